@@ -0,0 +1,177 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""The evaluation metrics of :mod:`tensorlayer.utils`, which only depend on numpy."""
+
+import numpy as np
+
+from . import _logging as logging
+
+
+class StreamingMetrics(object):
+    """The :class:`StreamingMetrics` class accumulates the evaluation metrics batch by batch, so the predictions
+    of the whole dataset never need to be kept in memory. The confusion matrix is accumulated by ``np.bincount``,
+    and the loss and accuracy are weighted by the number of examples of every batch, so a smaller final batch does
+    not bias the averages. The metrics of several workers can be merged by :meth:`merge`.
+
+    Parameters
+    ----------
+    n_classes : int or None
+        The number of classes, required to accumulate the confusion matrix.
+
+    Attributes
+    ----------
+    n_examples : int
+        The number of examples accumulated so far.
+    confusion_matrix : numpy.array or None
+        The ``[n_classes, n_classes]`` confusion matrix, rows are the targets and columns are the predictions.
+
+    Examples
+    --------
+    >>> metrics = tl.utils.StreamingMetrics(n_classes=10)
+    >>> for X_a, y_a in tl.iterate.minibatches(X_test, y_test, batch_size=500, allow_smaller_final_batch=True):
+    >>>     err, y_pred = sess.run([cost, y_op], feed_dict={x: X_a, y_: y_a})
+    >>>     metrics.update(y_true=y_a, y_pred=y_pred, loss=err)
+    >>> print(metrics.loss, metrics.acc, metrics.f1_macro)
+    >>> metrics.merge(metrics_of_another_worker)
+    """
+
+    def __init__(self, n_classes=None):
+        self.n_classes = n_classes
+        self.reset()
+
+    def reset(self):
+        """Clear all the accumulated metrics."""
+        self.n_examples = 0
+        self._loss_sum = 0.
+        self._acc_sum = 0.
+        self._n_loss = 0
+        self._n_acc = 0
+        self._n_correct = 0
+        self._n_pairs = 0
+        self.confusion_matrix = None if self.n_classes is None else np.zeros((self.n_classes, self.n_classes), dtype=np.int64)
+
+    def update(self, y_true=None, y_pred=None, loss=None, acc=None, n_examples=None):
+        """Accumulate the metrics of a batch.
+
+        Parameters
+        ----------
+        y_true : numpy.array or None
+            The target class ids of the batch.
+        y_pred : numpy.array or None
+            The predicted class ids of the batch. The confusion matrix is only updated if both ``y_true``
+            and ``y_pred`` are given, with the pairs of class ids in ``[0, n_classes)``, like the ``labels``
+            of ``sklearn.metrics.confusion_matrix``. The accuracy counts all the pairs.
+        loss : float or None
+            The mean loss of the batch.
+        acc : float or None
+            The mean accuracy (or other metric) of the batch.
+        n_examples : int or None
+            The number of examples of the batch, defaults is ``len(y_true)``, or 1 without ``y_true``.
+        """
+        if n_examples is None:
+            n_examples = len(y_true) if y_true is not None else 1
+        if y_true is not None and y_pred is not None:
+            if self.confusion_matrix is None:
+                raise Exception("n_classes is required to accumulate the confusion matrix")
+            y_true = np.asarray(y_true, dtype=np.int64).ravel()
+            y_pred = np.asarray(y_pred, dtype=np.int64).ravel()
+            n = self.n_classes
+            self._n_correct += int(np.count_nonzero(y_true == y_pred))
+            self._n_pairs += len(y_true)
+            valid = (y_true >= 0) & (y_true < n) & (y_pred >= 0) & (y_pred < n)
+            if not valid.all():
+                y_true, y_pred = y_true[valid], y_pred[valid]
+            self.confusion_matrix += np.bincount(n * y_true + y_pred, minlength=n * n).reshape(n, n)
+        if loss is not None:
+            self._loss_sum += float(loss) * n_examples
+            self._n_loss += n_examples
+        if acc is not None:
+            self._acc_sum += float(acc) * n_examples
+            self._n_acc += n_examples
+        self.n_examples += n_examples
+
+    def merge(self, other):
+        """Add the metrics accumulated by another :class:`StreamingMetrics`, e.g. of another worker."""
+        self.n_examples += other.n_examples
+        self._loss_sum += other._loss_sum
+        self._acc_sum += other._acc_sum
+        self._n_loss += other._n_loss
+        self._n_acc += other._n_acc
+        self._n_correct += other._n_correct
+        self._n_pairs += other._n_pairs
+        if other.confusion_matrix is not None:
+            if self.confusion_matrix is None:
+                self.n_classes = other.n_classes
+                self.confusion_matrix = np.zeros_like(other.confusion_matrix)
+            self.confusion_matrix += other.confusion_matrix
+        return self
+
+    @property
+    def loss(self):
+        """The mean loss over all the examples."""
+        return self._loss_sum / max(self._n_loss, 1)
+
+    @property
+    def acc(self):
+        """The mean accuracy over all the examples, from the class ids if no accuracy was given to :meth:`update`."""
+        if self._n_acc == 0 and self.confusion_matrix is not None:
+            return self._n_correct / float(max(self._n_pairs, 1))
+        return self._acc_sum / max(self._n_acc, 1)
+
+    @property
+    def precision(self):
+        """The precision of each class, 0 for the classes never predicted."""
+        return self._safe_divide(np.diag(self.confusion_matrix), self.confusion_matrix.sum(axis=0))
+
+    @property
+    def recall(self):
+        """The recall of each class, 0 for the classes without examples."""
+        return self._safe_divide(np.diag(self.confusion_matrix), self.confusion_matrix.sum(axis=1))
+
+    @property
+    def f1(self):
+        """The F1-score of each class."""
+        return self._safe_divide(2 * np.diag(self.confusion_matrix), self.confusion_matrix.sum(axis=0) + self.confusion_matrix.sum(axis=1))
+
+    @property
+    def f1_macro(self):
+        """The macro F1-score, i.e. the mean F1-score of the classes that appear in the targets or predictions."""
+        present = (self.confusion_matrix.sum(axis=0) + self.confusion_matrix.sum(axis=1)) > 0
+        return float(np.mean(self.f1[present])) if present.any() else 0.
+
+    @staticmethod
+    def _safe_divide(a, b):
+        return np.where(b > 0, a / np.maximum(b, 1).astype(np.float64), 0.)
+
+
+def evaluation(y_test=None, y_predict=None, n_classes=None):
+    """
+    Input the predicted results, targets results and
+    the number of class, return the confusion matrix, F1-score of each class,
+    accuracy and macro F1-score.
+
+    Parameters
+    ----------
+    y_test : numpy.array or list
+        target results
+    y_predict : numpy.array or list
+        predicted results
+    n_classes : int
+        number of classes
+
+    Examples
+    --------
+    >>> c_mat, f1, acc, f1_macro = evaluation(y_test, y_predict, n_classes)
+
+    Notes
+    -----
+    To evaluate a large dataset batch by batch, use :class:`StreamingMetrics`.
+    """
+    metrics = StreamingMetrics(n_classes)
+    metrics.update(y_true=y_test, y_pred=y_predict)
+    c_mat, f1, f1_macro, acc = metrics.confusion_matrix, metrics.f1, metrics.f1_macro, metrics.acc
+    logging.info('confusion matrix: \n%s' % c_mat)
+    logging.info('f1-score        : %s' % f1)
+    logging.info('f1-score(macro) : %f' % f1_macro)  # same output with > f1_score(y_true, y_pred, average='macro')
+    logging.info('accuracy-score  : %f' % acc)
+    return c_mat, f1, acc, f1_macro
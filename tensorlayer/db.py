@@ -6,6 +6,7 @@ Experimental Database Management System.
 Latest Version
 """
 
+import copy
 import inspect
 import math
 import pickle
@@ -486,12 +487,31 @@ class TensorDB(object):
     #     return data
 
 
-class DBLogger:
-    """ """
+class DBLogger(tl.utils.Callback):
+    """The :class:`DBLogger` class is a :class:`tl.utils.Callback` that saves the training logs and parameters
+    into TensorDB. It is asynchronous, so the database writes run on a background thread of ``tl.utils.fit``
+    and never block the training steps.
+
+    Parameters
+    ----------
+    db : :class:`TensorDB`
+    model : the model, its ``Params`` are saved at the end of every epoch. They are copied in the training
+        thread when the epoch ends, before the next epoch modifies them.
+    """
+
+    asynchronous = True
 
     def __init__(self, db, model):
+        tl.utils.Callback.__init__(self)
         self.db = db
         self.model = model
+        self.epoch = 0
+
+    def on_dispatch(self, name, args):
+        if name == 'on_epoch_end':
+            epoch, logs = args
+            return epoch, dict(logs, params=copy.deepcopy(self.model.Params))
+        return args
 
     def on_train_begin(self, logs={}):
         print("start")
@@ -508,13 +528,15 @@ class DBLogger:
         self.et = time.time() - self.et
         print("ending")
         print(epoch)
+        logs = dict(logs)
         logs['epoch'] = epoch
         logs['time'] = datetime.utcnow()
-        logs['stepTime'] = self.et
-        logs['acc'] = np.asscalar(logs['acc'])
+        logs['stepTime'] = logs.pop('epoch_time', self.et)
+        if 'acc' in logs:
+            logs['acc'] = float(logs['acc'])
+        w = logs.pop('params') if 'params' in logs else self.model.Params
         print(logs)
 
-        w = self.model.Params
         fid = self.db.save_params(w, logs)
         logs.update({'params': fid})
         self.db.valid_log(logs)
@@ -525,10 +547,15 @@ class DBLogger:
         self.batch = batch
 
     def on_batch_end(self, batch, logs={}):
+        if logs.get('size') == 0:
+            return  # the end of a graph-side input pipeline, no batch was trained
         self.t2 = time.time() - self.t
-        logs['acc'] = np.asscalar(logs['acc'])
-        #logs['loss']=np.asscalar(logs['loss'])
-        logs['step_time'] = self.t2
+        logs = dict(logs)
+        if 'acc' in logs:
+            logs['acc'] = float(logs['acc'])
+        if 'loss' in logs:
+            logs['loss'] = float(logs['loss'])
+        logs['step_time'] = logs.get('step_time', self.t2)
         logs['time'] = datetime.utcnow()
         logs['epoch'] = self.epoch
         logs['batch'] = self.batch
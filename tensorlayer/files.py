@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import array
+import bisect
 import gzip
+import hashlib
+import io
+import json
+import multiprocessing
 import os
 import pickle
 import re
+import shutil
+import struct
 import sys
 import tarfile
+import tempfile
+import threading
+import weakref
+import xml.etree.ElementTree as ET
 import zipfile
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import tensorflow as tf
-from six.moves import cPickle, urllib, zip
+from six.moves import cPickle, http_client, urllib, zip
 from tensorflow.python.platform import gfile
 
 from . import nlp, utils, visualize
@@ -18,10 +31,12 @@ from . import _logging as logging
 
 
 ## Load dataset functions
-def load_mnist_dataset(shape=(-1, 784), path="data"):
+def load_mnist_dataset(shape=(-1, 784), path="data", dtype=np.float32, lazy=False):
     """Automatically download MNIST dataset
     and return the training, validation and test set with 50000, 10000 and 10000
-    digit images respectively.
+    digit images respectively. The decoded images and labels are cached in ``mnist_cache.npz``
+    on first use, which is memory-mapped by the next calls. The float32 images are cached in
+    ``mnist_float32_cache.npz`` as well, which is memory-mapped copy-on-write, so the arrays are writable.
 
     Parameters
     ----------
@@ -29,11 +44,19 @@ def load_mnist_dataset(shape=(-1, 784), path="data"):
         The shape of digit images, defaults is (-1,784)
     path : string
         The path that the data is downloaded to, defaults is ``data/mnist/``.
+    dtype : numpy dtype
+        The dtype of the images, defaults is float32 in range [0, 1). With ``np.uint8``, the images are the
+        original bytes, memory-mapped from the cache without any conversion.
+    lazy : boolean
+        If True, the images are :class:`ScaledArray` of the memory-mapped bytes, which are converted to ``dtype``
+        batch by batch when they are indexed, e.g. by :func:`tl.iterate.minibatches`, instead of all at once.
 
     Examples
     --------
     >>> X_train, y_train, X_val, y_val, X_test, y_test = tl.files.load_mnist_dataset(shape=(-1,784))
     >>> X_train, y_train, X_val, y_val, X_test, y_test = tl.files.load_mnist_dataset(shape=(-1, 28, 28, 1))
+    - Keep 1/4 of the memory of the float32 images, the batches are float32
+    >>> X_train, y_train, X_val, y_val, X_test, y_test = tl.files.load_mnist_dataset(lazy=True)
     """
     path = os.path.join(path, 'mnist')
 
@@ -46,13 +69,8 @@ def load_mnist_dataset(shape=(-1, 784), path="data"):
         # Read the inputs in Yann LeCun's binary format.
         with gzip.open(filepath, 'rb') as f:
             data = np.frombuffer(f.read(), np.uint8, offset=16)
-        # The inputs are vectors now, we reshape them to monochrome 2D images,
-        # following the shape convention: (examples, channels, rows, columns)
-        data = data.reshape(shape)
-        # The inputs come as bytes, we convert them to float32 in range [0,1].
-        # (Actually to range [0, 255/256], for compatibility to the version
-        # provided at http://deeplearning.net/data/mnist/mnist.pkl.gz.)
-        return data / np.float32(256)
+        # The inputs are vectors of bytes, they are reshaped and converted when loaded.
+        return data.reshape(-1, 784)
 
     def load_mnist_labels(path, filename):
         filepath = maybe_download_and_extract(filename, path, 'http://yann.lecun.com/exdb/mnist/')
@@ -64,27 +82,40 @@ def load_mnist_dataset(shape=(-1, 784), path="data"):
 
     # Download and read the training and test set images and labels.
     logging.info("Load or Download MNIST > {}".format(path))
-    X_train = load_mnist_images(path, 'train-images-idx3-ubyte.gz')
-    y_train = load_mnist_labels(path, 'train-labels-idx1-ubyte.gz')
-    X_test = load_mnist_images(path, 't10k-images-idx3-ubyte.gz')
-    y_test = load_mnist_labels(path, 't10k-labels-idx1-ubyte.gz')
+    data = _load_dataset_cache(
+        path, 'mnist', lambda: {
+            'X_train': load_mnist_images(path, 'train-images-idx3-ubyte.gz'),
+            'y_train': load_mnist_labels(path, 'train-labels-idx1-ubyte.gz'),
+            'X_test': load_mnist_images(path, 't10k-images-idx3-ubyte.gz'),
+            'y_test': load_mnist_labels(path, 't10k-labels-idx1-ubyte.gz'),
+        })
+    if np.dtype(dtype) == np.float32 and not lazy:
+        # the float32 images are cached as well, so that the default dtype is not converted by every call
+        data = dict(data, **_load_float32_images_cache(path, 'mnist', data, ('X_train', 'X_test'), 1 / 256.))
+    # The inputs are reshaped, e.g. to monochrome 2D images (examples, rows, columns, channels).
+    X_train = data['X_train'].reshape(shape)
+    y_train = data['y_train']
+    X_test = data['X_test'].reshape(shape)
+    y_test = data['y_test']
 
     # We reserve the last 10000 training examples for validation.
     X_train, X_val = X_train[:-10000], X_train[-10000:]
     y_train, y_val = y_train[:-10000], y_train[-10000:]
 
+    # The inputs come as bytes, we convert them to float32 in range [0,1] in a single pass, unless they are cached.
+    # (Actually to range [0, 255/256], for compatibility to the version
+    # provided at http://deeplearning.net/data/mnist/mnist.pkl.gz.)
+    X_train, X_val, X_test = [_convert_images(X, 1 / 256., dtype, lazy) for X in (X_train, X_val, X_test)]
+
     # We just return all the arrays in order, as expected in main().
     # (It doesn't matter how we do this as long as we can read them again.)
-    X_train = np.asarray(X_train, dtype=np.float32)
     y_train = np.asarray(y_train, dtype=np.int32)
-    X_val = np.asarray(X_val, dtype=np.float32)
     y_val = np.asarray(y_val, dtype=np.int32)
-    X_test = np.asarray(X_test, dtype=np.float32)
     y_test = np.asarray(y_test, dtype=np.int32)
     return X_train, y_train, X_val, y_val, X_test, y_test
 
 
-def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, second=3):
+def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, second=3, dtype=np.float32, lazy=False):
     """The CIFAR-10 dataset consists of 60000 32x32 colour images in 10 classes, with
     6000 images per class. There are 50000 training images and 10000 test images.
 
@@ -93,6 +124,9 @@ def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, sec
     each class. The training batches contain the remaining images in random order,
     but some training batches may contain more images from one class than another.
     Between them, the training batches contain exactly 5000 images from each class.
+    The unpickled images and labels are cached in ``cifar10_cache.npz`` on first use,
+    which is memory-mapped by the next calls. The float32 images are cached in ``cifar10_float32_cache.npz``
+    as well, which is memory-mapped copy-on-write, so the arrays are writable.
 
     Parameters
     ----------
@@ -104,10 +138,18 @@ def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, sec
         If ``plotable`` is True, ``second`` is the display time.
     path : string
         The path that the data is downloaded to, defaults is ``data/cifar10/``.
+    dtype : numpy dtype
+        The dtype of the images, whose values are in range [0, 255], defaults is float32. With ``np.uint8``,
+        the images are memory-mapped from the cache without any conversion.
+    lazy : boolean
+        If True, the images are :class:`ScaledArray` of the memory-mapped bytes, which are converted to ``dtype``
+        batch by batch when they are indexed, e.g. by :func:`tl.iterate.minibatches`, instead of all at once.
 
     Examples
     --------
     >>> X_train, y_train, X_test, y_test = tl.files.load_cifar10_dataset(shape=(-1, 32, 32, 3))
+    - Keep 1/4 of the memory of the float32 images, the batches are float32
+    >>> X_train, y_train, X_test, y_test = tl.files.load_cifar10_dataset(shape=(-1, 32, 32, 3), lazy=True)
 
     References
     ----------
@@ -130,38 +172,34 @@ def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, sec
 
     filename = 'cifar-10-python.tar.gz'
     url = 'https://www.cs.toronto.edu/~kriz/'
-    #Download and uncompress file
-    maybe_download_and_extract(filename, path, url, extract=True)
-
-    #Unpickle file and fill in data
-    X_train = None
-    y_train = []
-    for i in range(1, 6):
-        data_dic = unpickle(os.path.join(path, 'cifar-10-batches-py/', "data_batch_{}".format(i)))
-        if i == 1:
-            X_train = data_dic['data']
-        else:
-            X_train = np.vstack((X_train, data_dic['data']))
-        y_train += data_dic['labels']
-
-    test_data_dic = unpickle(os.path.join(path, 'cifar-10-batches-py/', "test_batch"))
-    X_test = test_data_dic['data']
-    y_test = np.array(test_data_dic['labels'])
+    def load_cifar10_batches():
+        #Download and uncompress file
+        maybe_download_and_extract(filename, path, url, extract=True)
 
-    if shape == (-1, 3, 32, 32):
-        X_test = X_test.reshape(shape)
-        X_train = X_train.reshape(shape)
-    elif shape == (-1, 32, 32, 3):
-        X_test = X_test.reshape(shape, order='F')
-        X_train = X_train.reshape(shape, order='F')
-        X_test = np.transpose(X_test, (0, 2, 1, 3))
-        X_train = np.transpose(X_train, (0, 2, 1, 3))
+        #Unpickle file and fill in data
+        data_dics = [unpickle(os.path.join(path, 'cifar-10-batches-py/', "data_batch_{}".format(i))) for i in range(1, 6)]
+        test_data_dic = unpickle(os.path.join(path, 'cifar-10-batches-py/', "test_batch"))
+        return {
+            'X_train': np.concatenate([data_dic['data'] for data_dic in data_dics]),
+            'y_train': np.concatenate([data_dic['labels'] for data_dic in data_dics]).astype(np.int32),
+            'X_test': test_data_dic['data'],
+            'y_test': np.asarray(test_data_dic['labels'], dtype=np.int32),
+        }
+
+    data = _load_dataset_cache(path, 'cifar10', load_cifar10_batches)
+    if np.dtype(dtype) == np.float32 and not lazy:
+        # the float32 images are cached as well, so that the default dtype is not converted by every call
+        data = dict(data, **_load_float32_images_cache(path, 'cifar10', data, ('X_train', 'X_test'), 1))
+    X_train, y_train, X_test, y_test = data['X_train'], data['y_train'], data['X_test'], data['y_test']
+
+    if shape == (-1, 32, 32, 3):
+        # the rows are channel-major, they are viewed as (rows, columns, channels) without a copy
+        X_test = X_test.reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+        X_train = X_train.reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
     else:
         X_test = X_test.reshape(shape)
         X_train = X_train.reshape(shape)
 
-    y_train = np.array(y_train)
-
     if plotable == True:
         logging.info('\nCIFAR-10')
         import matplotlib.pyplot as plt
@@ -194,8 +232,8 @@ def load_cifar10_dataset(shape=(-1, 32, 32, 3), path='data', plotable=False, sec
         logging.info("X_test:  %s" % X_test.shape)
         logging.info("y_test:  %s" % y_test.shape)
 
-    X_train = np.asarray(X_train, dtype=np.float32)
-    X_test = np.asarray(X_test, dtype=np.float32)
+    X_train = _convert_images(X_train, 1, dtype, lazy)
+    X_test = _convert_images(X_test, 1, dtype, lazy)
     y_train = np.asarray(y_train, dtype=np.int32)
     y_test = np.asarray(y_test, dtype=np.int32)
 
@@ -207,7 +245,8 @@ def load_ptb_dataset(path='data'):
     including "Empirical Evaluation and Combination of Advanced Language
     Modeling Techniques", "Recurrent Neural Network Regularization".
     It consists of 929k training words, 73k validation words, and 82k test
-    words. It has 10k words in its vocabulary.
+    words. It has 10k words in its vocabulary. The word IDs are cached in ``ptb_cache.npz``
+    on first use.
 
     Parameters
     ----------
@@ -230,22 +269,30 @@ def load_ptb_dataset(path='data'):
     path = os.path.join(path, 'ptb')
     logging.info("Load or Download Penn TreeBank (PTB) dataset > {}".format(path))
 
-    #Maybe dowload and uncompress tar, or load exsisting files
-    filename = 'simple-examples.tgz'
-    url = 'http://www.fit.vutbr.cz/~imikolov/rnnlm/'
-    maybe_download_and_extract(filename, path, url, extract=True)
-
-    data_path = os.path.join(path, 'simple-examples', 'data')
-    train_path = os.path.join(data_path, "ptb.train.txt")
-    valid_path = os.path.join(data_path, "ptb.valid.txt")
-    test_path = os.path.join(data_path, "ptb.test.txt")
-
-    word_to_id = nlp.build_vocab(nlp.read_words(train_path))
+    def load_ptb_word_ids():
+        #Maybe dowload and uncompress tar, or load exsisting files
+        filename = 'simple-examples.tgz'
+        url = 'http://www.fit.vutbr.cz/~imikolov/rnnlm/'
+        maybe_download_and_extract(filename, path, url, extract=True)
 
-    train_data = nlp.words_to_word_ids(nlp.read_words(train_path), word_to_id)
-    valid_data = nlp.words_to_word_ids(nlp.read_words(valid_path), word_to_id)
-    test_data = nlp.words_to_word_ids(nlp.read_words(test_path), word_to_id)
-    vocabulary = len(word_to_id)
+        data_path = os.path.join(path, 'simple-examples', 'data')
+        train_path = os.path.join(data_path, "ptb.train.txt")
+        valid_path = os.path.join(data_path, "ptb.valid.txt")
+        test_path = os.path.join(data_path, "ptb.test.txt")
+
+        word_to_id = nlp.build_vocab(nlp.read_words(train_path))
+        return {
+            'train': np.asarray(nlp.words_to_word_ids(nlp.read_words(train_path), word_to_id), dtype=np.int32),
+            'valid': np.asarray(nlp.words_to_word_ids(nlp.read_words(valid_path), word_to_id), dtype=np.int32),
+            'test': np.asarray(nlp.words_to_word_ids(nlp.read_words(test_path), word_to_id), dtype=np.int32),
+            'vocabulary': np.asarray([len(word_to_id)], dtype=np.int64),
+        }
+
+    data = _load_dataset_cache(path, 'ptb', load_ptb_word_ids)
+    train_data = data['train'].tolist()
+    valid_data = data['valid'].tolist()
+    test_data = data['test'].tolist()
+    vocabulary = int(data['vocabulary'][0])
 
     # logging.info(nlp.read_words(train_path)) # ... 'according', 'to', 'mr.', '<unk>', '<eos>']
     # logging.info(train_data)                 # ...  214,         5,    23,    1,       2]
@@ -259,7 +306,8 @@ def load_matt_mahoney_text8_dataset(path='data'):
     """Download a text file from Matt Mahoney's website
     if not present, and make sure it's the right size.
     Extract the first file enclosed in a zip file as a list of words.
-    This dataset can be used for Word Embedding.
+    This dataset can be used for Word Embedding. The words are cached in ``text8_cache.npz``
+    as a vocabulary and word IDs on first use.
 
     Parameters
     ----------
@@ -280,14 +328,21 @@ def load_matt_mahoney_text8_dataset(path='data'):
     path = os.path.join(path, 'mm_test8')
     logging.info("Load or Download matt_mahoney_text8 Dataset> {}".format(path))
 
-    filename = 'text8.zip'
-    url = 'http://mattmahoney.net/dc/'
-    maybe_download_and_extract(filename, path, url, expected_bytes=31344016)
-
-    with zipfile.ZipFile(os.path.join(path, filename)) as f:
-        word_list = f.read(f.namelist()[0]).split()
-        for idx, word in enumerate(word_list):
-            word_list[idx] = word_list[idx].decode()
+    def load_text8_word_ids():
+        filename = 'text8.zip'
+        url = 'http://mattmahoney.net/dc/'
+        maybe_download_and_extract(filename, path, url, expected_bytes=31344016)
+
+        with zipfile.ZipFile(os.path.join(path, filename)) as f:
+            word_list = f.read(f.namelist()[0]).split()
+        word_to_id = {}
+        word_ids = [word_to_id.setdefault(word, len(word_to_id)) for word in word_list]
+        vocabulary = [word.decode() for word in sorted(word_to_id, key=word_to_id.get)]
+        return {'vocabulary': _encode_lines(vocabulary), 'word_ids': np.asarray(word_ids, dtype=np.int32)}
+
+    data = _load_dataset_cache(path, 'text8', load_text8_word_ids)
+    vocabulary = _decode_lines(data['vocabulary'])
+    word_list = list(map(vocabulary.__getitem__, data['word_ids'].tolist()))
     return word_list
 
 
@@ -298,6 +353,8 @@ def load_imdb_dataset(path='data', nb_words=None, skip_top=0, maxlen=None, test_
     ----------
     path : : string
         The path that the data is downloaded to, defaults is ``data/imdb/``.
+        The unpickled sequences are cached in ``imdb_cache.npz`` on first use, and are
+        shuffled, filtered and mapped with numpy from the cache.
 
     Examples
     --------
@@ -314,65 +371,244 @@ def load_imdb_dataset(path='data', nb_words=None, skip_top=0, maxlen=None, test_
     """
     path = os.path.join(path, 'imdb')
 
-    filename = "imdb.pkl"
-    url = 'https://s3.amazonaws.com/text-datasets/'
-    maybe_download_and_extract(filename, path, url)
-
-    if filename.endswith(".gz"):
-        f = gzip.open(os.path.join(path, filename), 'rb')
-    else:
-        f = open(os.path.join(path, filename), 'rb')
+    def load_imdb_sequences():
+        filename = "imdb.pkl"
+        url = 'https://s3.amazonaws.com/text-datasets/'
+        maybe_download_and_extract(filename, path, url)
 
-    X, labels = cPickle.load(f)
-    f.close()
-
-    np.random.seed(seed)
-    np.random.shuffle(X)
+        if filename.endswith(".gz"):
+            f = gzip.open(os.path.join(path, filename), 'rb')
+        else:
+            f = open(os.path.join(path, filename), 'rb')
+
+        X, labels = cPickle.load(f)
+        f.close()
+        # the sequences are stored end to end, the i-th one is tokens[offsets[i]:offsets[i + 1]]
+        return {
+            'tokens': np.fromiter((w for x in X for w in x), dtype=np.int32),
+            'offsets': np.cumsum([0] + [len(x) for x in X], dtype=np.int64),
+            'labels': np.asarray(labels),
+        }
+
+    data = _load_dataset_cache(path, 'imdb', load_imdb_sequences)
+    offsets = data['offsets']
+    lengths = np.diff(offsets)
+
+    # shuffle the sequences and the labels in the same order
+    order = np.arange(len(lengths))
     np.random.seed(seed)
-    np.random.shuffle(labels)
+    np.random.shuffle(order)
+    labels = np.asarray(data['labels'])[order]
+    lengths = lengths[order]
+    ends = np.cumsum(lengths)
+    X = data['tokens'][np.repeat(offsets[:-1][order] - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)].astype(np.int64)
 
     if start_char is not None:
-        X = [[start_char] + [w + index_from for w in x] for x in X]
+        X = np.insert(X + index_from, ends - lengths, start_char)
+        lengths = lengths + 1
     elif index_from:
-        X = [[w + index_from for w in x] for x in X]
+        X = X + index_from
 
     if maxlen:
-        new_X = []
-        new_labels = []
-        for x, y in zip(X, labels):
-            if len(x) < maxlen:
-                new_X.append(x)
-                new_labels.append(y)
-        X = new_X
-        labels = new_labels
-    if not X:
+        keep = lengths < maxlen
+        X = X[np.repeat(keep, lengths)]
+        lengths = lengths[keep]
+        labels = labels[keep]
+    if not len(lengths):
         raise Exception('After filtering for sequences shorter than maxlen=' + str(maxlen) + ', no sequence was kept. ' 'Increase maxlen.')
     if not nb_words:
-        nb_words = max([max(x) for x in X])
+        nb_words = X.max()
 
     # by convention, use 2 as OOV word
     # reserve 'index_from' (=3 by default) characters: 0 (padding), 1 (start), 2 (OOV)
+    oov = (X >= nb_words) | (X < skip_top)
     if oov_char is not None:
-        X = [[oov_char if (w >= nb_words or w < skip_top) else w for w in x] for x in X]
+        X = np.where(oov, oov_char, X)
     else:
-        nX = []
-        for x in X:
-            nx = []
-            for w in x:
-                if (w >= nb_words or w < skip_top):
-                    nx.append(w)
-            nX.append(nx)
-        X = nX
+        lengths = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[oov], minlength=len(lengths))
+        X = X[oov]
+
+    tokens, ends = X.tolist(), np.cumsum(lengths).tolist()
+    X = _object_array([tokens[end - length:end] for end, length in zip(ends, lengths.tolist())])
 
-    X_train = np.array(X[:int(len(X) * (1 - test_split))])
-    y_train = np.array(labels[:int(len(X) * (1 - test_split))])
+    X_train = X[:int(len(X) * (1 - test_split))]
+    y_train = labels[:int(len(X) * (1 - test_split))]
 
-    X_test = np.array(X[int(len(X) * (1 - test_split)):])
-    y_test = np.array(labels[int(len(X) * (1 - test_split)):])
+    X_test = X[int(len(X) * (1 - test_split)):]
+    y_test = labels[int(len(X) * (1 - test_split)):]
 
     return X_train, y_train, X_test, y_test
 
 
+def _load_dataset_cache(path, name, load, key=None, mode='r'):
+    """Return the dict of arrays cached in ``path/name_cache.npz``, which are memory-mapped with the ``np.memmap``
+    ``mode``. On first use, the arrays are returned by ``load()`` and written into the cache, unless ``path`` is
+    not writable. If ``key`` is given, e.g. the hash of the source files, it is stored in the cache as ``cache_key``,
+    and a cache with another key is rebuilt."""
+    cache = os.path.join(path, name + '_cache.npz')
+    if os.path.exists(cache):
+        arrays = _load_npz_arrays(cache, mmap=True, mode=mode)
+        if key is None or ('cache_key' in arrays and _decode_lines(arrays['cache_key']) == [key]):
+            return arrays
+        logging.info("[*] %s is outdated, rebuilding it" % cache)
+    arrays = load()
+    if key is not None:
+        arrays['cache_key'] = _encode_lines([key])
+    try:
+        _atomic_write(cache, lambda f: _write_npz_entries(f, sorted(arrays.items())))
+    except (IOError, OSError) as e:
+        logging.info("[!] Fail to cache %s: %s" % (cache, e))
+        return arrays
+    logging.info("[*] %s saved" % cache)
+    return _load_npz_arrays(cache, mmap=True, mode=mode)
+
+
+def _load_float32_images_cache(path, name, data, keys, scale):
+    """Return the uint8 images ``data[key]`` of the dataset cache ``name`` multiplied by ``scale`` in float32.
+    They are cached in ``path/name_float32_cache.npz`` on first use, and memory-mapped copy-on-write by the
+    next calls, so they are writable but never converted again. The cache is rebuilt with the dataset cache."""
+
+    def convert():
+        return {key: _convert_images(data[key], scale, np.float32, False) for key in keys}
+
+    cache = os.path.join(path, name + '_cache.npz')
+    if not os.path.exists(cache):  # the dataset cache could not be written
+        return convert()
+    return _load_dataset_cache(path, name + '_float32', convert, key='%s:%r' % (_files_key([cache]), scale), mode='c')
+
+
+def _files_key(files):
+    """Return a cache key of the files, which changes when a file is added, removed, or rewritten in place:
+    the number of files and the hash of their names, sizes and modification times."""
+    digest = hashlib.sha256()
+    for name in files:
+        st = os.stat(name)
+        mtime_ns = getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+        digest.update(('%s\t%d\t%d\n' % (os.path.basename(name), st.st_size, mtime_ns)).encode('utf-8'))
+    return '%d:%s' % (len(files), digest.hexdigest())
+
+
+def _encode_lines(strings):
+    """Return the strings as the uint8 array of their newline separated utf-8 bytes, to be cached."""
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_lines(array):
+    """Return the strings of an array written by :func:`_encode_lines`."""
+    return array.tobytes().decode('utf-8').split('\n') if len(array) else []
+
+
+def _build_tag_index(images, tag_files, n_threads=50):
+    """Return the arrays of the inverted index of the tags of ``images``, whose i-th tag file has the tags of
+    the i-th image, one per line: the sorted ``tags``, and the ids of the images with the i-th tag in
+    ``image_ids[tag_offsets[i]:tag_offsets[i + 1]]``. The tag files are read by ``n_threads`` threads."""
+    tag_to_id, tag_ids, image_ids = {}, array.array('i'), array.array('i')
+    pool = ThreadPool(n_threads)
+    try:
+        for image_id, text in enumerate(pool.imap(read_file, tag_files, chunksize=64)):
+            for tag in set(text.split('\n')):
+                if tag:
+                    tag_ids.append(tag_to_id.setdefault(tag, len(tag_to_id)))
+                    image_ids.append(image_id)
+    finally:
+        pool.terminate()
+    tags = sorted(tag_to_id)
+    ranks = np.empty(len(tags), dtype=np.int64)
+    ranks[[tag_to_id[tag] for tag in tags]] = np.arange(len(tags))
+    ranks = ranks[np.asarray(tag_ids, dtype=np.int64)]
+    return {
+        'images': _encode_lines(images),
+        'tags': _encode_lines(tags),
+        'tag_offsets': np.concatenate([[0], np.cumsum(np.bincount(ranks, minlength=len(tags)))]).astype(np.int64),
+        # a stable sort keeps the images of a tag in order
+        'image_ids': np.asarray(image_ids, dtype=np.int32)[np.argsort(ranks, kind='mergesort')],
+    }
+
+
+def _query_tag_index(index, tag):
+    """Return the images of an index built by :func:`_build_tag_index` with ``tag``, or all of them if it is None."""
+    images = _decode_lines(index['images'])
+    if tag is None:
+        return images
+    tags = _decode_lines(index['tags'])
+    idx = bisect.bisect_left(tags, tag)
+    if idx == len(tags) or tags[idx] != tag:
+        return []
+    offsets = index['tag_offsets']
+    return [images[image_id] for image_id in index['image_ids'][offsets[idx]:offsets[idx + 1]].tolist()]
+
+
+def _convert_images(images, scale, dtype, lazy):
+    """Return the ``images`` as is if they are of ``dtype``, e.g. uint8 or the images of
+    :func:`_load_float32_images_cache`, otherwise multiplied by ``scale`` into a contiguous array of ``dtype``,
+    or into a :class:`ScaledArray` if ``lazy`` is True."""
+    if images.dtype == np.dtype(dtype):
+        return images
+    if lazy:
+        return ScaledArray(images, scale, dtype)
+    return np.multiply(images, scale, out=np.empty(images.shape, dtype=dtype))
+
+
+class ScaledArray(object):
+    """A read-only array of ``data * scale`` in ``dtype``, which converts only the examples it is indexed by.
+    It keeps a dataset in a compact dtype, e.g. memory-mapped uint8 images, and returns the batches of
+    :func:`tl.iterate.minibatches`, :class:`tl.iterate.MinibatchIterator` and :func:`tl.utils.fit` in ``dtype``.
+
+    Parameters
+    ----------
+    data : numpy.array or numpy.memmap
+        The data, every row is a example.
+    scale : float
+        The factor the data is multiplied by.
+    dtype : numpy dtype
+        The dtype of the indexed examples, default is float32.
+
+    Examples
+    --------
+    >>> X_train, y_train, X_val, y_val, X_test, y_test = tl.files.load_mnist_dataset(shape=(-1, 784), lazy=True)
+    >>> print(X_train.shape, X_train.dtype, X_train.data.dtype)
+    ... (50000, 784) float32 uint8
+    >>> for X_a, y_a in tl.iterate.minibatches(X_train, y_train, batch_size=128, shuffle=True):
+    >>>     print(X_a.dtype)
+    ... float32
+    """
+
+    def __init__(self, data, scale=1., dtype=np.float32):
+        self.data = data
+        self.scale = scale
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        data = np.asarray(self.data[index])
+        return np.multiply(data, self.scale, out=np.empty(data.shape, dtype=self.dtype))
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype)
+
+    def reshape(self, *shape):
+        return ScaledArray(self.data.reshape(*shape), self.scale, self.dtype)
+
+
+def _object_array(values):
+    """Return a 1-D object array of the given lists, which ``np.array`` would stack if they have the same length."""
+    array = np.empty(len(values), dtype=object)
+    for idx, value in enumerate(values):
+        array[idx] = value
+    return array
+
+
 def load_nietzsche_dataset(path='data'):
     """Load Nietzsche dataset.
     Returns a string.
@@ -467,7 +703,7 @@ def load_wmt_en_fr_dataset(path='data'):
     return train_path, dev_path
 
 
-def load_flickr25k_dataset(tag='sky', path="data", n_threads=50, printable=False):
+def load_flickr25k_dataset(tag='sky', path="data", n_threads=50, printable=False, n_processes=None, stream=False):
     """Returns a list of images by a given tag from Flick25k dataset,
     it will download Flickr25k from `the official website <http://press.liacs.nl/mirflickr/mirdownload.html>`_
     at the first time you use it.
@@ -479,8 +715,12 @@ def load_flickr25k_dataset(tag='sky', path="data", n_threads=50, printable=False
         If you want to get all images, set to ``None``.
     path : string
         The path that the data is downloaded to, defaults is ``data/flickr25k/``.
-    n_threads : int, number of thread to read image.
+    n_threads : int, number of threads to read the tag files when the tag index is built.
+        The images are not read by these threads anymore, but decoded by ``n_processes`` processes.
     printable : bool, print infomation when reading images, default is ``False``.
+    n_processes : int or None, number of processes to decode images, default is the number of CPUs,
+        see :func:`tl.visualize.stream_images`.
+    stream : bool, if True, returns a generator of the images in the order they are decoded, default is ``False``.
 
     Examples
     -----------
@@ -489,6 +729,15 @@ def load_flickr25k_dataset(tag='sky', path="data", n_threads=50, printable=False
 
     - Get all images
     >>> images = tl.files.load_flickr25k_dataset(tag=None, n_threads=100, printable=True)
+
+    - Use the images while the next ones are decoded
+    >>> for image in tl.files.load_flickr25k_dataset(tag='sky', stream=True):
+    >>>     ...
+
+    Notes
+    ------
+    An inverted index of the tags is saved into ``flickr25k_tags_cache.npz`` the first time, so that
+    the next queries do not read the tag files. The index is rebuilt if a tag file is added, removed or edited.
     """
     path = os.path.join(path, 'flickr25k')
 
@@ -500,33 +749,35 @@ def load_flickr25k_dataset(tag='sky', path="data", n_threads=50, printable=False
         maybe_download_and_extract(filename, path, url, extract=True)
         del_file(path + '/' + filename)
     ## return images by the given tag.
-    # 1. image path list
     folder_imgs = path + "/mirflickr"
-    path_imgs = load_file_list(path=folder_imgs, regx='\\.jpg', printable=False)
-    path_imgs.sort(key=natural_keys)
-    # logging.info(path_imgs[0:10])
-    # 2. tag path list
+    # 1. tag path list
     folder_tags = path + "/mirflickr/meta/tags"
     path_tags = load_file_list(path=folder_tags, regx='\\.txt', printable=False)
     path_tags.sort(key=natural_keys)
     # logging.info(path_tags[0:10])
+    tag_files = [folder_tags + '/' + path_tag for path_tag in path_tags]
+
+    def index_flickr25k_tags():
+        # 2. image path list
+        path_imgs = load_file_list(path=folder_imgs, regx='\\.jpg', printable=False)
+        path_imgs.sort(key=natural_keys)
+        # logging.info(path_imgs[0:10])
+        logging.info("[Flickr25k] indexing the tags of {} images".format(len(path_tags)))
+        return _build_tag_index(path_imgs, tag_files, n_threads)
+
     # 3. select images
     if tag is None:
         logging.info("[Flickr25k] reading all images")
     else:
         logging.info("[Flickr25k] reading images with tag: {}".format(tag))
-    images_list = []
-    for idx in range(0, len(path_tags)):
-        tags = read_file(folder_tags + '/' + path_tags[idx]).split('\n')
-        # logging.info(idx+1, tags)
-        if tag is None or tag in tags:
-            images_list.append(path_imgs[idx])
+    # the index is rebuilt if a tag file is added, removed or edited since it was built
+    images_list = _query_tag_index(_load_dataset_cache(path, 'flickr25k_tags', index_flickr25k_tags, key=_files_key(tag_files)), tag)
 
-    images = visualize.read_images(images_list, folder_imgs, n_threads=n_threads, printable=printable)
-    return images
+    images = visualize.stream_images(images_list, folder_imgs, n_processes=n_processes, printable=printable)
+    return images if stream else list(images)
 
 
-def load_flickr1M_dataset(tag='sky', size=10, path="data", n_threads=50, printable=False):
+def load_flickr1M_dataset(tag='sky', size=10, path="data", n_threads=50, printable=False, n_processes=None, stream=False):
     """Returns a list of images by a given tag from Flickr1M dataset,
     it will download Flickr1M from `the official website <http://press.liacs.nl/mirflickr/mirdownload.html>`_
     at the first time you use it.
@@ -540,8 +791,12 @@ def load_flickr1M_dataset(tag='sky', size=10, path="data", n_threads=50, printab
         1 means 100k images ... 5 means 500k images, 10 means all 1 million images. Default is 10.
     path : string
         The path that the data is downloaded to, defaults is ``data/flickr25k/``.
-    n_threads : int, number of thread to read image.
+    n_threads : int, number of threads to read the tag files when the tag index is built.
+        The images are not read by these threads anymore, but decoded by ``n_processes`` processes.
     printable : bool, print infomation when reading images, default is ``False``.
+    n_processes : int or None, number of processes to decode images, default is the number of CPUs,
+        see :func:`tl.visualize.stream_images`.
+    stream : bool, if True, returns a generator of the images in the order they are decoded, default is ``False``.
 
     Examples
     ----------
@@ -550,6 +805,12 @@ def load_flickr1M_dataset(tag='sky', size=10, path="data", n_threads=50, printab
 
     - Use 1 Million images
     >>> images = tl.files.load_flickr1M_dataset(tag='zebra')
+
+    Notes
+    ------
+    An inverted index of the tags is saved into ``flickr1M_tags<size>_cache.npz`` the first time, so that
+    the next queries do not list the images nor read the tag files. The index is rebuilt if a tag file is added,
+    removed or edited.
     """
     path = os.path.join(path, 'flickr1M')
     logging.info("[Flickr1M] using {}% of images = {}".format(size * 10, size * 100000))
@@ -578,44 +839,39 @@ def load_flickr1M_dataset(tag='sky', size=10, path="data", n_threads=50, printab
     else:
         logging.info("[Flickr1M] tags exists in {}".format(path))
 
-    ## 1. image path list
-    images_list = []
-    images_folder_list = []
-    for i in range(0, size):
-        images_folder_list += load_folder_list(path=path + '/images%d' % i)
-    images_folder_list.sort(key=lambda s: int(s.split('/')[-1]))  # folder/images/ddd
-    # logging.info(images_folder_list)
-    # exit()
-    for folder in images_folder_list[0:size * 10]:
-        tmp = load_file_list(path=folder, regx='\\.jpg', printable=False)
-        tmp.sort(key=lambda s: int(s.split('.')[-2]))  # ddd.jpg
-        # logging.info(tmp[0::570])
-        images_list.extend([folder + '/' + x for x in tmp])
-    # logging.info('IM', len(images_list), images_list[0::6000])
-    ## 2. tag path list
+    ## 1. tag path list
     tag_list = []
     tag_folder_list = load_folder_list(path + "/tags")
     tag_folder_list.sort(key=lambda s: int(s.split('/')[-1]))  # folder/images/ddd
 
     for folder in tag_folder_list[0:size * 10]:
-        # logging.info(folder)
         tmp = load_file_list(path=folder, regx='\\.txt', printable=False)
         tmp.sort(key=lambda s: int(s.split('.')[-2]))  # ddd.txt
         tmp = [folder + '/' + s for s in tmp]
         tag_list += tmp
-    # logging.info('T', len(tag_list), tag_list[0::6000])
-    # exit()
+
+    def index_flickr1M_tags():
+        ## 2. image path list
+        images_list = []
+        images_folder_list = []
+        for i in range(0, size):
+            images_folder_list += load_folder_list(path=path + '/images%d' % i)
+        images_folder_list.sort(key=lambda s: int(s.split('/')[-1]))  # folder/images/ddd
+        for folder in images_folder_list[0:size * 10]:
+            tmp = load_file_list(path=folder, regx='\\.jpg', printable=False)
+            tmp.sort(key=lambda s: int(s.split('.')[-2]))  # ddd.jpg
+            # the images are indexed relatively to path
+            images_list.extend([os.path.relpath(folder, path) + '/' + x for x in tmp])
+        logging.info("[Flickr1M] indexing the tags of {} images".format(len(tag_list)))
+        return _build_tag_index(images_list, tag_list, n_threads)
+
     ## 3. select images
     logging.info("[Flickr1M] searching tag: {}".format(tag))
-    select_images_list = []
-    for idx in range(0, len(tag_list)):
-        tags = read_file(tag_list[idx]).split('\n')
-        if tag in tags:
-            select_images_list.append(images_list[idx])
-            # logging.info(idx, tags, tag_list[idx], images_list[idx])
+    # the index is rebuilt if a tag file is added, removed or edited since it was built
+    select_images_list = _query_tag_index(_load_dataset_cache(path, 'flickr1M_tags%d' % size, index_flickr1M_tags, key=_files_key(tag_list)), tag)
     logging.info("[Flickr1M] reading images with tag: {}".format(tag))
-    images = visualize.read_images(select_images_list, '', n_threads=n_threads, printable=printable)
-    return images
+    images = visualize.stream_images(select_images_list, path, n_processes=n_processes, printable=printable)
+    return images if stream else list(images)
 
 
 def load_cyclegan_dataset(filename='summer2winter_yosemite', path='data'):
@@ -725,7 +981,7 @@ def load_celebA_dataset(dirpath='data'):
     return data_files
 
 
-def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=False):
+def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=False, structured=False, n_processes=None):
     """ Pascal VOC 2007/2012 Dataset has 20 objects : aeroplane, bicycle, bird, boat, bottle, bus, car, cat, chair, cow, diningtable, dog, horse, motorbike, person, pottedplant, sheep, sofa, train, tvmonitor and additional 3 classes : head, hand, foot for person.
 
     Parameters
@@ -735,6 +991,9 @@ def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=Fals
     dataset : string, 2012, 2007, 2007test or 2012test.
         The VOC dataset version, we usually train model on 2007+2012 and test it on 2007test.
     contain_classes_in_person : If True, dataset will contains labels of head, hand and foot.
+    structured : If True, ``objs_info_list`` contains arrays instead of Darknet format strings.
+    n_processes : int or None, number of processes to parse the XML annotations the first time, default is the number of CPUs.
+        With 0, the annotations are parsed in the calling process.
 
     Returns
     ---------
@@ -756,6 +1015,8 @@ def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=Fals
         Number of objects in all images in ``imgs_file_list` in order.
     objs_info_list : list of string.
         Darknet format for the annotation of all images in ``imgs_file_list`` in order. ``[class_id x_centre y_centre width height]`` in ratio format.
+        If ``structured`` is True, ``(class_ids, boxes)`` of all images instead, an int32 array of ``n_objs`` class ids and
+        a float32 array of ``[n_objs, 4]`` ``[x_centre y_centre width height]`` in ratio format.
     objs_info_dicts : dictionary.
         ``{imgs_file_list : dictionary for annotation}``, the annotation of all images in ``imgs_file_list``,
         format from `TensorFlow/Models/object-detection <https://github.com/tensorflow/models/blob/master/object_detection/create_pascal_tf_record.py>`_.
@@ -785,6 +1046,17 @@ def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=Fals
     >>> c, b = tl.prepro.parse_darknet_ann_list_to_cls_box(ann)
     >>> print(c, b)
     ... [14, 14] [[0.173, 0.461333333333, 0.142, 0.496], [0.828, 0.542666666667, 0.188, 0.594666666667]]
+    - Get the classes and boxes as arrays
+    >>> ..., n_objs_list, objs_info_list, objs_info_dicts = tl.files.load_voc_dataset(dataset="2012", structured=True)
+    >>> c, b = objs_info_list[idx]
+    >>> print(c, b)
+    ... [14 14] [[0.173      0.46133333 0.142      0.496     ]
+    ...  [0.828      0.54266665 0.188      0.59466666]]
+
+    Notes
+    -------
+    The parsed annotations are cached in ``VOC/voc_<dataset>_cache.npz`` the first time, as the class ids, the boxes
+    and the offsets of the objects of every image, so that the next calls do not parse the XML files.
 
     References
     -------------
@@ -794,34 +1066,6 @@ def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=Fals
     """
     path = os.path.join(path, 'VOC')
 
-    def _recursive_parse_xml_to_dict(xml):
-        """Recursively parses XML contents to python dict.
-      We assume that `object` tags are the only ones that can appear
-      multiple times at the same level of a tree.
-
-      Args:
-        xml: xml tree obtained by parsing XML file contents using lxml.etree
-
-      Returns:
-        Python dictionary holding XML contents.
-      """
-        if not xml:
-            # if xml is not None:
-            return {xml.tag: xml.text}
-        result = {}
-        for child in xml:
-            child_result = _recursive_parse_xml_to_dict(child)
-            if child.tag != 'object':
-                result[child.tag] = child_result[child.tag]
-            else:
-                if child.tag not in result:
-                    result[child.tag] = []
-                result[child.tag].append(child_result[child.tag])
-        return {xml.tag: result}
-
-    from lxml import etree  # pip install lxml
-    import xml.etree.ElementTree as ET
-
     ##
     if dataset == "2012":
         url = "http://host.robots.ox.ac.uk/pascal/VOC/voc2012/"
@@ -946,86 +1190,99 @@ def load_voc_dataset(path='data', dataset='2012', contain_classes_in_person=Fals
         logging.info("[VOC] keep %d images" % len(imgs_file_list_new))
 
     ##======== parse XML annotations
-    def convert(size, box):
-        dw = 1. / size[0]
-        dh = 1. / size[1]
-        x = (box[0] + box[1]) / 2.0
-        y = (box[2] + box[3]) / 2.0
-        w = box[1] - box[0]
-        h = box[3] - box[2]
-        x = x * dw
-        w = w * dw
-        y = y * dh
-        h = h * dh
-        return (x, y, w, h)
-
-    def convert_annotation(file_name):
-        """ Given VOC2012 XML Annotations, returns number of objects and info. """
-        in_file = open(file_name)
-        out_file = ""
-        tree = ET.parse(in_file)
-        root = tree.getroot()
-        size = root.find('size')
-        w = int(size.find('width').text)
-        h = int(size.find('height').text)
-        n_objs = 0
-
-        # logging.info(file_name, w, h, size)
-        # exit()
-        for obj in root.iter('object'):
-            if dataset != "2012test":
-                difficult = obj.find('difficult').text
-                cls = obj.find('name').text
-                if cls not in classes or int(difficult) == 1:
-                    continue
-            else:
-                cls = obj.find('name').text
-                if cls not in classes:
-                    continue
-            cls_id = classes.index(cls)
-            xmlbox = obj.find('bndbox')
-            b = (float(xmlbox.find('xmin').text), float(xmlbox.find('xmax').text), float(xmlbox.find('ymin').text), float(xmlbox.find('ymax').text))
-            bb = convert((w, h), b)
-            # out_file.write(str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n')
-            out_file += str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n'
-            n_objs += 1
-            if cls in "person":
-                for part in obj.iter('part'):
-                    cls = part.find('name').text
-                    if cls not in classes_in_person:
-                        continue
-                    cls_id = classes.index(cls)
-                    xmlbox = part.find('bndbox')
-                    b = (float(xmlbox.find('xmin').text), float(xmlbox.find('xmax').text), float(xmlbox.find('ymin').text), float(xmlbox.find('ymax').text))
-                    bb = convert((w, h), b)
-                    # out_file.write(str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n')
-                    out_file += str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n'
-                    n_objs += 1
-        in_file.close()
-        return n_objs, out_file
-
-    logging.info("[VOC] Parsing xml annotations files")
-    n_objs_list = []
-    objs_info_list = []  # Darknet Format list of string
-    objs_info_dicts = {}
-    for idx, ann_file in enumerate(imgs_ann_file_list):
-        # logging.info(ann_file)
-        n_objs, objs_info = convert_annotation(ann_file)
-        n_objs_list.append(n_objs)
-        objs_info_list.append(objs_info)
-        with tf.gfile.GFile(ann_file, 'r') as fid:
-            xml_str = fid.read()
-        xml = etree.fromstring(xml_str)
-        data = _recursive_parse_xml_to_dict(xml)['annotation']
-        objs_info_dicts.update({imgs_file_list[idx]: data})
+    def parse_voc_annotations():
+        logging.info("[VOC] Parsing xml annotations files")
+        tasks = [(ann_file, classes, classes_in_person, dataset != "2012test") for ann_file in imgs_ann_file_list]
+        if n_processes == 0:
+            results = [_parse_voc_annotation(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(n_processes or multiprocessing.cpu_count())
+            try:
+                results = pool.map(_parse_voc_annotation, tasks, chunksize=64)
+            finally:
+                pool.terminate()
+        return {
+            'offsets': np.cumsum([0] + [len(class_ids) for class_ids, _, _ in results], dtype=np.int64),
+            'classes': np.asarray([class_id for class_ids, _, _ in results for class_id in class_ids], dtype=np.int32),
+            'boxes': np.asarray([box for _, boxes, _ in results for box in boxes], dtype=np.float32).reshape(-1, 4),
+            'annotations': np.frombuffer(json.dumps([annotation for _, _, annotation in results]).encode('utf-8'), dtype=np.uint8),
+        }
+
+    # the cache is rebuilt if an annotation file is added, removed or edited since it was parsed
+    data = _load_dataset_cache(
+        path, 'voc_%s%s' % (dataset, '_person' if contain_classes_in_person else ''), parse_voc_annotations, key=_files_key(imgs_ann_file_list)
+    )
+    offsets = data['offsets'].tolist()
+    n_objs_list = np.diff(data['offsets']).tolist()
+    if structured:
+        objs_info_list = [(data['classes'][start:end], data['boxes'][start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+    else:
+        # Darknet Format list of string
+        lines = [class_id + " " + " ".join(box) + '\n' for class_id, box in zip(data['classes'].astype(str).tolist(), data['boxes'].astype(str).tolist())]
+        objs_info_list = ["".join(lines[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+    objs_info_dicts = dict(zip(imgs_file_list, json.loads(data['annotations'].tobytes().decode('utf-8'))))
 
     return imgs_file_list, imgs_semseg_file_list, imgs_insseg_file_list, imgs_ann_file_list, \
         classes, classes_in_person, classes_dict,\
         n_objs_list, objs_info_list, objs_info_dicts
 
 
+def _recursive_parse_xml_to_dict(xml):
+    """Recursively parses XML contents to python dict.
+    We assume that `object` tags are the only ones that can appear
+    multiple times at the same level of a tree.
+
+    Args:
+      xml: xml tree obtained by parsing XML file contents using xml.etree.ElementTree
+
+    Returns:
+      Python dictionary holding XML contents.
+    """
+    if len(xml) == 0:
+        return {xml.tag: xml.text}
+    result = {}
+    for child in xml:
+        child_result = _recursive_parse_xml_to_dict(child)
+        if child.tag != 'object':
+            result[child.tag] = child_result[child.tag]
+        else:
+            if child.tag not in result:
+                result[child.tag] = []
+            result[child.tag].append(child_result[child.tag])
+    return {xml.tag: result}
+
+
+def _parse_voc_annotation(args):
+    """Parse the VOC XML annotation ``file_name`` once, return the class ids and the ``[x_centre, y_centre, width, height]``
+    boxes in ratio format of its objects of ``classes``, and the annotation as a dict. It is run by a process pool."""
+    file_name, classes, classes_in_person, skip_difficult = args
+    root = ET.parse(file_name).getroot()
+    size = root.find('size')
+    dw = 1. / int(size.find('width').text)
+    dh = 1. / int(size.find('height').text)
+    class_ids, boxes = [], []
+
+    def append(cls, obj):
+        xmlbox = obj.find('bndbox')
+        xmin, xmax, ymin, ymax = [float(xmlbox.find(key).text) for key in ('xmin', 'xmax', 'ymin', 'ymax')]
+        class_ids.append(classes.index(cls))
+        boxes.append(((xmin + xmax) / 2.0 * dw, (ymin + ymax) / 2.0 * dh, (xmax - xmin) * dw, (ymax - ymin) * dh))
+
+    for obj in root.iter('object'):
+        cls = obj.find('name').text
+        if cls not in classes or (skip_difficult and int(obj.find('difficult').text) == 1):
+            continue
+        append(cls, obj)
+        if cls in "person":
+            for part in obj.iter('part'):
+                cls = part.find('name').text
+                if cls in classes_in_person:
+                    append(cls, part)
+    return class_ids, boxes, _recursive_parse_xml_to_dict(root)['annotation']
+
+
 ## Load and save network list npz
-def save_npz(save_list=[], name='model.npz', sess=None):
+def save_npz(save_list=[], name='model.npz', sess=None, mmap=False, asynchronous=False, chunk_size=None, compress=False, dtype=None):
     """Input parameters and the file name, save parameters into .npz file. Use tl.utils.load_npz() to restore.
 
     Parameters
@@ -1035,6 +1292,28 @@ def save_npz(save_list=[], name='model.npz', sess=None):
     name : a string or None
         The name of the .npz file.
     sess : None or Session
+    mmap : boolean
+        If True, every parameter is stored as an uncompressed entry of the .npz file, with a JSON index of
+        their names, shapes and dtypes, so that ``load_npz`` can memory-map them instead of unpickling the whole
+        model into memory. Otherwise, the parameters are pickled into one object array (default).
+    asynchronous : boolean
+        If True, the parameters are fetched at once, and the file is written by a background thread while the
+        training continues. The thread is returned, ``join()`` it to wait for the file, which raises the
+        exception of a failed save.
+    chunk_size : int or None
+        If not None, with ``mmap=True`` and synchronous saving, the parameters are fetched and written by chunks
+        of about ``chunk_size`` bytes, so that only one chunk is in memory at a time.
+    compress : boolean
+        If True, the entries are compressed as ``np.savez_compressed``. The compressed entries cannot be memory-mapped.
+        It implies the format of ``mmap=True``.
+    dtype : None, 'float16' or 'int8'
+        If not None, the floating point parameters are exported as float16, or quantized to int8 with a per-tensor
+        affine quantization whose scale and zero-point are stored in the index. ``load_npz`` dequantizes them.
+        It implies the format of ``mmap=True``.
+
+    Returns
+    --------
+    thread : the background thread if ``asynchronous`` is True, otherwise None.
 
     Examples
     --------
@@ -1045,18 +1324,35 @@ def save_npz(save_list=[], name='model.npz', sess=None):
     >>> tl.files.assign_params(sess, load_params, network)
     - Load model from npz (Method 2)
     >>> tl.files.load_and_assign_npz(sess=sess, name='model.npz', network=network)
+    - Save model to a memory-mappable npz, the loaded parameters are read from the disk when they are assigned
+    >>> tl.files.save_npz(network.all_params, name='model.npz', sess=sess, mmap=True)
+    >>> load_params = tl.files.load_npz(name='model.npz')
+    - Save model in the background while training
+    >>> thread = tl.files.save_npz(network.all_params, name='model.npz', sess=sess, mmap=True, asynchronous=True)
+    >>> ...
+    >>> thread.join()
+    - Export a compressed and int8 quantized model, 4x smaller, and load it as float32
+    >>> tl.files.save_npz(network.all_params, name='model_int8.npz', sess=sess, compress=True, dtype='int8')
+    >>> tl.files.load_and_assign_npz(sess=sess, name='model_int8.npz', network=network)
 
     Notes
     -----
     If you got session issues, you can change the value.eval() to value.eval(session=sess)
 
+    The file is written to a temporary file, which is fsynced and renamed to ``name``, so that ``name`` is
+    always either the previous or the complete new checkpoint, even if the process is killed while saving.
+
     References
     ----------
     - `Saving dictionary using numpy <http://stackoverflow.com/questions/22315595/saving-dictionary-of-header-information-using-numpy-savez>`_
     """
     ## save params into a list
+    if compress or dtype is not None:
+        mmap = True
     save_list_var = []
-    if sess:
+    if sess and mmap and chunk_size is not None and not asynchronous:
+        save_list_var = _fetch_chunks(sess, save_list, chunk_size)
+    elif sess:
         save_list_var = sess.run(save_list)
     else:
         try:
@@ -1064,10 +1360,12 @@ def save_npz(save_list=[], name='model.npz', sess=None):
                 save_list_var.append(value.eval())
         except:
             logging.info(" Fail to save model, Hint: pass the session into this function, save_npz(network.all_params, name='model.npz', sess=sess)")
-    np.savez(name, params=save_list_var)
-    save_list_var = None
-    del save_list_var
-    logging.info("[*] %s saved" % name)
+    if mmap:
+        param_names = [_param_name(param) for param in save_list]
+        write = lambda f: _write_npz_params(f, param_names, save_list_var, compress=compress, dtype=dtype)
+    else:
+        write = lambda f: np.savez(f, params=save_list_var)
+    return _save_file(_npz_name(name), write, asynchronous, "[*] %s saved")
 
     ## save params into a dictionary
     # rename_dict = {}
@@ -1077,7 +1375,7 @@ def save_npz(save_list=[], name='model.npz', sess=None):
     # logging.info('Model is saved to: %s' % name)
 
 
-def load_npz(path='', name='model.npz'):
+def load_npz(path='', name='model.npz', mmap=True, dtype=None):
     """Load the parameters of a Model saved by tl.files.save_npz().
 
     Parameters
@@ -1086,6 +1384,13 @@ def load_npz(path='', name='model.npz'):
         Folder path to .npz file.
     name : a string or None
         The name of the .npz file.
+    mmap : boolean
+        If True, the parameters saved with ``save_npz(..., mmap=True)`` are returned as read-only ``np.memmap``,
+        which are read from the disk tensor by tensor when they are used, and whose pages are shared by the
+        processes loading the same file. Otherwise, they are read into memory.
+    dtype : None or a numpy dtype
+        The dtype of the parameters saved with ``save_npz(..., dtype=...)``, which are dequantized into it.
+        Default is the dtype of the parameters before the export.
 
     Returns
     --------
@@ -1109,6 +1414,8 @@ def load_npz(path='', name='model.npz'):
     #     logging.info('Loading %s, %s' % (key, str(val.shape)))
     # return params
     ## if save_npz save params into a list
+    if _PARAMS_INDEX in _npz_entries(path + name):
+        return _load_npz_params(path + name, mmap=mmap, dtype=dtype)
     d = np.load(path + name)
     # for val in sorted( d.items() ):
     #     params = val
@@ -1119,12 +1426,236 @@ def load_npz(path='', name='model.npz'):
     # return d.items()[0][1]['params']
 
 
+_PARAMS_INDEX = 'index.json'
+
+
+def _param_name(param):
+    """The name of a parameter, or None if it is not a TensorFlow variable or tensor."""
+    return getattr(param, 'name', None)
+
+
+def _npz_entries(name):
+    """Return the names of the entries of a .npz file."""
+    with zipfile.ZipFile(name) as zf:
+        return zf.namelist()
+
+
+def _npz_name(name):
+    """Append the .npz extension to the file name as ``np.savez``, if it is missing."""
+    return name if name.endswith('.npz') else name + '.npz'
+
+
+def _write_npz_params(f, param_names, values, compress=False, dtype=None):
+    """Write the parameters as the entries ``param_00000``, ``param_00001``, ... of an .npz file, with a JSON
+    index of their order, names, shapes and dtypes, and of the quantization of the floating point parameters
+    exported as ``dtype``. ``values`` can be an iterator."""
+    if dtype not in (None, 'float16', 'int8'):
+        raise ValueError("dtype should be None, 'float16' or 'int8', got %s" % dtype)
+    index = {'format': 'tensorlayer.params', 'version': 1, 'params': []}
+
+    def entries():
+        for idx, (param_name, value) in enumerate(zip(param_names, values)):
+            key = 'param_%05d' % idx
+            value = np.asarray(value)
+            param = {'key': key, 'name': param_name, 'shape': list(value.shape), 'dtype': value.dtype.str}
+            if dtype == 'float16' and value.dtype.kind == 'f':
+                value = value.astype(np.float16)
+            elif dtype == 'int8' and value.dtype.kind == 'f':
+                value, param['scale'], param['zero_point'] = _quantize_int8(value)
+            index['params'].append(param)
+            yield key, value
+
+    _write_npz_entries(f, entries(), extra=lambda: {_PARAMS_INDEX: json.dumps(index)}, compress=compress)
+
+
+def _quantize_int8(value):
+    """Quantize a float array to int8 with the per-tensor affine quantization ``value = (q - zero_point) * scale``,
+    whose range includes zero, and return ``q, scale, zero_point``."""
+    if value.size == 0:
+        return value.astype(np.int8), 1.0, 0
+    low, high = min(float(value.min()), 0.0), max(float(value.max()), 0.0)
+    if high == low:
+        return np.zeros(value.shape, dtype=np.int8), 1.0, 0
+    scale = (high - low) / 255.0
+    zero_point = int(round(-128 - low / scale))
+    q = np.clip(np.round(value / scale) + zero_point, -128, 127).astype(np.int8)
+    return q, scale, zero_point
+
+
+def _write_npz_entries(f, arrays, extra=None, compress=False):
+    """Write the (key, array) pairs as the .npy entries of an .npz file, readable by ``np.load``, followed
+    by the entries of the dict returned by ``extra()``. ``arrays`` can be an iterator, every array is written
+    before the next one is taken. The entries are uncompressed, unless ``compress`` is True."""
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for key, value in arrays:
+            value = np.asanyarray(value)
+            if sys.version_info >= (3, 6):
+                # stream the array into the entry instead of building its bytes in memory
+                with zf.open(key + '.npy', 'w', force_zip64=True) as entry:
+                    np.lib.format.write_array(entry, value, allow_pickle=False)
+            else:
+                buf = io.BytesIO()
+                np.lib.format.write_array(buf, value, allow_pickle=False)
+                zf.writestr(key + '.npy', buf.getvalue())
+        if extra is not None:
+            for key, data in extra().items():
+                zf.writestr(key, data)
+
+
+def _fetch_chunks(sess, save_list, chunk_size):
+    """Yield the values of the variables in order, fetched by chunks of about ``chunk_size`` bytes."""
+    chunk, n_bytes = [], 0
+    for variable in save_list:
+        chunk.append(variable)
+        n_bytes += variable.dtype.size * (variable.get_shape().num_elements() or 0)
+        if n_bytes >= chunk_size:
+            for value in sess.run(chunk):
+                yield value
+            chunk, n_bytes = [], 0
+    if chunk:
+        for value in sess.run(chunk):
+            yield value
+
+
+def _atomic_write(name, write):
+    """Call ``write(f)`` on a new temporary file next to ``name``, fsync it and rename it to ``name``."""
+    folder, base = os.path.split(name)
+    fd, tmp_name = tempfile.mkstemp(dir=folder or '.', prefix=base + '.', suffix='.tmp')
+    try:
+        # mkstemp creates the file readable by the owner only, give it the permissions of a new file
+        os.chmod(tmp_name, 0o666 & ~_UMASK)
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        getattr(os, 'replace', os.rename)(tmp_name, name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# the last save of every file, the saves of the same file run one after the other
+_SAVE_THREADS = {}
+_SAVE_THREADS_LOCK = threading.Lock()
+
+
+def _save_file(name, write, asynchronous=False, message="[*] %s saved"):
+    """Write the file ``name`` atomically with ``write(f)``, on a background :class:`_SaveThread` that is returned
+    if ``asynchronous`` is True, otherwise waited for. A save starts writing once the previous save of the same
+    file is finished, so that the last one always wins."""
+    key = os.path.abspath(name)
+    with _SAVE_THREADS_LOCK:
+        thread = _SaveThread(name, write, message, previous=_SAVE_THREADS.get(key))
+        _SAVE_THREADS[key] = thread
+    thread.start()
+    if not asynchronous:
+        thread.join()
+        return None
+    return thread
+
+
+class _SaveThread(threading.Thread):
+    """The background thread of a save. It waits for the ``previous`` save of the same file before writing.
+    :meth:`join` waits for the file and raises the exception of a failed save, which is also kept in ``exception``."""
+
+    def __init__(self, name, write, message, previous=None):
+        threading.Thread.__init__(self, name='save_%s' % name)
+        self.file_name = name
+        self.exception = None
+        self._write = write
+        self._message = message
+        self._previous = previous
+
+    def run(self):
+        try:
+            if self._previous is not None:
+                threading.Thread.join(self._previous)  # its exception belongs to its own caller
+            _atomic_write(self.file_name, self._write)
+            logging.info(self._message % self.file_name)
+        except Exception as e:
+            logging.info("[!] Fail to save %s: %s" % (self.file_name, e))
+            self.exception = e
+        finally:
+            # release the saved values, and the finished thread unless a newer save replaced it
+            self._write = self._previous = None
+            with _SAVE_THREADS_LOCK:
+                key = os.path.abspath(self.file_name)
+                if _SAVE_THREADS.get(key) is self:
+                    del _SAVE_THREADS[key]
+
+    def join(self, timeout=None):
+        threading.Thread.join(self, timeout)
+        if self.exception is not None and not self.is_alive():
+            raise self.exception
+
+
+def _load_npz_params(name, mmap=True, dtype=None):
+    """Return the parameters of an .npz file saved by :func:`_write_npz_params` in order, dequantized
+    into ``dtype``, by default their dtype before the export."""
+    with zipfile.ZipFile(name) as zf:
+        index = json.loads(zf.read(_PARAMS_INDEX).decode('utf-8'))
+    arrays = _load_npz_arrays(name, mmap=mmap)
+    params = []
+    for param in index['params']:
+        value = arrays[param['key']]
+        target_dtype = np.dtype(param['dtype'])
+        if dtype is not None and target_dtype.kind == 'f':
+            target_dtype = np.dtype(dtype)
+        if 'scale' in param:
+            value = ((value.astype(target_dtype) - param['zero_point']) * param['scale']).astype(target_dtype)
+        elif value.dtype != target_dtype:
+            value = value.astype(target_dtype)
+        params.append(value)
+    return params
+
+
+def _load_npz_arrays(name, mmap=True, mode='r'):
+    """Return the arrays of an .npz file as a dict of {key: array}. If ``mmap`` is True, the arrays stored
+    without compression are memory-mapped with the ``np.memmap`` ``mode``, instead of being read into memory."""
+    arrays = {}
+    with zipfile.ZipFile(name) as zf, open(name, 'rb') as f:
+        for info in zf.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+            key = info.filename[:-len('.npy')]
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                arrays[key] = _memmap_npz_entry(f, name, info, mode)
+            else:
+                arrays[key] = np.lib.format.read_array(zf.open(info))
+    return arrays
+
+
+def _memmap_npz_entry(f, name, info, mode='r'):
+    """Memory-map the .npy entry ``info`` stored without compression in the .npz file ``f`` of path ``name``."""
+    # the data of an entry follows its local file header, whose name and extra field lengths
+    # can differ from the central directory
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if dtype.hasobject or int(np.prod(shape)) == 0:
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        return np.lib.format.read_array(f)
+    return np.memmap(name, dtype=dtype, mode=mode, shape=shape, order='F' if fortran_order else 'C', offset=f.tell())
+
+
 def assign_params(sess, params, network):
     """Assign the given parameters to the TensorLayer network.
 
     Parameters
     ----------
     sess : TensorFlow Session. Automatically run when sess is not None.
+        The parameters are fed into assign ops that are created once per variable and reused by the
+        next calls, all in a single ``sess.run``, so that reloading the parameters does not grow the graph.
     params : a list
         A list of parameters in order.
     network : a :class:`Layer` class
@@ -1133,7 +1664,8 @@ def assign_params(sess, params, network):
     Returns
     --------
     ops : list
-        A list of tf ops in order that assign params. Support sess.run(ops) manually.
+        A list of tf ops in order that assign params. If sess is None, they assign constants of the
+        parameters and support sess.run(ops) manually, otherwise they are the cached assign ops.
 
     Examples
     --------
@@ -1149,11 +1681,32 @@ def assign_params(sess, params, network):
     ----------
     - `Assign value to a TensorFlow variable <http://stackoverflow.com/questions/34220532/how-to-assign-value-to-a-tensorflow-variable>`_
     """
-    ops = []
-    for idx, param in enumerate(params):
-        ops.append(network.all_params[idx].assign(param))
-    if sess is not None:
-        sess.run(ops)
+    if sess is None:
+        ops = []
+        for idx, param in enumerate(params):
+            ops.append(network.all_params[idx].assign(param))
+        return ops
+    return _assign_variables(sess, network.all_params[:len(params)], params)
+
+
+# the placeholder and assign op of every variable, created by the first assignment
+_ASSIGN_OPS = weakref.WeakKeyDictionary()
+
+
+def _assign_variables(sess, variables, values):
+    """Assign the values to the variables in a single ``sess.run``, through cached placeholders
+    and assign ops, and return the assign ops."""
+    ops, feed_dict = [], {}
+    for variable, value in zip(variables, values):
+        cached = _ASSIGN_OPS.get(variable)
+        if cached is None:
+            with variable.graph.as_default(), tf.name_scope('assign_params'):
+                placeholder = tf.placeholder(variable.dtype.base_dtype, shape=variable.get_shape())
+                cached = (placeholder, tf.assign(variable, placeholder))
+            _ASSIGN_OPS[variable] = cached
+        feed_dict[cached[0]] = value
+        ops.append(cached[1])
+    sess.run(ops, feed_dict=feed_dict)
     return ops
 
 
@@ -1190,7 +1743,7 @@ def load_and_assign_npz(sess=None, name=None, network=None):
 
 
 ## Load and save network dict npz
-def save_npz_dict(save_list=[], name='model.npz', sess=None):
+def save_npz_dict(save_list=[], name='model.npz', sess=None, asynchronous=False, chunk_size=None, base=None):
     """Input parameters and the file name, save parameters as a dictionary into .npz file.
     Use ``tl.files.load_and_assign_npz_dict()`` to restore.
 
@@ -1201,21 +1754,124 @@ def save_npz_dict(save_list=[], name='model.npz', sess=None):
     name : a string
         The name of the .npz file.
     sess : Session
+    asynchronous : boolean
+        If True, the parameters are fetched at once, and the file is written by a background thread while the
+        training continues. The thread is returned, ``join()`` it to wait for the file, which raises the
+        exception of a failed save.
+    chunk_size : int or None
+        If not None, with synchronous saving, the parameters are fetched and written by chunks of about
+        ``chunk_size`` bytes, so that only one chunk is in memory at a time.
+    base : a string or None
+        The name of a previous checkpoint saved by ``save_npz_dict``. If not None, a delta checkpoint is saved:
+        only the tensors whose hash differs from ``base`` are written, and a manifest refers to the checkpoints
+        that hold the unchanged tensors. ``load_and_assign_npz_dict`` resolves the references, so the
+        referenced checkpoints must be kept.
+
+    Returns
+    --------
+    thread : the background thread if ``asynchronous`` is True, otherwise None.
+
+    Examples
+    --------
+    >>> tl.files.save_npz_dict(network.all_params, name='model_0.npz', sess=sess)
+    >>> ... # fine-tune the top layers
+    >>> tl.files.save_npz_dict(network.all_params, name='model_1.npz', sess=sess, base='model_0.npz')
+    >>> tl.files.load_and_assign_npz_dict(name='model_1.npz', sess=sess)
+
+    Notes
+    -----
+    The file is written to a temporary file, which is fsynced and renamed to ``name``, see ``save_npz``.
     """
     assert sess is not None
+    if base is not None and os.path.abspath(_npz_name(name)) == os.path.abspath(base):
+        raise ValueError("The delta checkpoint %s cannot overwrite its base" % name)
     save_list_names = [tensor.name for tensor in save_list]
-    save_list_var = sess.run(save_list)
-    save_var_dict = {save_list_names[idx]: val for idx, val in enumerate(save_list_var)}
-    np.savez(name, **save_var_dict)
-    save_list_var = None
-    save_var_dict = None
-    del save_list_var
-    del save_var_dict
-    logging.info("[*] Model saved in npz_dict %s" % name)
+    if chunk_size is not None and not asynchronous:
+        save_list_var = _fetch_chunks(sess, save_list, chunk_size)
+    else:
+        save_list_var = sess.run(save_list)
+    if base is None:
+        write = lambda f: _write_npz_entries(f, zip(save_list_names, save_list_var))
+    else:
+        write = lambda f: _write_npz_delta(f, _npz_name(name), base, save_list_names, save_list_var)
+    return _save_file(_npz_name(name), write, asynchronous, "[*] Model saved in npz_dict %s")
+
+
+_DELTA_MANIFEST = 'manifest.json'
+
+
+def _tensor_hash(value):
+    """The SHA-1 of the dtype, shape and bytes of an array."""
+    value = np.ascontiguousarray(value)
+    digest = hashlib.sha1(('%s%s' % (value.dtype.str, value.shape)).encode('utf-8'))
+    digest.update(value.view(np.uint8).reshape(-1) if value.size else b'')
+    return digest.hexdigest()
+
+
+def _read_delta_manifest(name):
+    """Return the manifest of a delta checkpoint, or None for a full checkpoint."""
+    with zipfile.ZipFile(name) as zf:
+        if _DELTA_MANIFEST not in zf.namelist():
+            return None
+        return json.loads(zf.read(_DELTA_MANIFEST).decode('utf-8'))
+
+
+def _npz_dict_sources(name):
+    """Return the hash of every tensor of the checkpoint ``name`` and the absolute path of the checkpoint
+    that holds its data, as two dicts."""
+    manifest = _read_delta_manifest(name)
+    if manifest is None:
+        hashes = {key: _tensor_hash(value) for key, value in _load_npz_arrays(name).items()}
+        return hashes, {key: os.path.abspath(name) for key in hashes}
+    # the changed tensors are held by the delta checkpoint itself
+    folder = os.path.dirname(os.path.abspath(name))
+    sources = {key: os.path.abspath(name) for key in manifest['hashes']}
+    sources.update({key: os.path.normpath(os.path.join(folder, ref)) for key, ref in manifest['refs'].items()})
+    return manifest['hashes'], sources
+
+
+def _write_npz_delta(f, name, base, keys, values):
+    """Write the tensors that changed since the checkpoint ``base``, and a manifest with the hashes of all the
+    tensors and, for the unchanged ones, the path of the checkpoint that holds them, relative to ``name``."""
+    base_hashes, base_sources = _npz_dict_sources(base)
+    folder = os.path.dirname(os.path.abspath(name))
+    manifest = {'format': 'tensorlayer.delta', 'version': 1, 'base': os.path.relpath(os.path.abspath(base), folder), 'hashes': {}, 'refs': {}}
+
+    def changed():
+        for key, value in zip(keys, values):
+            manifest['hashes'][key] = _tensor_hash(value)
+            if base_hashes.get(key) == manifest['hashes'][key]:
+                # refer directly to the checkpoint holding the data, so loading never walks the chain
+                manifest['refs'][key] = os.path.relpath(base_sources[key], folder)
+            else:
+                yield key, value
+
+    _write_npz_entries(f, changed(), extra=lambda: {_DELTA_MANIFEST: json.dumps(manifest)})
+    logging.info("[*] %d of %d tensors changed since %s" % (len(manifest['hashes']) - len(manifest['refs']), len(manifest['hashes']), base))
+
+
+def _load_npz_dict_arrays(name):
+    """Return the tensors of a checkpoint saved by ``save_npz_dict`` as a dict of memory-mapped arrays,
+    with the unchanged tensors of a delta checkpoint read from the checkpoints that hold them."""
+    arrays = _load_npz_arrays(name)
+    manifest = _read_delta_manifest(name)
+    if manifest is not None:
+        folder = os.path.dirname(os.path.abspath(name))
+        sources = {}
+        for key, ref in manifest['refs'].items():
+            path = os.path.normpath(os.path.join(folder, ref))
+            if path not in sources:
+                if not os.path.exists(path):
+                    raise Exception("[!] Checkpoint %s referred by the delta checkpoint %s not found" % (path, name))
+                sources[path] = _load_npz_arrays(path)
+            arrays[key] = sources[path][key]
+    return arrays
 
 
 def load_and_assign_npz_dict(name='model.npz', sess=None):
-    """Restore the parameters saved by ``tl.files.save_npz_dict()``.
+    """Restore the parameters saved by ``tl.files.save_npz_dict()``. The parameters are memory-mapped and
+    assigned in a single ``sess.run`` through cached assign ops, see ``assign_params``.
+    For a delta checkpoint, the unchanged parameters are read from the checkpoints it refers to.
 
     Parameters
     ----------
@@ -1228,26 +1884,34 @@ def load_and_assign_npz_dict(name='model.npz', sess=None):
         logging.info("[!] Load {} failed!".format(name))
         return False
 
-    params = np.load(name)
-    if len(params.keys()) != len(set(params.keys())):
+    entries = _npz_entries(name)
+    if len(entries) != len(set(entries)):
         raise Exception("Duplication in model npz_dict %s" % name)
-    ops = list()
+    params = _load_npz_dict_arrays(name)
+    # look up the variables by name once, instead of scanning the collection for every key
+    global_variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+    variables_by_name = {v.name: v for v in global_variables}
+    variables, values = [], []
     for key in params.keys():
         try:
             # tensor = tf.get_default_graph().get_tensor_by_name(key)
             # varlist = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=key)
-            varlist = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=key)
+            if key in variables_by_name:
+                varlist = [variables_by_name[key]]
+            else:
+                varlist = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=key)
             if len(varlist) > 1:
                 raise Exception("[!] Multiple candidate variables to be assigned for name %s" % key)
             elif len(varlist) == 0:
                 raise KeyError
             else:
-                ops.append(varlist[0].assign(params[key]))
+                variables.append(varlist[0])
+                values.append(params[key])
                 logging.info("[*] params restored: %s" % key)
         except KeyError:
             logging.info("[!] Warning: Tensor named %s not found in network." % key)
 
-    sess.run(ops)
+    _assign_variables(sess, variables, values)
     logging.info("[*] Model restored from npz_dict %s" % name)
 
 
@@ -1521,10 +2185,14 @@ def exists_or_mkdir(path, verbose=True):
         return True
 
 
-def maybe_download_and_extract(filename, working_directory, url_source, extract=False, expected_bytes=None):
+def maybe_download_and_extract(filename, working_directory, url_source, extract=False, expected_bytes=None, sha256=None, n_connections=1, retries=3):
     """Checks if file exists in working_directory otherwise tries to dowload the file,
     and optionally also tries to extract the file if format is ".zip" or ".tar"
 
+    The file is downloaded into ``filename.partial``, which is renamed to ``filename`` once it is complete and
+    verified. An interrupted download is resumed from the ``.partial`` file with HTTP range requests, in this
+    call (see ``retries``) or in the next one.
+
     Parameters
     -----------
     filename : string
@@ -1534,10 +2202,20 @@ def maybe_download_and_extract(filename, working_directory, url_source, extract=
     url : string
         The URL to download the file from
     extract : bool, defaults is False
-        If True, tries to uncompress the dowloaded file is ".tar.gz/.tar.bz2" or ".zip" file
+        If True, tries to uncompress the dowloaded file is ".tar.gz/.tar.bz2" or ".zip" file.
+        With a single connection and neither ``expected_bytes`` nor ``sha256``, a ".tar", ".tar.gz", ".tgz" or ".tar.bz2"
+        file is extracted while it is downloaded, otherwise the file is only extracted once it is verified.
     expected_bytes : int/None
         If set tries to verify that the downloaded file is of the specified size, otherwise raises an Exception,
         defaults is None which corresponds to no check being performed
+    sha256 : string/None
+        If set tries to verify that the SHA-256 hex digest of the downloaded file is the specified one, otherwise
+        removes the file and raises an Exception, defaults is None which corresponds to no check being performed
+    n_connections : int
+        If greater than 1 and the server supports range requests, the file is downloaded in ``n_connections``
+        segments in parallel, each of which is resumed separately.
+    retries : int
+        The number of times an interrupted connection is resumed before an Exception is raised.
 
     Returns
     ----------
@@ -1551,35 +2229,46 @@ def maybe_download_and_extract(filename, working_directory, url_source, extract=
     >>> tl.files.maybe_download_and_extract(filename = 'ADEChallengeData2016.zip',
                                             working_directory = 'data/',
                                             url_source = 'http://sceneparsing.csail.mit.edu/data/',
-                                            extract=True)
+                                            extract=True, n_connections=4)
     """
-
-    # We first define a download function, supporting both Python 2 and 3.
-    def _download(filename, working_directory, url_source):
-        def _dlProgress(count, blockSize, totalSize):
-            if (totalSize != 0):
-                percent = float(count * blockSize) / float(totalSize) * 100.0
-                sys.stdout.write("\r" "Downloading " + filename + "...%d%%" % percent)
-                sys.stdout.flush()
-
-        if sys.version_info[0] == 2:
-            from urllib import urlretrieve
-        else:
-            from urllib.request import urlretrieve
-        filepath = os.path.join(working_directory, filename)
-        urlretrieve(url_source + filename, filepath, reporthook=_dlProgress)
-        sys.stdout.write('\n')
-
     exists_or_mkdir(working_directory, verbose=False)
     filepath = os.path.join(working_directory, filename)
 
     if not os.path.exists(filepath):
-        _download(filename, working_directory, url_source)
-        statinfo = os.stat(filepath)
-        logging.info('Succesfully downloaded %s %s bytes.' % (filename, statinfo.st_size))  #, 'bytes.')
-        if (not (expected_bytes is None) and (expected_bytes != statinfo.st_size)):
+        url = url_source + filename
+        partial = filepath + '.partial'
+        progress = _DownloadProgress(filename)
+        extracted = False
+        if not (n_connections > 1 and _download_segments(url, partial, n_connections, retries, progress)):
+            _remove_segments(partial)  # the segments of a previous download cannot be resumed with a single connection
+            # the files of a streamed extraction are written before the size and digest can be verified
+            stream_extract = extract and expected_bytes is None and sha256 is None and filename.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2'))
+            with _DownloadStream(url, partial, retries=retries, replay=stream_extract or sha256 is not None, progress=progress) as stream:
+                if stream_extract:
+                    logging.info('Trying to extract tar file while downloading')
+                    try:
+                        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+                            tar.extractall(working_directory)
+                        extracted = True
+                    except tarfile.ReadError:
+                        logging.info('... Not a tar file')
+                stream.drain()
+            digest = stream.sha256.hexdigest() if sha256 is not None else None
+        else:
+            digest = _file_sha256(partial) if sha256 is not None else None
+        sys.stdout.write('\n')
+        size = os.path.getsize(partial)
+        logging.info('Succesfully downloaded %s %s bytes.' % (filename, size))
+        if (not (expected_bytes is None) and (expected_bytes != size)):
+            os.remove(partial)
             raise Exception('Failed to verify ' + filename + '. Can you get to it with a browser?')
-        if (extract):
+        if sha256 is not None and digest != sha256.lower():
+            os.remove(partial)
+            raise Exception('Failed to verify the SHA-256 of ' + filename + ': got %s, expected %s' % (digest, sha256))
+        getattr(os, 'replace', os.rename)(partial, filepath)
+        if extracted:
+            logging.info('... Success!')
+        elif (extract):
             if tarfile.is_tarfile(filepath):
                 logging.info('Trying to extract tar file')
                 tarfile.open(filepath, 'r').extractall(working_directory)
@@ -1594,6 +2283,232 @@ def maybe_download_and_extract(filename, working_directory, url_source, extract=
     return filepath
 
 
+class _DownloadProgress(object):
+    """Print the percentage of ``filename`` downloaded by one or several connections."""
+
+    def __init__(self, filename, total=None):
+        self.filename = filename
+        self.total = total
+        self.done = 0
+        self._percent = None
+        self._lock = threading.Lock()
+
+    def __call__(self, n_bytes):
+        with self._lock:
+            self.done += n_bytes
+            if self.total:
+                percent = int(self.done * 100.0 / self.total)
+                if percent != self._percent:
+                    self._percent = percent
+                    sys.stdout.write("\r" "Downloading " + self.filename + "...%d%%" % percent)
+                    sys.stdout.flush()
+
+
+class _DownloadStream(object):
+    """A file-like object reading the bytes ``start`` to ``end`` (inclusive, by default to the end) of ``url``,
+    which are appended to the file ``partial`` as they arrive. Only the missing bytes are requested, with an
+    HTTP range, and the connection is resumed up to ``retries`` times when it is interrupted. If ``replay`` is
+    True, the bytes already in ``partial`` are read first, so that the stream and ``sha256`` cover all the bytes.
+    """
+
+    def __init__(self, url, partial, start=0, end=None, retries=3, replay=True, progress=None, timeout=60, block_size=1 << 16):
+        self.url = url
+        self.partial = partial
+        self.start = start
+        self.length = None if end is None else end + 1 - start
+        self.retries = retries
+        self.progress = progress
+        self.timeout = timeout
+        self.block_size = block_size
+        self.sha256 = hashlib.sha256()
+        self.size = os.path.getsize(partial) if os.path.exists(partial) else 0
+        self._local = None
+        if replay and self.size:
+            self._local, self.size = open(partial, 'rb'), 0
+        elif progress is not None:
+            progress(self.size)
+        self._file = open(partial, 'ab')
+        self._response = None
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._close_response()
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def drain(self):
+        """Read and discard the rest of the stream."""
+        while self.read(self.block_size):
+            pass
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.block_size), b''))
+        if self._local is not None:
+            data = self._local.read(size)
+            if data:
+                self._update(data)
+                return data
+            self._local.close()
+            self._local = None
+        if self.length is not None and self.size >= self.length:
+            self._done = True
+        if self._done:
+            return b''
+        if self.length is not None:
+            size = min(size, self.length - self.size)
+        data = self._read_remote(size)
+        if data:
+            self._file.write(data)
+            self._update(data)
+        if not data:
+            self._done = True
+        return data
+
+    def _update(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        if self.progress is not None:
+            self.progress(len(data))
+
+    def _read_remote(self, size):
+        for attempt in range(self.retries + 1):
+            try:
+                if self._response is None and not self._open():
+                    return b''
+                data = self._response.read(size)
+                if not data and self.length is not None and self.size < self.length:
+                    raise IOError('connection closed at byte %d of %d' % (self.start + self.size, self.start + self.length))
+                return data
+            except (IOError, http_client.HTTPException) as e:
+                self._close_response()
+                if attempt == self.retries or (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+                    raise
+                logging.info("[!] Download of %s interrupted (%s), resuming at byte %d" % (self.url, e, self.start + self.size))
+
+    def _open(self):
+        """Request the missing bytes, return False if there is none."""
+        offset = self.start + self.size
+        request = urllib.request.Request(self.url)
+        if offset or self.length is not None:
+            request.add_header('Range', 'bytes=%d-%s' % (offset, '' if self.length is None else self.start + self.length - 1))
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                # range not satisfiable, the partial file is complete
+                return False
+            raise
+        if offset and response.getcode() != 206:
+            # the server ignored the range and sends the whole file
+            logging.info("[!] %s does not support range requests, skipping %d bytes" % (self.url, offset))
+            while offset > 0:
+                skipped = response.read(min(offset, self.block_size))
+                if not skipped:
+                    raise IOError('connection closed while skipping to byte %d' % (self.start + self.size))
+                offset -= len(skipped)
+        content_length = response.info().get('Content-Length')
+        if self.length is None and content_length is not None:
+            self.length = self.size + int(content_length) if response.getcode() == 206 else int(content_length) - self.start
+        if self.progress is not None and self.progress.total is None and self.start == 0 and self.length is not None:
+            self.progress.total = self.length
+        self._response = response
+        return True
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+
+def _url_size(url, timeout=60):
+    """Return the size of ``url`` if the server supports range requests, otherwise None."""
+    request = urllib.request.Request(url, headers={'Range': 'bytes=0-0'})
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except (IOError, http_client.HTTPException):
+        return None
+    try:
+        content_range = response.info().get('Content-Range')
+        if response.getcode() != 206 or content_range is None or '/' not in content_range:
+            return None
+        total = content_range.rsplit('/', 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    finally:
+        response.close()
+
+
+def _download_segments(url, partial, n_connections, retries=3, progress=None):
+    """Download ``url`` into ``partial`` in ``n_connections`` segments in parallel. The first segment is written
+    into ``partial`` and the other ones into ``partial.1``, ``partial.2``, ..., which are appended to it once they
+    are all complete. Return False, without downloading anything, if the server does not support range requests
+    or if ``partial`` holds more than the first segment, which is then resumed with a single connection."""
+    total = _url_size(url)
+    if total is None:
+        return False
+    bounds = [total * i // n_connections for i in range(n_connections + 1)]
+    if os.path.exists(partial) and os.path.getsize(partial) > bounds[1]:
+        return False
+    if progress is not None:
+        progress.total = total
+    paths = [partial] + ['%s.%d' % (partial, i) for i in range(1, n_connections)]
+    errors = []
+
+    def run(i):
+        try:
+            with _DownloadStream(url, paths[i], start=bounds[i], end=bounds[i + 1] - 1, retries=retries, replay=False, progress=progress) as stream:
+                stream.drain()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i, ), name='download_%d' % i) for i in range(n_connections) if bounds[i + 1] > bounds[i]]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    with open(partial, 'ab') as f:
+        for path in paths[1:]:
+            if os.path.exists(path):
+                with open(path, 'rb') as segment:
+                    shutil.copyfileobj(segment, f, 1 << 20)
+        f.flush()
+        os.fsync(f.fileno())
+    for path in paths[1:]:
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+def _remove_segments(partial):
+    """Remove the segment files ``partial.1``, ``partial.2``, ... left over by :func:`_download_segments`."""
+    folder, name = os.path.split(partial)
+    for f in os.listdir(folder or '.'):
+        if f.startswith(name + '.') and f[len(name) + 1:].isdigit():
+            os.remove(os.path.join(folder, f))
+
+
+def _file_sha256(name, block_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
 ## Sort
 def natural_keys(text):
     """Sort list of string with number in human order.
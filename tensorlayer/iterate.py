@@ -5,20 +5,102 @@ import numpy as np
 from six.moves import xrange
 
 
-def minibatches(inputs=None, targets=None, batch_size=None, shuffle=False):
+def _data_len(data):
+    """Return the number of examples in a numpy.array, or in a tuple or dict of equally long numpy.array."""
+    if isinstance(data, dict):
+        lengths = [len(d) for d in data.values()]
+    elif isinstance(data, tuple):
+        lengths = [len(d) for d in data]
+    else:
+        return len(data)
+    assert len(set(lengths)) == 1, "All arrays should have the same number of examples, got %s" % lengths
+    return lengths[0]
+
+
+def _data_take(data, excerpt):
+    """Index a numpy.array, or every numpy.array of a tuple or dict, by the same ``excerpt``."""
+    if isinstance(data, dict):
+        return {k: d[excerpt] for k, d in data.items()}
+    elif isinstance(data, tuple):
+        return tuple(d[excerpt] for d in data)
+    return data[excerpt]
+
+
+def _data_empty(data, batch_size):
+    """Allocate an uninitialized batch of ``batch_size`` examples with the same structure, shapes and dtypes as ``data``."""
+    if isinstance(data, dict):
+        return {k: np.empty((batch_size, ) + d.shape[1:], dtype=d.dtype) for k, d in data.items()}
+    elif isinstance(data, tuple):
+        return tuple(np.empty((batch_size, ) + d.shape[1:], dtype=d.dtype) for d in data)
+    return np.empty((batch_size, ) + data.shape[1:], dtype=data.dtype)
+
+
+def _data_take_into(data, indices, out):
+    """Gather the examples of ``indices`` from ``data`` into the preallocated batch ``out``."""
+    if isinstance(data, dict):
+        for k, d in data.items():
+            _take_into(d, indices, out[k])
+    elif isinstance(data, tuple):
+        for d, o in zip(data, out):
+            _take_into(d, indices, o)
+    else:
+        _take_into(data, indices, out)
+    return out
+
+
+def _take_into(data, indices, out):
+    if isinstance(data, np.ndarray):
+        np.take(data, indices, axis=0, out=out, mode='clip')
+    else:
+        # array-likes such as tl.files.ScaledArray convert the examples they are indexed by
+        out[...] = data[indices]
+
+
+def _shard_slice(n_examples, num_shards=1, shard_index=0):
+    """Return the contiguous slice of the ``shard_index``-th of ``num_shards`` equally sized shards of ``n_examples``.
+    The remaining ``n_examples % num_shards`` examples are dropped so that all shards have the same size."""
+    if not 0 <= shard_index < num_shards:
+        raise ValueError("shard_index should be in [0, %d), got %d" % (num_shards, shard_index))
+    shard_size = n_examples // num_shards
+    return slice(shard_index * shard_size, (shard_index + 1) * shard_size)
+
+
+def _batch_matrix(data, batch_size, offset=0):
+    """Return ``data[offset:]`` as a ``[batch_size, batch_len, ...]`` matrix of ``batch_size`` contiguous rows.
+    For a numpy.array or numpy.memmap this is a reshaped view, so the data is not copied."""
+    batch_len = (len(data) - offset) // batch_size
+    return data[offset:offset + batch_size * batch_len].reshape((batch_size, batch_len) + data.shape[1:])
+
+
+def minibatches(inputs=None, targets=None, batch_size=None, shuffle=False, num_shards=1, shard_index=0, seed=None, epoch=0, allow_smaller_final_batch=False):
     """Generate a generator that input a group of example in numpy.array and
     their labels, return the examples and labels by the given batchsize.
 
     Parameters
     ----------
-    inputs : numpy.array
-        (X) The input features, every row is a example.
-    targets : numpy.array
-        (y) The labels of inputs, every row is a example.
+    inputs : numpy.array, or a tuple or dict of numpy.array
+        (X) The input features, every row is a example. All arrays in a tuple or dict
+        must have the same number of rows, and they are sliced by the same indices.
+    targets : numpy.array, a tuple or dict of numpy.array, or None
+        (y) The labels of inputs, every row is a example. If None, only the batches of inputs are returned.
     batch_size : int
         The batch size.
     shuffle : boolean
         Indicating whether to use a shuffling queue, shuffle the dataset before return.
+    num_shards : int
+        The number of data-parallel workers, e.g. ``task_spec.num_workers`` of a :class:`TaskSpecDef`. Default is 1.
+    shard_index : int
+        The index of this worker in ``[0, num_shards)``, e.g. ``task_spec.shard_index``. Every worker gets a disjoint
+        shard of ``len(inputs) // num_shards`` examples, the remaining examples are skipped in this epoch.
+    seed : int or None
+        The seed shared by all workers. If given, the shuffling of the whole dataset only depends on ``seed`` and
+        ``epoch``, so all workers reshuffle consistently without communication. Required when ``shuffle`` is True
+        and ``num_shards`` > 1. If None, ``np.random`` is used.
+    epoch : int
+        The current epoch, used together with ``seed`` to reshuffle the dataset at every epoch.
+    allow_smaller_final_batch : boolean
+        If True, the remaining examples are returned as a final batch smaller than ``batch_size``,
+        otherwise they are skipped. Default is False.
 
     Examples
     --------
@@ -36,27 +118,228 @@ def minibatches(inputs=None, targets=None, batch_size=None, shuffle=False):
     ...        ['f', 'f']],
     ...         dtype='<U1'), array([4, 5]))
 
+    - Multiple inputs, the structure of inputs and targets is kept in every batch.
+    >>> X1 = np.zeros((1000, 100), dtype=np.float32)
+    >>> X2 = np.zeros((1000, 5), dtype=np.int64)
+    >>> for (X1_a, X2_a), y_a in tl.iterate.minibatches((X1, X2), y, batch_size=100, shuffle=True):
+    >>>     ...
+    >>> for X_a, y_a in tl.iterate.minibatches({'image': X1, 'id': X2}, y, batch_size=100, shuffle=True):
+    >>>     print(X_a['image'].shape, X_a['id'].shape)
+    ... (100, 100) (100, 5)
+
+    - Data-parallel workers, every worker iterates on its own shard of the dataset.
+    >>> task_spec = tl.distributed.TaskSpec()
+    >>> for epoch in range(n_epoch):
+    >>>     for X_a, y_a in tl.iterate.minibatches(X, y, batch_size=100, shuffle=True, num_shards=task_spec.num_workers,
+    ...                                            shard_index=task_spec.shard_index, seed=1234, epoch=epoch):
+    >>>         ...
 
     Notes
     -------
-    - If you have two inputs, e.g. X1 (1000, 100) and X2 (1000, 80), you can ``np.hstack((X1, X2))
-    into (1000, 180) and feed into ``inputs``, then you can split a batch of X1 and X2.
+    - If you have two inputs, e.g. X1 (1000, 100) and X2 (1000, 80), pass them as ``(X1, X2)`` or
+    ``{'x1': X1, 'x2': X2}`` instead of ``np.hstack((X1, X2))``, so the arrays keep their own dtype and shape
+    and the dataset is not copied.
     """
-    assert len(inputs) == len(targets)
+    n_examples = _data_len(inputs)
+    if targets is not None:
+        assert n_examples == _data_len(targets)
+    if shuffle and num_shards > 1 and seed is None:
+        raise ValueError("A seed shared by all workers is required to shuffle a sharded dataset")
+    shard = _shard_slice(n_examples, num_shards, shard_index)
     if shuffle:
-        indices = np.arange(len(inputs))
-        np.random.shuffle(indices)
-    for start_idx in range(0, len(inputs) - batch_size + 1, batch_size):
+        indices = np.arange(n_examples)
+        if seed is None:
+            np.random.shuffle(indices)
+        else:
+            np.random.RandomState([seed, epoch]).shuffle(indices)
+        indices = indices[shard]
+    shard_size = shard.stop - shard.start
+    for start_idx in range(0, shard_size if allow_smaller_final_batch else shard_size - batch_size + 1, batch_size):
         if shuffle:
             excerpt = indices[start_idx:start_idx + batch_size]
         else:
-            excerpt = slice(start_idx, start_idx + batch_size)
-        yield inputs[excerpt], targets[excerpt]
+            excerpt = slice(shard.start + start_idx, shard.start + min(start_idx + batch_size, shard_size))
+        if targets is None:
+            yield _data_take(inputs, excerpt)
+        else:
+            yield _data_take(inputs, excerpt), _data_take(targets, excerpt)
+
+
+class MinibatchIterator(object):
+    """The :class:`MinibatchIterator` class is a reusable version of :func:`minibatches`, every ``for`` loop
+    over it returns the batches of one epoch. The index array and the output batches are allocated once
+    and reused for all the epochs, so iterating on it repeatedly, e.g. for evaluation passes, does not allocate memory.
+
+    Without shuffling, the batches are views of the dataset and nothing is copied. With shuffling, the examples
+    are gathered into a ring of ``n_buffers`` preallocated batches, so a returned batch is overwritten
+    ``n_buffers`` steps later; copy it if you need to keep it longer.
+
+    Parameters
+    ----------
+    inputs : numpy.array, or a tuple or dict of numpy.array
+        (X) The input features, every row is a example.
+    targets : numpy.array, a tuple or dict of numpy.array, or None
+        (y) The labels of inputs, every row is a example. If None, only the batches of inputs are returned.
+    batch_size : int
+        The batch size.
+    shuffle : boolean
+        If True, shuffle the dataset at every epoch.
+    n_buffers : int
+        The number of batches in the output ring buffer, i.e. the number of batches that can be in flight. Default is 2.
+    num_shards : int
+        The number of data-parallel workers, see :func:`minibatches`.
+    shard_index : int
+        The index of this worker, see :func:`minibatches`.
+    seed : int or None
+        The seed shared by all workers, the shuffling of an epoch only depends on ``seed`` and the epoch number.
+    allow_smaller_final_batch : boolean
+        If True, the remaining examples are returned as a final batch smaller than ``batch_size``,
+        otherwise they are skipped. Default is False.
+
+    Attributes
+    ----------
+    epoch : int
+        The number of epochs iterated so far.
+
+    Examples
+    --------
+    >>> train_batches = tl.iterate.MinibatchIterator(X_train, y_train, batch_size=128, shuffle=True)
+    >>> val_batches = tl.iterate.MinibatchIterator(X_val, y_val, batch_size=128)
+    >>> for epoch in range(n_epoch):
+    >>>     for X_a, y_a in train_batches:
+    >>>         sess.run(train_op, feed_dict={x: X_a, y_: y_a})
+    >>>     for X_a, y_a in val_batches:
+    >>>         ...
+    """
 
+    def __init__(self, inputs=None, targets=None, batch_size=None, shuffle=False, n_buffers=2, num_shards=1, shard_index=0, seed=None,
+                 allow_smaller_final_batch=False):
+        self.inputs = inputs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.allow_smaller_final_batch = allow_smaller_final_batch
+        self.epoch = 0
+        n_examples = _data_len(inputs)
+        if targets is not None:
+            assert n_examples == _data_len(targets)
+        if shuffle and num_shards > 1 and seed is None:
+            raise ValueError("A seed shared by all workers is required to shuffle a sharded dataset")
+        self._shard = _shard_slice(n_examples, num_shards, shard_index)
+        if shuffle:
+            self._order = np.arange(n_examples)
+            self._indices = np.empty_like(self._order)
+            self._inputs_buffers = [_data_empty(inputs, batch_size) for _ in range(n_buffers)]
+            if targets is not None:
+                self._targets_buffers = [_data_empty(targets, batch_size) for _ in range(n_buffers)]
+
+    def __len__(self):
+        shard_size = self._shard.stop - self._shard.start
+        if self.allow_smaller_final_batch:
+            return (shard_size + self.batch_size - 1) // self.batch_size
+        return shard_size // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            self._indices[:] = self._order
+            if self.seed is None:
+                np.random.shuffle(self._indices)
+            else:
+                np.random.RandomState([self.seed, self.epoch]).shuffle(self._indices)
+            indices = self._indices[self._shard]
+        self.epoch += 1
+        shard_size = self._shard.stop - self._shard.start
+        for step in xrange(len(self)):
+            start_idx = step * self.batch_size
+            end_idx = min(start_idx + self.batch_size, shard_size)
+            if self.shuffle:
+                excerpt = indices[start_idx:end_idx]
+                buffer_idx = step % len(self._inputs_buffers)
+                # the final batch may be smaller, it is gathered into the head of the buffer
+                head = slice(0, end_idx - start_idx)
+                inputs = _data_take_into(self.inputs, excerpt, _data_take(self._inputs_buffers[buffer_idx], head))
+                if self.targets is not None:
+                    targets = _data_take_into(self.targets, excerpt, _data_take(self._targets_buffers[buffer_idx], head))
+            else:
+                excerpt = slice(self._shard.start + start_idx, self._shard.start + end_idx)
+                inputs = _data_take(self.inputs, excerpt)
+                if self.targets is not None:
+                    targets = _data_take(self.targets, excerpt)
+            if self.targets is None:
+                yield inputs
+            else:
+                yield inputs, targets
+
+
+def class_balanced_minibatches(inputs=None, targets=None, batch_size=None, n_batches=None, class_weights=None, sample_weights=None, seed=None):
+    """Generate a generator that returns class-balanced (or arbitrarily weighted) batches of examples and labels.
+    The examples are drawn with replacement by their indices, so the dataset is never replicated or copied,
+    which replaces the oversampling of ``tl.utils.class_balancing_oversample``.
 
-def seq_minibatches(inputs, targets, batch_size, seq_length, stride=1):
+    Parameters
+    ----------
+    inputs : numpy.array, or a tuple or dict of numpy.array
+        (X) The input features, every row is a example.
+    targets : numpy.array
+        (y) The labels of inputs, every row is a example.
+    batch_size : int
+        The batch size.
+    n_batches : int or None
+        The number of batches to return. If None, returns ``len(targets) // batch_size`` batches, i.e. one epoch.
+    class_weights : dict or None
+        The probability of drawing each class ``{label: weight}``, the weights do not need to sum to 1.
+        If None, all classes have the same probability. The labels not in the dictionary are never drawn.
+    sample_weights : numpy.array or None
+        The probability of drawing each example. If given, ``class_weights`` is ignored and ``targets``
+        are not used for the sampling.
+    seed : int or None
+        The seed of the sampling. If None, ``np.random`` is used.
+
+    Examples
+    --------
+    >>> X = np.asarray([['a','a'], ['b','b'], ['c','c'], ['d','d'], ['e','e'], ['f','f']])
+    >>> y = np.asarray([0, 0, 0, 0, 0, 1])
+    >>> for X_a, y_a in tl.iterate.class_balanced_minibatches(X, y, batch_size=4, n_batches=2, seed=0):
+    >>>     print(y_a)
+    ... [1 1 1 1]
+    ... [0 1 0 1]
+    >>> for X_a, y_a in tl.iterate.class_balanced_minibatches(X, y, batch_size=4, class_weights={0: 3, 1: 1}):
+    >>>     ...
+    """
+    n_examples = _data_len(inputs)
+    assert n_examples == _data_len(targets)
+    if sample_weights is None:
+        if isinstance(targets, (tuple, dict)) or np.ndim(targets) != 1:
+            raise ValueError("targets should be a 1-D array of labels to balance the classes, use sample_weights otherwise")
+        labels, label_idx, counts = np.unique(np.asarray(targets), return_inverse=True, return_counts=True)
+        if class_weights is None:
+            weights = np.ones(len(labels))
+        else:
+            weights = np.asarray([class_weights.get(label, 0) for label in labels.tolist()], dtype=np.float64)
+            if not (weights >= 0).all() or not weights.sum() > 0:
+                raise ValueError("class_weights should be non-negative, with a positive weight for one label of targets at least")
+        # every example of a class shares the probability of the class
+        sample_weights = (weights / counts)[label_idx.ravel()]
+    else:
+        sample_weights = np.asarray(sample_weights, dtype=np.float64)
+        if sample_weights.shape != (n_examples, ) or not (sample_weights >= 0).all() or not sample_weights.sum() > 0:
+            raise ValueError("sample_weights should have one non-negative weight per example with a positive sum")
+    cdf = np.cumsum(sample_weights)
+    if n_batches is None:
+        n_batches = n_examples // batch_size
+    rnd = np.random.RandomState(seed) if seed is not None else np.random
+    for _ in xrange(n_batches):
+        excerpt = np.searchsorted(cdf, rnd.random_sample(batch_size) * cdf[-1], side='right')
+        excerpt = np.minimum(excerpt, n_examples - 1)
+        yield _data_take(inputs, excerpt), _data_take(targets, excerpt)
+
+
+def seq_minibatches(inputs, targets, batch_size, seq_length, stride=1, num_shards=1, shard_index=0):
     """Generate a generator that return a batch of sequence inputs and targets.
     If ``batch_size = 100, seq_length = 5``, one return will have ``500`` rows (examples).
+    For data-parallel workers, set ``num_shards`` and ``shard_index`` to iterate on a contiguous
+    part of the sequence only, see :func:`minibatches`.
 
     Examples
     --------
@@ -99,6 +382,8 @@ def seq_minibatches(inputs, targets, batch_size, seq_length, stride=1):
     ... ['e' 'e']] [3 4]
     """
     assert len(inputs) == len(targets)
+    shard = _shard_slice(len(inputs), num_shards, shard_index)
+    inputs, targets = inputs[shard], targets[shard]
     n_loads = (batch_size * stride) + (seq_length - stride)
     for start_idx in range(0, len(inputs) - n_loads + 1, (batch_size * stride)):
         seq_inputs = np.zeros((batch_size, seq_length) + inputs.shape[1:], dtype=inputs.dtype)
@@ -113,28 +398,23 @@ def seq_minibatches(inputs, targets, batch_size, seq_length, stride=1):
         yield flatten_inputs, flatten_targets
 
 
-def seq_minibatches2(inputs, targets, batch_size, num_steps):
+def seq_minibatches2(inputs, targets, batch_size, num_steps, num_shards=1, shard_index=0, random_offset=False):
     """Generate a generator that iterates on two list of words. Yields (Returns) the source contexts and
     the target context by the given batch_size and num_steps (sequence_length),
     see ``PTB tutorial``. In TensorFlow's tutorial, this generates the batch_size pointers into the raw
     PTB data, and allows minibatch iteration along these pointers.
 
-    - Hint, if the input data are images, you can modify the code as follow.
-
-    .. code-block:: python
-
-        from
-        data = np.zeros([batch_size, batch_len)
-        to
-        data = np.zeros([batch_size, batch_len, inputs.shape[1], inputs.shape[2], inputs.shape[3]])
+    - Hint, if the input data are images, i.e. ``inputs`` has shape ``[n, height, width, channels]``,
+    every batch of inputs has shape ``[batch_size, num_steps, height, width, channels]``.
 
     Parameters
     ----------
-    inputs : a list
+    inputs : a list, numpy.array or numpy.memmap
             the context in list format; note that context usually be
             represented by splitting by space, and then convert to unique
-            word IDs.
-    targets : a list
+            word IDs. A numpy.array or numpy.memmap is not copied, and the
+            batches are views of it.
+    targets : a list, numpy.array or numpy.memmap
             the context in list format; note that context usually be
             represented by splitting by space, and then convert to unique
             word IDs.
@@ -142,6 +422,13 @@ def seq_minibatches2(inputs, targets, batch_size, num_steps):
             the batch size.
     num_steps : int
             the number of unrolls. i.e. sequence_length
+    num_shards : int
+            the number of data-parallel workers, see :func:`minibatches`.
+    shard_index : int
+            the index of this worker, it iterates on the ``shard_index``-th contiguous part of the context.
+    random_offset : boolean
+            if True, skip a random number of ``[0, num_steps)`` words at the beginning of the context,
+            so that the truncated BPTT boundaries change at every epoch.
 
     Yields
     ------
@@ -159,35 +446,33 @@ def seq_minibatches2(inputs, targets, batch_size, num_steps):
     ...     x, y = batch
     ...     print(x, y)
     ...
-    ... [[  0.   1.   2.]
-    ... [ 10.  11.  12.]]
-    ... [[ 20.  21.  22.]
-    ... [ 30.  31.  32.]]
+    ... [[ 0  1  2]
+    ...  [10 11 12]]
+    ... [[20 21 22]
+    ...  [30 31 32]]
     ...
-    ... [[  3.   4.   5.]
-    ... [ 13.  14.  15.]]
-    ... [[ 23.  24.  25.]
-    ... [ 33.  34.  35.]]
+    ... [[ 3  4  5]
+    ...  [13 14 15]]
+    ... [[23 24 25]
+    ...  [33 34 35]]
     ...
-    ... [[  6.   7.   8.]
-    ... [ 16.  17.  18.]]
-    ... [[ 26.  27.  28.]
-    ... [ 36.  37.  38.]]
+    ... [[ 6  7  8]
+    ...  [16 17 18]]
+    ... [[26 27 28]
+    ...  [36 37 38]]
 
     See Also
     ---------------
     - ``tensorflow/models/rnn/ptb/reader.py``
     """
     assert len(inputs) == len(targets)
-    data_len = len(inputs)
-    batch_len = data_len // batch_size
-    # data = np.zeros([batch_size, batch_len])
-    data = np.zeros((batch_size, batch_len) + inputs.shape[1:], dtype=inputs.dtype)
-    data2 = np.zeros([batch_size, batch_len])
-
-    for i in range(batch_size):
-        data[i] = inputs[batch_len * i:batch_len * (i + 1)]
-        data2[i] = targets[batch_len * i:batch_len * (i + 1)]
+    inputs, targets = np.asarray(inputs), np.asarray(targets)
+    shard = _shard_slice(len(inputs), num_shards, shard_index)
+    inputs, targets = inputs[shard], targets[shard]
+    offset = np.random.randint(num_steps) if random_offset else 0
+    data = _batch_matrix(inputs, batch_size, offset)
+    data2 = _batch_matrix(targets, batch_size, offset)
+    batch_len = data.shape[1]
 
     epoch_size = (batch_len - 1) // num_steps
 
@@ -200,7 +485,7 @@ def seq_minibatches2(inputs, targets, batch_size, num_steps):
         yield (x, x2)
 
 
-def ptb_iterator(raw_data, batch_size, num_steps):
+def ptb_iterator(raw_data, batch_size, num_steps, num_shards=1, shard_index=0, random_offset=False):
     """
     Generate a generator that iterates on a list of words, see PTB tutorial. Yields (Returns) the source contexts and
     the target context by the given batch_size and num_steps (sequence_length).\n
@@ -214,14 +499,22 @@ def ptb_iterator(raw_data, batch_size, num_steps):
 
     Parameters
     ----------
-    raw_data : a list
+    raw_data : a list, numpy.array or numpy.memmap
             the context in list format; note that context usually be
             represented by splitting by space, and then convert to unique
-            word IDs.
+            word IDs. A numpy.array or numpy.memmap is not copied, and the
+            batches are views of it.
     batch_size : int
             the batch size.
     num_steps : int
             the number of unrolls. i.e. sequence_length
+    num_shards : int
+            the number of data-parallel workers, see :func:`minibatches`.
+    shard_index : int
+            the index of this worker, it iterates on the ``shard_index``-th contiguous part of the context.
+    random_offset : boolean
+            if True, skip a random number of ``[0, num_steps)`` words at the beginning of the context,
+            so that the truncated BPTT boundaries change at every epoch.
 
     Yields
     ------
@@ -258,13 +551,13 @@ def ptb_iterator(raw_data, batch_size, num_steps):
     ----------------
     - ``tensorflow/models/rnn/ptb/reader.py``
     """
-    raw_data = np.array(raw_data, dtype=np.int32)
+    if not isinstance(raw_data, np.ndarray):
+        raw_data = np.array(raw_data, dtype=np.int32)
+    raw_data = raw_data[_shard_slice(len(raw_data), num_shards, shard_index)]
 
-    data_len = len(raw_data)
-    batch_len = data_len // batch_size
-    data = np.zeros([batch_size, batch_len], dtype=np.int32)
-    for i in range(batch_size):
-        data[i] = raw_data[batch_len * i:batch_len * (i + 1)]
+    offset = np.random.randint(num_steps) if random_offset else 0
+    data = _batch_matrix(raw_data, batch_size, offset)
+    batch_len = data.shape[1]
 
     epoch_size = (batch_len - 1) // num_steps
 
@@ -855,8 +855,9 @@ class ReconLayer(DenseLayer):
 
     Methods
     -------
-    pretrain(self, sess, x, X_train, X_val, denoise_name=None, n_epoch=100, batch_size=128, print_freq=10, save=True, save_name='w1pre_')
-        Start to pre-train the parameters of previous DenseLayer.
+    pretrain(self, sess, x, X_train, X_val, denoise_name=None, n_epoch=100, batch_size=128, print_freq=10, save=True, save_name='w1pre_', accumulate_steps=1)
+        Start to pre-train the parameters of previous DenseLayer. If ``accumulate_steps`` > 1, the gradients of
+        ``accumulate_steps`` batches are accumulated before every update, see :class:`tl.utils.GradientAccumulator`, built once per ``accumulate_steps``.
 
     Notes
     -----
@@ -952,12 +953,13 @@ class ReconLayer(DenseLayer):
         else:
             raise Exception("Don't support the given reconstruct activation function")
 
-        self.train_op = tf.train.AdamOptimizer(
-            learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-08, use_locking=False).minimize(
-                self.cost, var_list=self.train_params)
+        self.optimizer = tf.train.AdamOptimizer(learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-08, use_locking=False)
+        self.train_op = self.optimizer.minimize(self.cost, var_list=self.train_params)
         # self.train_op = tf.train.GradientDescentOptimizer(1.0).minimize(self.cost, var_list=self.train_params)
+        self.accumulators = {}  # the GradientAccumulator of every accumulate_steps of pretrain()
 
-    def pretrain(self, sess, x, X_train, X_val, denoise_name=None, n_epoch=100, batch_size=128, print_freq=10, save=True, save_name='w1pre_'):
+    def pretrain(self, sess, x, X_train, X_val, denoise_name=None, n_epoch=100, batch_size=128, print_freq=10, save=True, save_name='w1pre_',
+                 accumulate_steps=1):
         # ====================================================
         #
         # You need to modify the cost function in __init__() so as to
@@ -972,21 +974,43 @@ class ReconLayer(DenseLayer):
         else:
             logging.info("     no denoising layer")
 
+        # accumulate the gradients of accumulate_steps batches before every update, the accumulator is
+        # built once, the optimizer slots were created by train_op, only the accumulators are new
+        if accumulate_steps > 1:
+            logging.info("     accumulate gradients of %d batches" % accumulate_steps)
+            if accumulate_steps not in self.accumulators:
+                accumulator = utils.GradientAccumulator(self.optimizer, self.cost, self.train_params, n_steps=accumulate_steps)
+                sess.run(tf.variables_initializer(accumulator.accumulators + [accumulator.count]))
+                self.accumulators[accumulate_steps] = accumulator
+            accumulator = self.accumulators[accumulate_steps]
+            sess.run(accumulator.reset_op)  # discard the gradients left by an interrupted call
+
+        # only the denoising layer is enabled during pretraining
+        dp_dict = utils.inference_feed_dict(self)
+        if denoise_name:
+            train_dp_dict = dict(dp_dict)
+            train_dp_dict[set_keep[denoise_name]] = dp_denoise
+        else:
+            train_dp_dict = dp_dict
+
+        n_step = 0
         for epoch in range(n_epoch):
             start_time = time.time()
             for X_train_a, _ in iterate.minibatches(X_train, X_train, batch_size, shuffle=True):
-                dp_dict = utils.dict_to_one(self.all_drop)
-                if denoise_name:
-                    dp_dict[set_keep[denoise_name]] = dp_denoise
                 feed_dict = {x: X_train_a}
-                feed_dict.update(dp_dict)
-                sess.run(self.train_op, feed_dict=feed_dict)
+                feed_dict.update(train_dp_dict)
+                if accumulate_steps > 1:
+                    n_step += 1
+                    sess.run(accumulator.apply_op if n_step % accumulate_steps == 0 else accumulator.accumulate_op, feed_dict=feed_dict)
+                else:
+                    sess.run(self.train_op, feed_dict=feed_dict)
+            if accumulate_steps > 1 and epoch + 1 == n_epoch and n_step % accumulate_steps != 0:
+                sess.run(accumulator.flush_op)  # apply the gradients of the last incomplete accumulation
 
             if epoch + 1 == 1 or (epoch + 1) % print_freq == 0:
                 logging.info("Epoch %d of %d took %fs" % (epoch + 1, n_epoch, time.time() - start_time))
                 train_loss, n_batch = 0, 0
                 for X_train_a, _ in iterate.minibatches(X_train, X_train, batch_size, shuffle=True):
-                    dp_dict = utils.dict_to_one(self.all_drop)
                     feed_dict = {x: X_train_a}
                     feed_dict.update(dp_dict)
                     err = sess.run(self.cost, feed_dict=feed_dict)
@@ -995,7 +1019,6 @@ class ReconLayer(DenseLayer):
                 logging.info("   train loss: %f" % (train_loss / n_batch))
                 val_loss, n_batch = 0, 0
                 for X_val_a, _ in iterate.minibatches(X_val, X_val, batch_size, shuffle=True):
-                    dp_dict = utils.dict_to_one(self.all_drop)
                     feed_dict = {x: X_val_a}
                     feed_dict.update(dp_dict)
                     err = sess.run(self.cost, feed_dict=feed_dict)
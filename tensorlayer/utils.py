@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
+import json
 import math
+import multiprocessing
+import os
 import random
+import threading
 import time
 
 import numpy as np
 import tensorflow as tf
 import tensorlayer as tl
+from six.moves import queue
 
 from . import iterate
 from . import _logging as logging
+from ._metrics import StreamingMetrics, evaluation
 
 
 def fit(sess,
@@ -29,7 +35,12 @@ def fit(sess,
         tensorboard=False,
         tensorboard_epoch_freq=5,
         tensorboard_weight_histograms=True,
-        tensorboard_graph_vis=True):
+        tensorboard_graph_vis=True,
+        callbacks=None,
+        eval_train_fused=False,
+        eval_train_subsample=None,
+        tensorboard_step_freq=10,
+        profiler=None):
     """Traing a given non time-series network by the given cost function, training data, batch_size, n_epoch etc.
 
     Parameters
@@ -38,16 +49,18 @@ def fit(sess,
         sess = tf.InteractiveSession()
     network : a TensorLayer layer
         the network will be trained
-    train_op : a TensorFlow optimizer
-        like tf.train.AdamOptimizer
-    X_train : numpy array
-        the input of training data
-    y_train : numpy array
-        the target of training data
-    x : placeholder
-        for inputs
-    y_ : placeholder
-        for targets
+    train_op : a TensorFlow optimizer or a :class:`GradientAccumulator`
+        like tf.train.AdamOptimizer. With a :class:`GradientAccumulator`, the gradients of every training step
+        are accumulated, and applied once every ``n_steps`` training steps.
+    X_train : numpy array, a tuple or dict of numpy array, or a graph-side input pipeline
+        the input of training data, or a ``tf.data.Iterator`` (or its initializer operation) whose ``get_next``
+        tensors are the inputs of the network, see Notes
+    y_train : numpy array, a tuple or dict of numpy array, or None
+        the target of training data, None for a graph-side input pipeline
+    x : placeholder, a tuple or dict of placeholder, or None
+        for inputs, with the same structure as ``X_train``
+    y_ : placeholder, a tuple or dict of placeholder, or None
+        for targets, with the same structure as ``y_train``, or the ``get_next`` tensors of targets of a graph-side input pipeline
     acc : the TensorFlow expression of accuracy (or other metric) or None
         if None, would not display the metric
     batch_size : int
@@ -56,10 +69,10 @@ def fit(sess,
         the number of training epochs
     print_freq : int
         display the training information every ``print_freq`` epochs
-    X_val : numpy array or None
+    X_val : numpy array, a tuple or dict of numpy array, a graph-side input pipeline, or None
         the input of validation data
-    y_val : numpy array or None
-        the target of validation data
+    y_val : numpy array, a tuple or dict of numpy array, or None
+        the target of validation data, None for a graph-side input pipeline
     eval_train : boolean
         if X_val and y_val are not None, it refects whether to evaluate the training data
     tensorboard : boolean
@@ -73,6 +86,22 @@ def fit(sess,
         of the weight histograms every tensorboard_epoch_freq epoch (default True)
     tensorboard_graph_vis : boolean
         if True stores the graph in the tensorboard summaries saved to log/ (default True)
+    callbacks : list of :class:`Callback` or None
+        the callbacks called at the beginning and end of the training, of every epoch and of every batch.
+        The callbacks with ``asynchronous=True`` run on a background thread, so they never block the training steps.
+    eval_train_fused : boolean
+        if True, the training loss and ``acc`` are accumulated from the training steps themselves by fetching
+        ``[cost, acc, train_op]`` together, instead of running another pass over the training data for ``eval_train``.
+        Note that these metrics are computed with the noise layers enabled and while the parameters are updated. (default False)
+    eval_train_subsample : int or None
+        if not None, ``eval_train`` evaluates a random subsample of this number of training examples instead of
+        the whole training data, or all of them if there are fewer. The subsample is drawn by its own random
+        generator, so that it does not change the shuffling of the training data. (default None)
+    tensorboard_step_freq : int
+        in the epochs that store tensorboard data, the summaries are fetched together with every ``tensorboard_step_freq``
+        training step, and of every ``tensorboard_step_freq`` validation batch. (default 10)
+    profiler : :class:`StepProfiler` or None
+        if not None, records the wall time of the phases of the training, and reports them at the end of the training. (default None)
 
     Examples
     --------
@@ -85,13 +114,54 @@ def fit(sess,
     ...            X_val=X_val, y_val=y_val, eval_train=False,
     ...            tensorboard=True, tensorboard_weight_histograms=True, tensorboard_graph_vis=True)
 
+    - Multiple inputs, the placeholders have the same structure as the data
+    >>> tl.utils.fit(sess, network, train_op, cost, (X1_train, X2_train), y_train, (x1, x2), y_,
+    ...            acc=acc, batch_size=500, n_epoch=200, print_freq=5,
+    ...            X_val=(X1_val, X2_val), y_val=y_val, eval_train=False)
+
+    - Callbacks, e.g. logging into TensorDB on a background thread
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_,
+    ...            acc=acc, batch_size=500, n_epoch=200, print_freq=5,
+    ...            X_val=X_val, y_val=y_val, callbacks=[tl.db.DBLogger(db, network)])
+
+    - Report the training metrics of the training steps, without another pass over the training data
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_,
+    ...            acc=acc, batch_size=500, n_epoch=200, print_freq=5,
+    ...            X_val=X_val, y_val=y_val, eval_train_fused=True)
+
+    - Graph-side input pipeline, the network is built on the ``get_next`` tensors and nothing is fed
+    >>> iterator = tf.data.Iterator.from_structure(train_dataset.output_types, train_dataset.output_shapes)
+    >>> x, y_ = iterator.get_next()
+    >>> network = ...  # built on x, with the cost on y_
+    >>> tl.utils.fit(sess, network, train_op, cost, iterator.make_initializer(train_dataset), None, x, y_,
+    ...            acc=acc, batch_size=500, n_epoch=200, print_freq=5,
+    ...            X_val=iterator.make_initializer(val_dataset), y_val=None)
+
+    - Profile the phases of the training steps, and trace the 100th step
+    >>> profiler = tl.utils.StepProfiler(trace_steps=[100], json_path='logs/profile.json')
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_,
+    ...            acc=acc, batch_size=500, n_epoch=10, profiler=profiler)
+
     Notes
     --------
+    The tensorboard summaries of the training data are computed by the training steps themselves, so with the noise
+    layers enabled. The weight histograms are computed once per tensorboard epoch, and the events are written
+    to the logs/ directory on a background thread.
+
+    A graph-side input pipeline is a ``tf.data.Iterator`` or the initializer operation of one, e.g. returned by
+    ``make_initializer`` of a reinitializable iterator. It is initialized at every pass and run until
+    ``tf.errors.OutOfRangeError``, i.e. the dataset should not repeat. The training steps only feed the keep
+    probabilities of the noise layers. The training metrics are weighted by ``batch_size``, and ``eval_train_subsample``
+    is not supported. Any other TensorFlow operation or tensor raises a ``TypeError``.
+
     If tensorboard=True, the global_variables_initializer will be run inside the fit function
     in order to initalize the automatically generated summary nodes used for tensorboard visualization,
     thus tf.global_variables_initializer().run() before the fit() call will be undefined.
     """
-    assert X_train.shape[0] >= batch_size, "Number of training examples should be bigger than the batch size"
+    graph_input = _is_graph_input(X_train)
+    if not graph_input:
+        assert iterate._data_len(X_train) >= batch_size, "Number of training examples should be bigger than the batch size"
+    has_val = (X_val is not None) and (y_val is not None or _is_graph_input(X_val))
 
     if (tensorboard):
         logging.info("Setting up tensorboard ...")
@@ -106,96 +176,172 @@ def fit(sess,
             else:
                 train_writer = tf.summary.FileWriter('logs/train')
                 val_writer = tf.summary.FileWriter('logs/validation')
+            # add_summary serializes the events, so it runs on background threads instead of between the steps
+            train_writer = _AsyncWorker(train_writer)
+            val_writer = _AsyncWorker(val_writer)
 
-        #Set up summary nodes
+        #Set up summary nodes, the weight histograms do not depend on the batch
+        #so they are kept out of the summaries merged into the steps
+        histograms = []
         if (tensorboard_weight_histograms):
             for param in network.all_params:
                 if hasattr(tf, 'summary') and hasattr(tf.summary, 'histogram'):
                     logging.info('Param name %s' % param.name)
-                    tf.summary.histogram(param.name, param)
+                    histograms.append(tf.summary.histogram(param.name, param, collections=[]))
 
         if hasattr(tf, 'summary') and hasattr(tf.summary, 'histogram'):
             tf.summary.scalar('cost', cost)
 
         merged = tf.summary.merge_all()
+        merged_histograms = tf.summary.merge(histograms) if histograms else None
 
         #Initalize all variables and summaries
         tl.layers.initialize_global_variables(sess)
         logging.info("Finished! use $tensorboard --logdir=logs/ to start server")
 
+    # the iterators own their index array and batch buffers, and are reused at every epoch;
+    # the evaluation passes do not need shuffling, so their batches are views of the data.
+    if graph_input:
+        train_batches = eval_train_batches = X_train
+    else:
+        train_batches = iterate.MinibatchIterator(X_train, y_train, batch_size, shuffle=True)
+        eval_train_batches = iterate.MinibatchIterator(X_train, y_train, batch_size, shuffle=False, allow_smaller_final_batch=True)
+    train_feed_dict = training_feed_dict(network)  # enable noise layers
+    if has_val:
+        if _is_graph_input(X_val):
+            val_batches = X_val
+        else:
+            val_batches = iterate.MinibatchIterator(X_val, y_val, batch_size, shuffle=False, allow_smaller_final_batch=True)
+
+    if isinstance(train_op, GradientAccumulator):
+        accumulator = train_op
+        train_op = accumulator.accumulate_op
+        sess.run(accumulator.reset_op)  # discard the gradients left over by a previous training
+    else:
+        accumulator = None
+    train_fetches = {'loss': cost, 'train_op': train_op}
+    if eval_train_fused and acc is not None:
+        train_fetches['acc'] = acc
+    if tensorboard and hasattr(tf, 'summary'):
+        summary_fetches = dict(train_fetches, summary=merged)
+
+    callbacks = _CallbackDispatcher(callbacks)
+    if profiler is None:
+        profiler = _NULL_PROFILER
+    profiler.reset()
     logging.info("Start training the network ...")
-    start_time_begin = time.time()
-    tensorboard_train_index, tensorboard_val_index = 0, 0
-    for epoch in range(n_epoch):
-        start_time = time.time()
-        loss_ep = 0
-        n_step = 0
-        for X_train_a, y_train_a in iterate.minibatches(X_train, y_train, batch_size, shuffle=True):
-            feed_dict = {x: X_train_a, y_: y_train_a}
-            feed_dict.update(network.all_drop)  # enable noise layers
-            loss, _ = sess.run([cost, train_op], feed_dict=feed_dict)
-            loss_ep += loss
-            n_step += 1
-        loss_ep = loss_ep / n_step
-
-        if tensorboard and hasattr(tf, 'summary'):
-            if epoch + 1 == 1 or (epoch + 1) % tensorboard_epoch_freq == 0:
-                for X_train_a, y_train_a in iterate.minibatches(X_train, y_train, batch_size, shuffle=True):
-                    dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-                    feed_dict = {x: X_train_a, y_: y_train_a}
-                    feed_dict.update(dp_dict)
-                    result = sess.run(merged, feed_dict=feed_dict)
-                    train_writer.add_summary(result, tensorboard_train_index)
+    # the background threads of the callbacks and summary writers are drained even if the training fails
+    try:
+        callbacks('on_train_begin', {})
+        start_time_begin = time.time()
+        tensorboard_train_index, tensorboard_val_index = 0, 0
+        n_train_step = 0  # the accumulated gradients are carried over the epochs
+        subsample_rnd = np.random.RandomState()  # the subsamples of eval_train_subsample do not use the global generator
+        for epoch in range(n_epoch):
+            start_time = time.time()
+            callbacks('on_epoch_begin', epoch, {})
+            train_metrics = StreamingMetrics()
+            tensorboard_epoch = tensorboard and hasattr(tf, 'summary') and (epoch + 1 == 1 or (epoch + 1) % tensorboard_epoch_freq == 0)
+            n_step = 0
+            for feed_dict, _ in _batch_feeds(sess, train_batches, x, y_, train_feed_dict, profiler):
+                if callbacks:
+                    with profiler.phase('callbacks'):
+                        callbacks('on_batch_begin', n_step, {})
+                    step_start_time = time.time()
+                summary_step = tensorboard_epoch and n_step % tensorboard_step_freq == 0
+                fetches = summary_fetches if summary_step else train_fetches
+                if accumulator is not None and (n_train_step + 1) % accumulator.n_steps == 0:
+                    fetches = dict(fetches, train_op=accumulator.apply_op)
+                try:
+                    results = profiler.run(sess, fetches, feed_dict=feed_dict, n_examples=batch_size)
+                except tf.errors.OutOfRangeError:
+                    # the end of a graph-side input pipeline is only known by running the step, whose
+                    # on_batch_begin is closed by an on_batch_end without examples
+                    if callbacks:
+                        with profiler.phase('callbacks'):
+                            callbacks('on_batch_end', n_step, {'size': 0, 'step_time': time.time() - step_start_time})
+                    break
+                n_train_step += 1
+                if summary_step:
+                    train_writer.put('add_summary', (results.pop('summary'), tensorboard_train_index))
                     tensorboard_train_index += 1
-                if (X_val is not None) and (y_val is not None):
-                    for X_val_a, y_val_a in iterate.minibatches(X_val, y_val, batch_size, shuffle=True):
-                        dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-                        feed_dict = {x: X_val_a, y_: y_val_a}
-                        feed_dict.update(dp_dict)
-                        result = sess.run(merged, feed_dict=feed_dict)
-                        val_writer.add_summary(result, tensorboard_val_index)
-                        tensorboard_val_index += 1
-
-        if epoch + 1 == 1 or (epoch + 1) % print_freq == 0:
-            if (X_val is not None) and (y_val is not None):
-                logging.info("Epoch %d of %d took %fs" % (epoch + 1, n_epoch, time.time() - start_time))
-                if eval_train is True:
-                    train_loss, train_acc, n_batch = 0, 0, 0
-                    for X_train_a, y_train_a in iterate.minibatches(X_train, y_train, batch_size, shuffle=True):
-                        dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-                        feed_dict = {x: X_train_a, y_: y_train_a}
-                        feed_dict.update(dp_dict)
+                del results['train_op']
+                train_metrics.update(n_examples=batch_size, **results)
+                if callbacks:
+                    results['size'] = batch_size
+                    results['step_time'] = time.time() - step_start_time
+                    with profiler.phase('callbacks'):
+                        callbacks('on_batch_end', n_step, results)
+                n_step += 1
+            loss_ep = train_metrics.loss
+            epoch_logs = {'loss': loss_ep}
+
+            if tensorboard_epoch:
+                with profiler.phase('summary'):
+                    if merged_histograms is not None:
+                        train_writer.put('add_summary', (sess.run(merged_histograms), tensorboard_train_index))
+                    if has_val:
+                        dp_dict = inference_feed_dict(network)  # disable noise layers
+                        # the batches of a graph-side input pipeline cannot be skipped without running them
+                        step_freq = 1 if _is_graph_input(val_batches) else tensorboard_step_freq
+                        for i, (feed_dict, _) in enumerate(_batch_feeds(sess, val_batches, x, y_, dp_dict)):
+                            if i % step_freq != 0:
+                                continue
+                            try:
+                                result = sess.run(merged, feed_dict=feed_dict)
+                            except tf.errors.OutOfRangeError:
+                                break
+                            val_writer.put('add_summary', (result, tensorboard_val_index))
+                            tensorboard_val_index += 1
+
+            if epoch + 1 == 1 or (epoch + 1) % print_freq == 0:
+                with profiler.phase('eval'):
+                    if has_val:
+                        logging.info("Epoch %d of %d took %fs" % (epoch + 1, n_epoch, time.time() - start_time))
+                        if eval_train is True:
+                            if eval_train_fused:
+                                metrics = train_metrics
+                            elif eval_train_subsample is not None and not graph_input:
+                                n_examples = iterate._data_len(X_train)
+                                idx = np.sort(subsample_rnd.choice(n_examples, min(eval_train_subsample, n_examples), replace=False))
+                                batches = iterate.minibatches(
+                                    iterate._data_take(X_train, idx), iterate._data_take(y_train, idx), batch_size, allow_smaller_final_batch=True)
+                                metrics = _evaluate(sess, network, batches, x, y_, cost=cost, acc=acc)
+                            else:
+                                metrics = _evaluate(sess, network, eval_train_batches, x, y_, cost=cost, acc=acc)
+                            logging.info("   train loss: %f" % metrics.loss)
+                            epoch_logs['train_loss'] = metrics.loss
+                            if acc is not None:
+                                logging.info("   train acc: %f" % metrics.acc)
+                                epoch_logs['acc'] = metrics.acc
+                        metrics = _evaluate(sess, network, val_batches, x, y_, cost=cost, acc=acc)
+                        logging.info("   val loss: %f" % metrics.loss)
+                        epoch_logs['val_loss'] = metrics.loss
                         if acc is not None:
-                            err, ac = sess.run([cost, acc], feed_dict=feed_dict)
-                            train_acc += ac
-                        else:
-                            err = sess.run(cost, feed_dict=feed_dict)
-                        train_loss += err
-                        n_batch += 1
-                    logging.info("   train loss: %f" % (train_loss / n_batch))
-                    if acc is not None:
-                        logging.info("   train acc: %f" % (train_acc / n_batch))
-                val_loss, val_acc, n_batch = 0, 0, 0
-                for X_val_a, y_val_a in iterate.minibatches(X_val, y_val, batch_size, shuffle=True):
-                    dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-                    feed_dict = {x: X_val_a, y_: y_val_a}
-                    feed_dict.update(dp_dict)
-                    if acc is not None:
-                        err, ac = sess.run([cost, acc], feed_dict=feed_dict)
-                        val_acc += ac
+                            logging.info("   val acc: %f" % metrics.acc)
+                            epoch_logs['val_acc'] = metrics.acc
                     else:
-                        err = sess.run(cost, feed_dict=feed_dict)
-                    val_loss += err
-                    n_batch += 1
-                logging.info("   val loss: %f" % (val_loss / n_batch))
-                if acc is not None:
-                    logging.info("   val acc: %f" % (val_acc / n_batch))
-            else:
-                logging.info("Epoch %d of %d took %fs, loss %f" % (epoch + 1, n_epoch, time.time() - start_time, loss_ep))
-    logging.info("Total training time: %fs" % (time.time() - start_time_begin))
+                        logging.info("Epoch %d of %d took %fs, loss %f" % (epoch + 1, n_epoch, time.time() - start_time, loss_ep))
+            epoch_logs['epoch_time'] = time.time() - start_time
+            callbacks('on_epoch_end', epoch, epoch_logs)
+            if callbacks.stop_training:
+                logging.info("Training stopped by a callback after epoch %d" % (epoch + 1))
+                break
+        if accumulator is not None and n_train_step % accumulator.n_steps != 0:
+            sess.run(accumulator.flush_op)  # apply the gradients of the last incomplete accumulation
+        logging.info("Total training time: %fs" % (time.time() - start_time_begin))
+        callbacks('on_train_end', {})
+        profiler.report()
+    finally:
+        try:
+            callbacks.close()
+        finally:
+            if tensorboard and hasattr(tf, 'summary') and hasattr(tf.summary, 'FileWriter'):
+                # flushes the pending events and releases the event files
+                _close_workers((train_writer, val_writer), last_call=('close', ()))
 
 
-def test(sess, network, acc, X_test, y_test, x, y_, batch_size, cost=None):
+def test(sess, network, acc, X_test, y_test, x, y_, batch_size, cost=None, y_op=None, n_classes=None):
     """
     Test a given non time-series network by the given test data and metric.
 
@@ -207,51 +353,51 @@ def test(sess, network, acc, X_test, y_test, x, y_, batch_size, cost=None):
         the network will be trained
     acc : the TensorFlow expression of accuracy (or other metric) or None
         if None, would not display the metric
-    X_test : numpy array
-        the input of test data
-    y_test : numpy array
-        the target of test data
-    x : placeholder
-        for inputs
-    y_ : placeholder
-        for targets
+    X_test : numpy array, a tuple or dict of numpy array, or a graph-side input pipeline
+        the input of test data, or a ``tf.data.Iterator`` (or its initializer operation), see :func:`fit`
+    y_test : numpy array, a tuple or dict of numpy array, or None
+        the target of test data, None for a graph-side input pipeline
+    x : placeholder, a tuple or dict of placeholder, or None
+        for inputs, with the same structure as ``X_test``
+    y_ : placeholder, a tuple or dict of placeholder, or None
+        for targets, with the same structure as ``y_test``, or the ``get_next`` tensors of targets of a graph-side input pipeline
     batch_size : int or None
         batch size for testing, when dataset is large, we should use minibatche for testing.
         when dataset is small, we can set it to None.
     cost : the TensorFlow expression of cost or None
         if None, would not display the cost
+    y_op : the TensorFlow expression of the predicted class ids or None
+        if not None, the confusion matrix, precision, recall and F1-score are accumulated batch by batch
+    n_classes : int or None
+        number of classes, required if ``y_op`` is not None
+
+    Returns
+    --------
+    metrics : :class:`StreamingMetrics`
+        The loss and accuracy are weighted by the number of examples of every batch, the final batch can be smaller.
 
     Examples
     --------
     >>> see tutorial_mnist_simple.py
     >>> tl.utils.test(sess, network, acc, X_test, y_test, x, y_, batch_size=None, cost=cost)
+    >>> metrics = tl.utils.test(sess, network, acc, X_test, y_test, x, y_, batch_size=500, cost=cost, y_op=y_op, n_classes=10)
+    >>> print(metrics.confusion_matrix, metrics.f1_macro)
     """
     logging.info('Start testing the network ...')
-    if batch_size is None:
-        dp_dict = dict_to_one(network.all_drop)
-        feed_dict = {x: X_test, y_: y_test}
-        feed_dict.update(dp_dict)
-        if cost is not None:
-            logging.info("   test loss: %f" % sess.run(cost, feed_dict=feed_dict))
-        logging.info("   test acc: %f" % sess.run(acc, feed_dict=feed_dict))
-        # logging.info("   test acc: %f" % np.mean(y_test == sess.run(y_op,
-        #                                           feed_dict=feed_dict)))
+    if _is_graph_input(X_test):
+        batches = X_test
+    elif batch_size is None:
+        batches = [(X_test, y_test)]
     else:
-        test_loss, test_acc, n_batch = 0, 0, 0
-        for X_test_a, y_test_a in iterate.minibatches(X_test, y_test, batch_size, shuffle=True):
-            dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-            feed_dict = {x: X_test_a, y_: y_test_a}
-            feed_dict.update(dp_dict)
-            if cost is not None:
-                err, ac = sess.run([cost, acc], feed_dict=feed_dict)
-                test_loss += err
-            else:
-                ac = sess.run(acc, feed_dict=feed_dict)
-            test_acc += ac
-            n_batch += 1
-        if cost is not None:
-            logging.info("   test loss: %f" % (test_loss / n_batch))
-        logging.info("   test acc: %f" % (test_acc / n_batch))
+        batches = iterate.minibatches(X_test, y_test, batch_size, shuffle=False, allow_smaller_final_batch=True)
+    metrics = _evaluate(sess, network, batches, x, y_, cost=cost, acc=acc, y_op=y_op, n_classes=n_classes)
+    if cost is not None:
+        logging.info("   test loss: %f" % metrics.loss)
+    if acc is not None:
+        logging.info("   test acc: %f" % metrics.acc)
+    if y_op is not None:
+        logging.info("   test f1-score(macro): %f" % metrics.f1_macro)
+    return metrics
 
 
 def predict(sess, network, X, x, y_op, batch_size=None):
@@ -264,15 +410,17 @@ def predict(sess, network, X, x, y_op, batch_size=None):
         sess = tf.InteractiveSession()
     network : a TensorLayer layer
         the network will be trained
-    X : numpy array
-        the input
-    x : placeholder
-        for inputs
-    y_op : placeholder
-        the argmax expression of softmax outputs
+    X : numpy array, a tuple or dict of numpy array, or a graph-side input pipeline
+        the input, or a ``tf.data.Iterator`` (or its initializer operation), see :func:`fit`
+    x : placeholder, a tuple or dict of placeholder, or None
+        for inputs, with the same structure as ``X``
+    y_op : a TensorFlow expression, or a list of TensorFlow expressions
+        the argmax expression of softmax outputs, or any outputs whose first dimension is the batch.
+        If a list is given, a list of results is returned in the same order.
     batch_size : int or None
         batch size for prediction, when dataset is large, we should use minibatche for prediction.
         when dataset is small, we can set it to None.
+        The results are preallocated from the first batch and filled in place, the last batch can be smaller.
 
     Examples
     --------
@@ -280,78 +428,684 @@ def predict(sess, network, X, x, y_op, batch_size=None):
     >>> y = network.outputs
     >>> y_op = tf.argmax(tf.nn.softmax(y), 1)
     >>> print(tl.utils.predict(sess, network, X_test, x, y_op))
+    >>> y_pred, y_prob = tl.utils.predict(sess, network, X_test, x, [y_op, tf.nn.softmax(y)], batch_size=1000)
     """
-    if batch_size is None:
-        dp_dict = dict_to_one(network.all_drop)  # disable noise layers
-        feed_dict = {
-            x: X,
-        }
+    dp_dict = inference_feed_dict(network)  # disable noise layers
+    if _is_graph_input(X):
+        # the number of examples is unknown, the results of the batches are concatenated at the end
+        y_ops = list(y_op) if isinstance(y_op, (list, tuple)) else [y_op]
+        results = [[] for _ in y_ops]
+        for feed_dict, _ in _batch_feeds(sess, X, None, None, dp_dict):
+            try:
+                results_a = sess.run(y_ops, feed_dict=feed_dict)
+            except tf.errors.OutOfRangeError:
+                break
+            for result, result_a in zip(results, results_a):
+                result.append(result_a)
+        if not results[0]:
+            return None
+        results = [np.concatenate(result) for result in results]
+        if isinstance(y_op, (list, tuple)):
+            return results
+        return results[0]
+    elif batch_size is None:
+        feed_dict = _feed_dict(x, X)
         feed_dict.update(dp_dict)
         return sess.run(y_op, feed_dict=feed_dict)
     else:
-        result = None
-        for X_a, _ in iterate.minibatches(X, X, batch_size, shuffle=False):
-            dp_dict = dict_to_one(network.all_drop)
-            feed_dict = {
-                x: X_a,
-            }
+        y_ops = list(y_op) if isinstance(y_op, (list, tuple)) else [y_op]
+        n_examples = iterate._data_len(X)
+        results = None
+        # the last batch may be smaller than batch_size, it is handled as any other batch
+        for start_idx in range(0, n_examples, batch_size):
+            end_idx = min(start_idx + batch_size, n_examples)
+            feed_dict = _feed_dict(x, iterate._data_take(X, slice(start_idx, end_idx)))
             feed_dict.update(dp_dict)
-            result_a = sess.run(y_op, feed_dict=feed_dict)
-            if result is None:
-                result = result_a
-            else:
-                result = np.vstack((result, result_a))  # TODO: https://github.com/tensorlayer/tensorlayer/issues/288
-        if result is None:
-            if len(X) % batch_size != 0:
-                dp_dict = dict_to_one(network.all_drop)
-                feed_dict = {
-                    x: X[-(len(X) % batch_size):, :],
-                }
-                feed_dict.update(dp_dict)
-                result_a = sess.run(y_op, feed_dict=feed_dict)
-                result = result_a
-        else:
-            if len(X) != len(result) and len(X) % batch_size != 0:
-                dp_dict = dict_to_one(network.all_drop)
-                feed_dict = {
-                    x: X[-(len(X) % batch_size):, :],
-                }
-                feed_dict.update(dp_dict)
-                result_a = sess.run(y_op, feed_dict=feed_dict)
-                result = np.vstack((result, result_a))  # TODO: https://github.com/tensorlayer/tensorlayer/issues/288
-        return result
+            results_a = sess.run(y_ops, feed_dict=feed_dict)
+            if results is None:
+                # preallocate the outputs from the shape and dtype of the first batch, instead of
+                # growing them batch by batch, see https://github.com/tensorlayer/tensorlayer/issues/288
+                results = [np.empty((n_examples, ) + np.shape(r)[1:], dtype=np.asarray(r).dtype) for r in results_a]
+            for result, result_a in zip(results, results_a):
+                result[start_idx:end_idx] = result_a
+        if results is None or isinstance(y_op, (list, tuple)):
+            return results
+        return results[0]
 
 
-## Evaluation
-def evaluation(y_test=None, y_predict=None, n_classes=None):
+def data_parallel(model_fn, x, y_, optimizer, n_towers=None, devices=None):
+    """Replicate a network on several devices (towers) with shared parameters for data-parallel training
+    on a single machine, e.g. on all the cores of a CPU host. Every batch fed into ``x`` and ``y_`` is split
+    across the towers, the gradients of the towers are averaged and applied once. The returned network, train_op,
+    cost and acc can be used as usual with :func:`fit`, :func:`test` and :func:`predict`.
+
+    Parameters
+    ----------
+    model_fn : a function
+        ``model_fn(x, y_, reuse)`` builds the network on the inputs ``x`` and the targets ``y_`` of a tower and
+        returns ``(network, cost)`` or ``(network, cost, acc)``. It is called with ``reuse=False`` for the first tower
+        and ``reuse=True`` for the others, which reuse its variables, see :func:`tl.layers.set_name_reuse`.
+    x : placeholder, or a tuple or dict of placeholder
+        for inputs of the whole batch
+    y_ : placeholder, or a tuple or dict of placeholder
+        for targets of the whole batch
+    optimizer : a TensorFlow optimizer
+        like tf.train.AdamOptimizer(0.001)
+    n_towers : int or None
+        the number of towers, default is the number of devices, or the number of CPU cores if ``devices`` is None.
+    devices : list of str or None
+        the device of every tower, default is ``'/cpu:0'`` for all the towers.
+
+    Returns
+    --------
+    network : a TensorLayer layer
+        the network of the first tower, with the ``all_params`` and ``all_drop`` of all the towers,
+        and with the ``outputs`` of the towers concatenated in the order of the batch.
+    train_op : the TensorFlow operation that applies the averaged gradients
+    cost : the TensorFlow expression of the cost of the whole batch
+    acc : the TensorFlow expression of the accuracy of the whole batch, or None if ``model_fn`` does not return it
+
+    Examples
+    --------
+    >>> def mlp(x, y_, reuse):
+    >>>     with tf.variable_scope("MLP", reuse=reuse):
+    >>>         network = tl.layers.InputLayer(x, name='input')
+    >>>         network = tl.layers.DropoutLayer(network, keep=0.8, name='drop1')
+    >>>         network = tl.layers.DenseLayer(network, 10, tf.identity, name='output')
+    >>>     cost = tl.cost.cross_entropy(network.outputs, y_, name='cost')
+    >>>     acc = tf.reduce_mean(tf.cast(tf.equal(tf.argmax(network.outputs, 1), y_), tf.float32))
+    >>>     return network, cost, acc
+    >>> network, train_op, cost, acc = tl.utils.data_parallel(mlp, x, y_, tf.train.AdamOptimizer(0.0001), n_towers=4)
+    >>> sess = tf.Session()
+    >>> tl.layers.initialize_global_variables(sess)
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_, acc=acc, batch_size=512)
+
+    Notes
+    --------
+    The towers do not depend on each other, so the session runs them concurrently on its inter-op threads, even
+    when they are all placed on ``'/cpu:0'``. To place them on several devices, e.g. ``['/gpu:0', '/gpu:1']``,
+    create the session with ``tf.ConfigProto(allow_soft_placement=True)`` so that the towers of missing devices fall
+    back to the available ones. The batch is split into towers of equal size up to one example, the towers left
+    empty by a batch smaller than ``n_towers`` do not contribute to the cost and the gradients.
     """
-    Input the predicted results, targets results and
-    the number of class, return the confusion matrix, F1-score of each class,
-    accuracy and macro F1-score.
+    if devices is None:
+        if n_towers is None:
+            n_towers = multiprocessing.cpu_count()
+        devices = ['/cpu:0'] * n_towers
+    elif n_towers is None:
+        n_towers = len(devices)
+    if len(devices) != n_towers:
+        raise ValueError("the number of devices %d is not the number of towers %d" % (len(devices), n_towers))
+
+    # split the batch into towers of sizes (batch_size + i) // n_towers, which sum up to batch_size
+    batch_size = tf.shape(_first_tensor(x))[0]
+    sizes = (batch_size + tf.range(n_towers)) // n_towers
+    weights = tf.cast(sizes, tf.float32) / tf.cast(batch_size, tf.float32)
+    xs = _split_towers(x, sizes, n_towers)
+    ys = _split_towers(y_, sizes, n_towers)
+
+    name_reuse = tl.layers.set_keep['name_reuse']
+    networks, costs, accs, tower_grads = [], [], [], []
+    try:
+        for i, device in enumerate(devices):
+            with tf.device(device), tf.name_scope('tower_%d' % i):
+                with tf.variable_scope(tf.get_variable_scope(), reuse=True if i > 0 else None):
+                    tl.layers.set_name_reuse(name_reuse or i > 0)
+                    outputs = model_fn(xs[i], ys[i], i > 0)
+                networks.append(outputs[0])
+                # the gradient of the weighted cost of a tower is its share of the gradient of the batch,
+                # the mean cost of an empty tower is NaN, so it is masked out with its gradients
+                not_empty = sizes[i] > 0
+                costs.append(_mask_empty(outputs[1] * weights[i], not_empty))
+                grads_and_vars = optimizer.compute_gradients(costs[-1], var_list=networks[0].all_params)
+                tower_grads.append([(_mask_empty(g, not_empty), v) for g, v in grads_and_vars])
+                if len(outputs) > 2 and outputs[2] is not None:
+                    accs.append(_mask_empty(outputs[2] * weights[i], not_empty))
+    finally:
+        tl.layers.set_name_reuse(name_reuse)
+
+    with tf.name_scope('towers'):
+        grads_and_vars = []
+        for tower_gvs in zip(*tower_grads):
+            grads = [g for g, _ in tower_gvs if g is not None]
+            if grads:
+                grads_and_vars.append((tf.add_n(grads), tower_gvs[0][1]))
+        train_op = optimizer.apply_gradients(grads_and_vars)
+        cost = tf.add_n(costs)
+        acc = tf.add_n(accs) if len(accs) == n_towers else None
+
+        network = tl.layers.merge_networks(networks)
+        network.outputs = tf.concat([n.outputs for n in networks], 0)
+    return network, train_op, cost, acc
+
+
+def _first_tensor(x):
+    """Return the first tensor of a tensor, or a tuple/list or dict of tensors."""
+    if isinstance(x, dict):
+        return x[sorted(x)[0]]
+    if isinstance(x, (list, tuple)):
+        return x[0]
+    return x
+
+
+def _mask_empty(x, not_empty):
+    """Return ``x``, or zeros if the scalar boolean tensor ``not_empty`` is False. ``x`` can be None,
+    a tensor or the ``tf.IndexedSlices`` of a sparse gradient."""
+    if x is None:
+        return None
+    if isinstance(x, tf.IndexedSlices):
+        return tf.IndexedSlices(_mask_empty(x.values, not_empty), x.indices, x.dense_shape)
+    return tf.where(not_empty, x, tf.zeros_like(x))
+
+
+def _split_towers(x, sizes, n_towers):
+    """Split a tensor, or a tuple/list or dict of tensors, along the batch into ``n_towers`` parts of ``sizes``,
+    and return the list of the parts with the same structure."""
+    if isinstance(x, dict):
+        splits = {k: tf.split(v, sizes, num=n_towers) for k, v in x.items()}
+        return [{k: splits[k][i] for k in x} for i in range(n_towers)]
+    if isinstance(x, (list, tuple)):
+        splits = [tf.split(v, sizes, num=n_towers) for v in x]
+        return [type(x)(split[i] for split in splits) for i in range(n_towers)]
+    return tf.split(x, sizes, num=n_towers)
+
+
+class GradientAccumulator(object):
+    """The :class:`GradientAccumulator` class accumulates the gradients of a cost over ``n_steps`` micro-batches
+    into variables and applies their mean once. It trains with an effective batch of ``n_steps`` times the batch size
+    with the memory of one batch, and runs the optimizer update once every ``n_steps`` steps.
+    Pass it as the ``train_op`` of :func:`fit`, or see the ``accumulate_steps`` of :func:`tl.layers.ReconLayer.pretrain`.
 
     Parameters
     ----------
-    y_test : numpy.array or list
-        target results
-    y_predict : numpy.array or list
-        predicted results
-    n_classes : int
-        number of classes
+    optimizer : a TensorFlow optimizer
+        like tf.train.AdamOptimizer(0.001)
+    cost : the TensorFlow expression of cost of a micro-batch
+    var_list : list of variables or None
+        the variables to train, default is the trainable variables.
+    n_steps : int
+        the number of micro-batches accumulated before every update.
+    global_step : variable or None
+        incremented at every update, see ``apply_gradients`` of TensorFlow optimizers.
+    name : str
+        the name scope of the accumulators.
+
+    Attributes
+    ----------
+    accumulators : list of variables
+        the accumulated gradients of the variables, not trainable. They are initialized by
+        ``tl.layers.initialize_global_variables``.
+    count : variable
+        the number of micro-batches accumulated since the last update.
+    accumulate_op : operation
+        run it on a micro-batch to add its gradients to the accumulators.
+    apply_op : operation
+        run it on the last micro-batch to add its gradients, apply the mean of the accumulated gradients
+        and reset the accumulators to zero.
+    flush_op : operation
+        run it without a batch to apply the mean of the gradients accumulated so far and reset the accumulators,
+        e.g. when the number of micro-batches is not a multiple of ``n_steps``. Only run it if ``count`` is not zero.
+    reset_op : operation
+        run it to discard the accumulated gradients, e.g. the ones left over by an interrupted training.
+
+    Examples
+    --------
+    >>> train_op = tl.utils.GradientAccumulator(tf.train.AdamOptimizer(0.0001), cost, network.all_params, n_steps=8)
+    >>> tl.layers.initialize_global_variables(sess)
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_, batch_size=64, n_epoch=100)
+
+    - Train step by step
+    >>> sess.run(train_op.reset_op)
+    >>> for step, (X_a, y_a) in enumerate(tl.iterate.minibatches(X_train, y_train, 64, shuffle=True)):
+    >>>     op = train_op.apply_op if (step + 1) % train_op.n_steps == 0 else train_op.accumulate_op
+    >>>     sess.run(op, feed_dict={x: X_a, y_: y_a})
+    >>> if (step + 1) % train_op.n_steps != 0:
+    >>>     sess.run(train_op.flush_op)
+    """
+
+    def __init__(self, optimizer, cost, var_list=None, n_steps=4, global_step=None, name='gradient_accumulator'):
+        if n_steps < 1:
+            raise ValueError("n_steps should be at least 1, got %d" % n_steps)
+        self.n_steps = n_steps
+        grads_and_vars = [(g, v) for g, v in optimizer.compute_gradients(cost, var_list=var_list) if g is not None]
+        variables = [v for _, v in grads_and_vars]
+        with tf.name_scope(name):
+            self.accumulators = [tf.Variable(tf.zeros(v.get_shape(), dtype=v.dtype.base_dtype), trainable=False, name='accumulator') for v in variables]
+            self.count = tf.Variable(0, trainable=False, name='count')
+            self.accumulate_op = self._accumulate(grads_and_vars)
+            # the accumulators are read after the gradients of the last micro-batch are added
+            with tf.control_dependencies([self._accumulate(grads_and_vars)]):
+                self.apply_op = self._apply(optimizer, variables, global_step)
+            self.flush_op = self._apply(optimizer, variables, global_step)
+            self.reset_op = self._reset()
+
+    def _accumulate(self, grads_and_vars):
+        ops = [tf.assign_add(self.count, 1)]
+        for accumulator, (grad, _) in zip(self.accumulators, grads_and_vars):
+            if isinstance(grad, tf.IndexedSlices):
+                # the sparse gradients of embeddings only update their rows
+                ops.append(tf.scatter_add(accumulator, grad.indices, grad.values))
+            else:
+                ops.append(tf.assign_add(accumulator, grad))
+        return tf.group(*ops)
+
+    def _apply(self, optimizer, variables, global_step):
+        """Return the operation that applies the mean of the accumulated gradients and then resets the accumulators."""
+        count = tf.maximum(self.count.read_value(), 1)
+        means = [accumulator.read_value() / tf.cast(count, accumulator.dtype.base_dtype) for accumulator in self.accumulators]
+        apply_op = optimizer.apply_gradients(list(zip(means, variables)), global_step=global_step)
+        with tf.control_dependencies([apply_op]):
+            return self._reset()
+
+    def _reset(self):
+        return tf.group(tf.assign(self.count, 0), *[tf.assign(accumulator, tf.zeros_like(accumulator)) for accumulator in self.accumulators])
+
+
+## Profiling
+class StepProfiler(object):
+    """The :class:`StepProfiler` class records the wall time of the phases of the training of :func:`fit`, to find
+    where the time goes: gathering the batches (``batch``), building the feed dicts (``feed_dict``), running the
+    training steps (``run``), the callbacks (``callbacks``), the tensorboard summaries (``summary``) and the evaluation
+    passes (``eval``). At the end of the training, it logs a table of the time distribution of every phase and
+    the throughput in examples per second, and optionally writes them to a JSON file.
+
+    Parameters
+    ----------
+    trace_steps : list of int or None
+        the training steps (counted from 0 over all the epochs) for which a ``tf.RunMetadata`` trace is captured.
+        The traces are written to ``trace_dir`` in the Chrome trace format, open them in chrome://tracing.
+        The traced steps are slower, so they are recorded as the ``run_traced`` phase.
+    trace_dir : str
+        the folder of the traces.
+    json_path : str or None
+        if not None, :meth:`report` also writes the summary to this JSON file.
+
+    Examples
+    --------
+    >>> profiler = tl.utils.StepProfiler(trace_steps=[10], json_path='logs/profile.json')
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_, n_epoch=10, profiler=profiler)
+    >>> print(profiler.summary()['phases']['run']['p90'])
+
+    - Profile your own loop
+    >>> profiler.reset()
+    >>> for X_a, y_a in tl.iterate.minibatches(X_train, y_train, 128, shuffle=True):
+    >>>     with profiler.phase('feed_dict'):
+    >>>         feed_dict = {x: X_a, y_: y_a}
+    >>>     profiler.run(sess, train_op, feed_dict=feed_dict, n_examples=len(X_a))
+    >>> profiler.report()
+    """
+
+    #: the edges in seconds of the buckets of the histograms, from 10us to 100s
+    histogram_edges = [0] + [10.0**(e / 2.0) for e in range(-10, 5)] + [float('inf')]
+
+    def __init__(self, trace_steps=None, trace_dir='logs/trace', json_path=None):
+        self.trace_steps = set(trace_steps or [])
+        self.trace_dir = trace_dir
+        self.json_path = json_path
+        self.reset()
+
+    def reset(self):
+        """Clear the records and restart the clock of the total time."""
+        self.times = {}
+        self.examples = {}
+        self.n_steps = 0
+        self.start_time = time.time()
+
+    def phase(self, name, n_examples=None):
+        """Return a context manager that records its wall time as a sample of the phase ``name``,
+        processing ``n_examples`` examples."""
+        return _ProfilerPhase(self, name, n_examples)
+
+    def record(self, name, seconds, n_examples=None):
+        """Record a sample of the phase ``name``."""
+        self.times.setdefault(name, []).append(seconds)
+        if n_examples:
+            self.examples[name] = self.examples.get(name, 0) + n_examples
+
+    def run(self, sess, fetches, feed_dict=None, n_examples=None):
+        """Run a training step as ``sess.run(fetches, feed_dict)``, and record it as the ``run`` phase,
+        or capture its trace if it is one of the ``trace_steps``."""
+        step = self.n_steps
+        self.n_steps += 1
+        if step not in self.trace_steps:
+            with self.phase('run', n_examples):
+                return sess.run(fetches, feed_dict=feed_dict)
+        run_metadata = tf.RunMetadata()
+        with self.phase('run_traced'):
+            results = sess.run(fetches, feed_dict=feed_dict, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), run_metadata=run_metadata)
+        from tensorflow.python.client import timeline
+        tl.files.exists_or_mkdir(self.trace_dir, verbose=False)
+        with open(os.path.join(self.trace_dir, 'step_%d.json' % step), 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        return results
+
+    def summary(self):
+        """Return the summary of the records as a dict, with the ``total_time`` since :meth:`reset`, the number of
+        training steps, the training throughput ``examples_per_sec``, the ``histogram_edges`` and, for every phase,
+        the ``count``, ``total``, ``mean``, ``p50``, ``p90``, ``p99`` and ``max`` in seconds, the ``fraction``
+        of the total time, the ``histogram`` of the samples and, if any, its ``examples_per_sec``."""
+        total_time = time.time() - self.start_time
+        phases = {}
+        for name, times in self.times.items():
+            times = np.asarray(times)
+            p50, p90, p99 = np.percentile(times, [50, 90, 99])
+            phases[name] = {
+                'count': len(times),
+                'total': float(times.sum()),
+                'mean': float(times.mean()),
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99),
+                'max': float(times.max()),
+                'fraction': float(times.sum() / total_time),
+                'histogram': np.histogram(times, bins=self.histogram_edges)[0].tolist(),
+            }
+            if name in self.examples:
+                phases[name]['examples_per_sec'] = self.examples[name] / max(float(times.sum()), 1e-12)
+        return {
+            'total_time': total_time,
+            'n_steps': self.n_steps,
+            'examples_per_sec': self.examples.get('run', 0) / total_time,
+            'histogram_edges': self.histogram_edges[:-1],
+            'phases': phases,
+        }
+
+    def report(self):
+        """Log the summary as a table, write it to ``json_path`` if not None, and return it."""
+        summary = self.summary()
+        logging.info("Profile of %d steps in %fs, %f examples/sec" % (summary['n_steps'], summary['total_time'], summary['examples_per_sec']))
+        logging.info("   %-12s %8s %10s %10s %10s %10s %10s %7s" % ('phase', 'count', 'total(s)', 'mean(ms)', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'time(%)'))
+        for name, p in sorted(summary['phases'].items(), key=lambda item: -item[1]['total']):
+            logging.info("   %-12s %8d %10.3f %10.3f %10.3f %10.3f %10.3f %7.1f" % (name, p['count'], p['total'], p['mean'] * 1e3, p['p50'] * 1e3,
+                                                                            p['p90'] * 1e3, p['p99'] * 1e3, p['fraction'] * 100))
+        if self.json_path is not None:
+            with open(self.json_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+        return summary
+
+
+class _ProfilerPhase(object):
+    """The context manager of :meth:`StepProfiler.phase`."""
+
+    def __init__(self, profiler, name, n_examples):
+        self.profiler = profiler
+        self.name = name
+        self.n_examples = n_examples
+
+    def __enter__(self):
+        self.start_time = time.time()
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.time() - self.start_time, self.n_examples)
+
+
+class _NullProfiler(object):
+    """A :class:`StepProfiler` that records nothing, used when profiling is disabled."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def reset(self):
+        pass
+
+    def phase(self, name, n_examples=None):
+        return self
+
+    def run(self, sess, fetches, feed_dict=None, n_examples=None):
+        return sess.run(fetches, feed_dict=feed_dict)
+
+    def report(self):
+        pass
+
+
+_NULL_PROFILER = _NullProfiler()
+
+
+## Callbacks
+class Callback(object):
+    """The :class:`Callback` class is the base class of the callbacks of :func:`fit`, e.g. for early stopping,
+    checkpointing, learning rate schedules or logging. Override the methods of the events you need.
+
+    The ``logs`` of ``on_batch_end`` contain the ``loss``, ``size`` and ``step_time`` of the batch, the ``logs`` of
+    ``on_epoch_end`` contain the mean training ``loss`` and the ``epoch_time`` of the epoch and, in the epochs of
+    evaluation, ``train_loss``, ``acc``, ``val_loss`` and ``val_acc``. With a graph-side input pipeline, the step that
+    reaches the end of the data ends with the ``logs`` ``{'size': 0, 'step_time': ...}`` of an empty batch.
+
+    Attributes
+    ----------
+    asynchronous : boolean
+        If True, the events are queued and the methods run on a background thread in order, so that slow sinks
+        (e.g. TensorDB, file writers) never block the training steps. The arguments of the events are taken by
+        :meth:`on_dispatch` in the training thread. The first exception raised by the methods is raised again in
+        the training thread, by the next event or at the end of the training. Default is False.
+    max_queue_size : int
+        The maximum number of events queued for an asynchronous callback. When the queue is full, the training
+        blocks until the callback catches up, so the events are never dropped and the memory stays bounded.
+        Default is 100.
+    stop_training : boolean
+        Set it to True in ``on_epoch_end`` to stop the training after the current epoch. Only synchronous callbacks
+        can stop the training.
 
     Examples
     --------
-    >>> c_mat, f1, acc, f1_macro = evaluation(y_test, y_predict, n_classes)
+    >>> class EarlyStopping(tl.utils.Callback):
+    >>>     def __init__(self, patience=5):
+    >>>         tl.utils.Callback.__init__(self)
+    >>>         self.patience, self.best, self.wait = patience, np.inf, 0
+    >>>     def on_epoch_end(self, epoch, logs={}):
+    >>>         if 'val_loss' in logs:
+    >>>             if logs['val_loss'] < self.best:
+    >>>                 self.best, self.wait = logs['val_loss'], 0
+    >>>             else:
+    >>>                 self.wait += 1
+    >>>                 self.stop_training = self.wait >= self.patience
+    >>> tl.utils.fit(sess, network, train_op, cost, X_train, y_train, x, y_, X_val=X_val, y_val=y_val,
+    ...              print_freq=1, callbacks=[EarlyStopping(patience=5)])
     """
-    from sklearn.metrics import confusion_matrix, f1_score, accuracy_score
-    c_mat = confusion_matrix(y_test, y_predict, labels=[x for x in range(n_classes)])
-    f1 = f1_score(y_test, y_predict, average=None, labels=[x for x in range(n_classes)])
-    f1_macro = f1_score(y_test, y_predict, average='macro')
-    acc = accuracy_score(y_test, y_predict)
-    logging.info('confusion matrix: \n%s' % c_mat)
-    logging.info('f1-score        : %s' % f1)
-    logging.info('f1-score(macro) : %f' % f1_macro)  # same output with > f1_score(y_true, y_pred, average='macro')
-    logging.info('accuracy-score  : %f' % acc)
-    return c_mat, f1, acc, f1_macro
+
+    asynchronous = False
+    max_queue_size = 100
+
+    def __init__(self):
+        self.stop_training = False
+
+    def on_dispatch(self, name, args):
+        """Return the arguments of the event ``name`` of an asynchronous callback. It is called in the training
+        thread when the event is queued, override it to copy the state that the training modifies before the
+        background thread runs the event, e.g. the parameters of the model."""
+        return args
+
+    def on_train_begin(self, logs={}):
+        pass
+
+    def on_train_end(self, logs={}):
+        pass
+
+    def on_epoch_begin(self, epoch, logs={}):
+        pass
+
+    def on_epoch_end(self, epoch, logs={}):
+        pass
+
+    def on_batch_begin(self, batch, logs={}):
+        pass
+
+    def on_batch_end(self, batch, logs={}):
+        pass
+
+
+class _AsyncWorker(object):
+    """Call the methods of ``target`` in order on a background thread, e.g. the events of an asynchronous
+    callback or the ``add_summary`` of a summary writer. At most ``max_queue_size`` calls are queued,
+    :meth:`put` blocks when the queue is full. The first exception of the calls is stored in ``exception``
+    and raised by the next :meth:`put` or by :meth:`close`, the next calls still run."""
+
+    def __init__(self, target, max_queue_size=100):
+        self.target = target
+        self.exception = None
+        self._queue = queue.Queue(max_queue_size)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            name, args = event
+            try:
+                getattr(self.target, name)(*args)
+            except Exception as e:
+                logging.info("[!] %s.%s failed: %s" % (self.target.__class__.__name__, name, e))
+                if self.exception is None:
+                    self.exception = e
+
+    def _raise(self):
+        """Raise the stored exception once."""
+        exception, self.exception = self.exception, None
+        if exception is not None:
+            raise exception
+
+    def put(self, name, args):
+        """Queue the call ``target.name(*args)``, wait for a free slot if the queue is full. Raise the exception
+        of a previous call."""
+        self._raise()
+        self._queue.put((name, args))
+
+    def close(self, last_call=None):
+        """Queue the ``(name, args)`` call ``last_call`` if given, wait for all the queued calls to finish,
+        then raise the exception of a failed call."""
+        if last_call is not None:
+            self._queue.put(last_call)
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
+
+
+def _close_workers(workers, last_call=None):
+    """Close all the :class:`_AsyncWorker`, then raise the first exception of their calls."""
+    exceptions = []
+    for worker in workers:
+        try:
+            worker.close(last_call)
+        except Exception as e:
+            exceptions.append(e)
+    if exceptions:
+        raise exceptions[0]
+
+
+class _CallbackDispatcher(object):
+    """Dispatch the events of :func:`fit` to the synchronous callbacks directly and to the asynchronous
+    callbacks through their background threads."""
+
+    def __init__(self, callbacks=None):
+        self._sync = [cb for cb in callbacks or [] if not getattr(cb, 'asynchronous', False)]
+        self._async = [_AsyncWorker(cb, getattr(cb, 'max_queue_size', 100)) for cb in callbacks or [] if getattr(cb, 'asynchronous', False)]
+
+    def __bool__(self):
+        return bool(self._sync or self._async)
+
+    __nonzero__ = __bool__
+
+    def __call__(self, name, *args):
+        for cb in self._sync:
+            getattr(cb, name)(*args)
+        for worker in self._async:
+            on_dispatch = getattr(worker.target, 'on_dispatch', None)
+            worker.put(name, on_dispatch(name, args) if on_dispatch else args)
+
+    @property
+    def stop_training(self):
+        return any(getattr(cb, 'stop_training', False) for cb in self._sync)
+
+    def close(self):
+        _close_workers(self._async)
+
+
+## Evaluation
+def _evaluate(sess, network, batches, x, y_, cost=None, acc=None, y_op=None, n_classes=None):
+    """Run ``cost``, ``acc`` and ``y_op`` on all the batches with the noise layers disabled,
+    and return the accumulated :class:`StreamingMetrics`."""
+    dp_dict = inference_feed_dict(network)  # disable noise layers
+    fetches = {name: op for name, op in (('loss', cost), ('acc', acc), ('y_pred', y_op)) if op is not None}
+    graph_input = _is_graph_input(batches)
+    if graph_input and y_ is not None:
+        fetches['y_true'] = y_  # the targets of the batch come from the input pipeline
+    metrics = StreamingMetrics(n_classes)
+    for feed_dict, y_a in _batch_feeds(sess, batches, x, y_, dp_dict):
+        try:
+            results = sess.run(fetches, feed_dict=feed_dict)
+        except tf.errors.OutOfRangeError:
+            break
+        if graph_input:
+            y_a = results.pop('y_true', None)
+        n_examples = iterate._data_len(y_a) if y_a is not None else 1
+        metrics.update(y_true=y_a if y_op is not None else None, n_examples=n_examples, **results)
+    return metrics
+
+
+def _is_graph_input(data):
+    """Return True if ``data`` is a graph-side input pipeline, i.e. a ``tf.data.Iterator`` or the
+    initializer operation of one, False for numpy arrays, and raise a TypeError for other TensorFlow
+    operations and tensors."""
+    if not hasattr(tf, 'data'):
+        return False
+    if isinstance(data, tf.data.Iterator):
+        return True
+    if isinstance(data, tf.Operation):
+        if data.type != 'MakeIterator':
+            raise TypeError("The operation %s (%s) is not the initializer of a tf.data.Iterator" % (data.name, data.type))
+        return True
+    if isinstance(data, (tf.Tensor, tf.Variable)):
+        raise TypeError("The tensor %s is not a graph-side input pipeline, pass its tf.data.Iterator instead" % data.name)
+    return False
+
+
+def _batch_feeds(sess, batches, x, y_, feed_dict=None, profiler=None):
+    """Yield the feed dict and the targets of every batch, updated with ``feed_dict``. ``batches`` is an iterable
+    of (inputs, targets) batches fed into the placeholders ``x`` and ``y_``, or a graph-side input pipeline, which
+    is initialized and then yields ``feed_dict`` as is, until ``sess.run`` raises ``tf.errors.OutOfRangeError``.
+    The ``profiler`` records the time of gathering the batches and of building their feed dicts."""
+    if profiler is None:
+        profiler = _NULL_PROFILER
+    if _is_graph_input(batches):
+        sess.run(batches.initializer if isinstance(batches, tf.data.Iterator) else batches)
+        while True:
+            yield feed_dict, None
+    else:
+        batches = iter(batches)
+        while True:
+            with profiler.phase('batch'):
+                try:
+                    X_a, y_a = next(batches)
+                except StopIteration:
+                    return
+            with profiler.phase('feed_dict'):
+                batch_feed_dict = _feed_dict(x, X_a, y_, y_a)
+                if feed_dict:
+                    batch_feed_dict.update(feed_dict)
+            yield batch_feed_dict, y_a
+
+
+def _feed_dict(x, X, y_=None, y=None):
+    """Return the feed dict of a batch. The placeholders ``x`` (and ``y_``) can be a single placeholder,
+    a tuple/list or a dict of placeholders, and ``X`` (and ``y``) must have the same structure."""
+    feed_dict = {}
+    for placeholders, data in ((x, X), (y_, y)):
+        if placeholders is None:
+            continue
+        if isinstance(placeholders, dict):
+            feed_dict.update({placeholders[k]: data[k] for k in placeholders})
+        elif isinstance(placeholders, (list, tuple)):
+            assert len(placeholders) == len(data), "The number of placeholders and arrays should be the same"
+            feed_dict.update(zip(placeholders, data))
+        else:
+            feed_dict[placeholders] = data
+    return feed_dict
 
 
 def dict_to_one(dp_dict={}):
@@ -373,6 +1127,49 @@ def dict_to_one(dp_dict={}):
     return {x: 1 for x in dp_dict}
 
 
+def inference_feed_dict(network):
+    """
+    Return the feed dict that disables the noise layers of a network, i.e. ``dict_to_one(network.all_drop)``.
+    It is cached on the network and only rebuilt when ``network.all_drop`` is replaced or placeholders are added to it,
+    so that it can be used at every batch. Do not modify the returned dictionary, copy it instead.
+
+    Parameters
+    ----------
+    network : a TensorLayer layer
+        the network with the keeping probabilities ``all_drop``
+
+    Examples
+    --------
+    >>> feed_dict = {x: X_batch}
+    >>> feed_dict.update(tl.utils.inference_feed_dict(network))
+    """
+    return _cached_feed_dict(network, '_inference_feed_dict', dict_to_one)
+
+
+def training_feed_dict(network):
+    """
+    Return the feed dict that enables the noise layers of a network, i.e. ``network.all_drop`` itself, so that
+    the keeping probabilities modified in place are always fed. Do not modify the returned dictionary, copy it instead.
+
+    Parameters
+    ----------
+    network : a TensorLayer layer
+        the network with the keeping probabilities ``all_drop``
+    """
+    return network.all_drop
+
+
+def _cached_feed_dict(network, attr, build):
+    """Return ``build(network.all_drop)`` cached in the attribute ``attr`` of the network, together with ``all_drop``
+    and its length, to detect in O(1) when it is replaced or when placeholders are added to it."""
+    all_drop = network.all_drop
+    cached = getattr(network, attr, None)
+    if cached is None or cached[0] is not all_drop or cached[1] != len(all_drop):
+        cached = (all_drop, len(all_drop), build(all_drop))
+        setattr(network, attr, cached)
+    return cached[2]
+
+
 def flatten_list(list_of_list=[[], []]):
     """
     Input a list of list, return a list that all items are in a list.
@@ -408,6 +1205,11 @@ def class_balancing_oversample(X_train=None, y_train=None, printable=True):
     >>> X, y = tl.utils.class_balancing_oversample(X_train=np.hstack((X1, X2)), y_train=y, printable=False)
     >>> X1 = X[:, 0:5]
     >>> X2 = X[:, 5:]
+
+    Notes
+    -----
+    The returned dataset has ``n_classes x max_count`` rows. To train on class-balanced batches without copying
+    the dataset, use ``tl.iterate.class_balanced_minibatches`` instead.
     """
     # ======== Classes balancing
     if printable:
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import itertools
+import multiprocessing
 import os
 
 import matplotlib
@@ -47,6 +50,55 @@ def read_images(img_list, path='', n_threads=10, printable=True):
     return imgs
 
 
+def stream_images(img_list, path='', n_processes=None, max_pending=None, printable=False):
+    """ Yields the images in list by given path and name of each image file, in order, as they are decoded
+    by a pool of processes. At most ``max_pending`` images are decoded ahead of the consumer, so the memory
+    does not grow with the number of images and the first images are available before the others are decoded.
+
+    Parameters
+    -------------
+    img_list : list of string, the image file names.
+    path : string, image folder path.
+    n_processes : int or None, number of processes to decode images, default is the number of CPUs.
+        With 0, the images are decoded in the calling process.
+    max_pending : int or None, maximum number of images being decoded or waiting to be consumed,
+        default is ``4 * n_processes``.
+    printable : bool, print infomation every 1000 images, default is False.
+
+    Examples
+    ---------
+    >>> for image in tl.visualize.stream_images(img_list, path='data/images', n_processes=8):
+    >>>     ...
+    """
+    if n_processes == 0:
+        pool = None
+        decoded = (read_image(img, path) for img in img_list)
+    else:
+        n_processes = n_processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(n_processes)
+        img_iter = iter(img_list)
+        pending = collections.deque(pool.apply_async(read_image, (img, path)) for img in itertools.islice(img_iter, max_pending or 4 * n_processes))
+
+        def _decoded():
+            while pending:
+                image = pending.popleft().get()
+                # keep the pool busy while the consumer uses the image
+                for img in itertools.islice(img_iter, 1):
+                    pending.append(pool.apply_async(read_image, (img, path)))
+                yield image
+
+        decoded = _decoded()
+    try:
+        for idx, image in enumerate(decoded):
+            if printable and (idx + 1) % 1000 == 0:
+                logging.info('read %d from %s' % (idx + 1, path))
+            yield image
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
 def save_image(image, image_path=''):
     """Save one image.
 
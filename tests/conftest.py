@@ -0,0 +1,15 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import types
+
+try:
+    import tensorflow  # noqa: F401
+except ImportError:
+    # tensorlayer/__init__.py requires TensorFlow, register the package without running it,
+    # so that the tests of the numpy-only modules, e.g. tensorlayer.iterate, still run
+    package = types.ModuleType('tensorlayer')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tensorlayer')]
+    sys.modules['tensorlayer'] = package
@@ -0,0 +1,146 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+import tensorlayer as tl
+
+_VOC_OBJECT = '''
+  <object>
+    <name>%s</name>
+    <difficult>0</difficult>
+    <bndbox><xmin>%d</xmin><ymin>10</ymin><xmax>%d</xmax><ymax>30</ymax></bndbox>
+  </object>'''
+
+
+def _write_voc_annotation(name, objects):
+    """Write a VOC XML annotation of a 100x50 image with the (class, xmin, xmax) objects."""
+    with open(name, 'w') as f:
+        f.write('<annotation><filename>%s</filename><size><width>100</width><height>50</height><depth>3</depth></size>%s\n</annotation>' %
+                (os.path.basename(name).replace('.xml', '.jpg'), ''.join(_VOC_OBJECT % obj for obj in objects)))
+
+
+@pytest.fixture
+def voc_path(tmp_path):
+    """A VOC 2007 tree of three images, already extracted so that nothing is downloaded."""
+    root = tmp_path / 'VOC' / 'VOC2007'
+    for folder in ('JPEGImages', 'SegmentationClass', 'SegmentationObject', 'Annotations'):
+        (root / folder).mkdir(parents=True)
+    for i in range(1, 4):
+        (root / 'JPEGImages' / ('2007_%06d.jpg' % i)).write_bytes(b'')
+        _write_voc_annotation(str(root / 'Annotations' / ('2007_%06d.xml' % i)), [('person', 10, 30)] * i)
+    return str(tmp_path)
+
+
+def _load_voc(path):
+    return tl.files.load_voc_dataset(path=path, dataset='2007', structured=True, n_processes=0)
+
+
+def test_load_voc_dataset_structured(voc_path):
+    imgs_file_list, _, _, imgs_ann_file_list, classes, _, _, n_objs_list, objs_info_list, objs_info_dicts = _load_voc(voc_path)
+    assert n_objs_list == [1, 2, 3]
+    class_ids, boxes = objs_info_list[2]
+    np.testing.assert_array_equal(class_ids, [classes.index('person')] * 3)
+    np.testing.assert_allclose(boxes[0], [0.2, 0.4, 0.2, 0.4], rtol=1e-6)
+    assert objs_info_dicts[imgs_file_list[0]]['filename'] == '2007_000001.jpg'
+    assert os.path.exists(os.path.join(voc_path, 'VOC', 'voc_2007_cache.npz'))
+    # the next call reads the cache
+    assert _load_voc(voc_path)[7] == [1, 2, 3]
+
+
+def test_voc_cache_is_rebuilt_when_an_annotation_is_removed(voc_path):
+    assert _load_voc(voc_path)[7] == [1, 2, 3]
+    os.remove(os.path.join(voc_path, 'VOC', 'VOC2007', 'Annotations', '2007_000003.xml'))
+    os.remove(os.path.join(voc_path, 'VOC', 'VOC2007', 'JPEGImages', '2007_000003.jpg'))
+    assert _load_voc(voc_path)[7] == [1, 2]
+
+
+def test_voc_cache_is_rebuilt_when_an_annotation_is_edited(voc_path):
+    assert _load_voc(voc_path)[7] == [1, 2, 3]
+    ann_file = os.path.join(voc_path, 'VOC', 'VOC2007', 'Annotations', '2007_000002.xml')
+    mtime = os.stat(ann_file).st_mtime
+    _write_voc_annotation(ann_file, [('person', 10, 30), ('person', 10, 30), ('dog', 50, 90)])
+    os.utime(ann_file, (mtime + 10, mtime + 10))
+    _, _, _, _, classes, _, _, n_objs_list, objs_info_list, _ = _load_voc(voc_path)
+    assert n_objs_list == [1, 3, 3]
+    np.testing.assert_array_equal(objs_info_list[1][0], [classes.index('person')] * 2 + [classes.index('dog')])
+
+
+@pytest.fixture
+def flickr25k_path(tmp_path, monkeypatch):
+    """A Flickr25k tree of three images and their tags, already extracted so that nothing is downloaded.
+    The images are "decoded" to their names."""
+    root = tmp_path / 'flickr25k' / 'mirflickr'
+    (root / 'meta' / 'tags').mkdir(parents=True)
+    for i, tags in enumerate(['sky\nsea', 'dog', 'sky'], 1):
+        (root / ('im%d.jpg' % i)).write_bytes(b'')
+        (root / 'meta' / 'tags' / ('tags%d.txt' % i)).write_text(tags)
+    monkeypatch.setattr(tl.visualize, 'read_image', lambda image, path='': image)
+    return str(tmp_path)
+
+
+def _load_flickr25k(path, tag):
+    return tl.files.load_flickr25k_dataset(tag=tag, path=path, n_threads=2, n_processes=0)
+
+
+def test_load_flickr25k_dataset(flickr25k_path):
+    assert _load_flickr25k(flickr25k_path, 'sky') == ['im1.jpg', 'im3.jpg']
+    assert os.path.exists(os.path.join(flickr25k_path, 'flickr25k', 'flickr25k_tags_cache.npz'))
+    assert _load_flickr25k(flickr25k_path, 'dog') == ['im2.jpg']
+    assert _load_flickr25k(flickr25k_path, 'cat') == []
+    assert _load_flickr25k(flickr25k_path, None) == ['im1.jpg', 'im2.jpg', 'im3.jpg']
+
+
+def test_flickr25k_tag_index_is_rebuilt_when_a_tag_file_is_edited(flickr25k_path):
+    assert _load_flickr25k(flickr25k_path, 'sky') == ['im1.jpg', 'im3.jpg']
+    tag_file = os.path.join(flickr25k_path, 'flickr25k', 'mirflickr', 'meta', 'tags', 'tags2.txt')
+    mtime = os.stat(tag_file).st_mtime
+    with open(tag_file, 'w') as f:
+        f.write('sky')
+    os.utime(tag_file, (mtime + 10, mtime + 10))
+    assert _load_flickr25k(flickr25k_path, 'sky') == ['im1.jpg', 'im2.jpg', 'im3.jpg']
+    assert _load_flickr25k(flickr25k_path, 'dog') == []
+
+
+@pytest.fixture
+def mnist_path(tmp_path):
+    """The gzipped idx files of a MNIST of 10003 training and 5 test images, so that nothing is downloaded."""
+    folder = tmp_path / 'mnist'
+    folder.mkdir()
+    for prefix, n_images in (('train', 10003), ('t10k', 5)):
+        images = (np.arange(n_images * 784) % 251).astype(np.uint8)
+        labels = (np.arange(n_images) % 10).astype(np.uint8)
+        with gzip.open(str(folder / ('%s-images-idx3-ubyte.gz' % prefix)), 'wb', compresslevel=1) as f:
+            f.write(b'\0' * 16 + images.tobytes())
+        with gzip.open(str(folder / ('%s-labels-idx1-ubyte.gz' % prefix)), 'wb') as f:
+            f.write(b'\0' * 8 + labels.tobytes())
+    return str(tmp_path)
+
+
+def test_load_mnist_dataset(mnist_path):
+    X_train, y_train, X_val, y_val, X_test, y_test = tl.files.load_mnist_dataset(shape=(-1, 28, 28, 1), path=mnist_path, dtype=np.uint8)
+    assert X_train.shape == (3, 28, 28, 1) and X_val.shape == (10000, 28, 28, 1) and X_test.shape == (5, 28, 28, 1)
+    assert X_train.dtype == np.uint8
+    np.testing.assert_array_equal(X_test.ravel(), np.arange(5 * 784) % 251)
+    np.testing.assert_array_equal(y_val[:3], [3, 4, 5])
+    assert y_train.dtype == np.int32
+    X_train_lazy = tl.files.load_mnist_dataset(path=mnist_path, lazy=True)[0]
+    assert isinstance(X_train_lazy, tl.files.ScaledArray)
+    np.testing.assert_array_equal(X_train_lazy[:3], X_train.reshape(3, 784) / np.float32(256))
+
+
+def test_load_mnist_dataset_float32_cache(mnist_path):
+    tl.files.load_mnist_dataset(path=mnist_path)
+    assert os.path.exists(os.path.join(mnist_path, 'mnist', 'mnist_float32_cache.npz'))
+    for _ in range(2):
+        X_train, _, _, _, X_test = tl.files.load_mnist_dataset(path=mnist_path)[:5]
+        assert X_train.dtype == np.float32 and X_train.shape == (3, 784)
+        np.testing.assert_array_equal(X_test.ravel(), (np.arange(5 * 784) % 251) / np.float32(256))
+        # the cached images are copy-on-write, the changes are not written into the cache
+        X_train[0, 0] = -1
+    assert tl.files.load_mnist_dataset(path=mnist_path)[0][0, 0] == 0
@@ -0,0 +1,167 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+import tensorlayer as tl
+
+
+@pytest.fixture
+def model():
+    """A session with the variables of a tiny model."""
+    with tf.Graph().as_default():
+        rnd = np.random.RandomState(0)
+        params = [
+            tf.Variable(rnd.randn(20, 10).astype(np.float32), name='w'),
+            tf.Variable(rnd.randn(10).astype(np.float32), name='b'),
+            tf.Variable(np.arange(6, dtype=np.int64).reshape(2, 3), name='step'),
+        ]
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            yield sess, params
+
+
+def _assert_params_equal(values, sess, params):
+    assert len(values) == len(params)
+    for value, param in zip(values, params):
+        np.testing.assert_array_equal(value, sess.run(param))
+
+
+def test_save_npz_asynchronous(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    thread = tl.files.save_npz(params, name=name, sess=sess, mmap=True, asynchronous=True)
+    thread.join()
+    _assert_params_equal(tl.files.load_npz(name=name), sess, params)
+
+
+def test_save_npz_chunked(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    assert tl.files.save_npz(params, name=name, sess=sess, mmap=True, chunk_size=64) is None
+    _assert_params_equal(tl.files.load_npz(name=name), sess, params)
+    assert os.listdir(str(tmp_path)) == ['model.npz']
+
+
+def test_asynchronous_saves_of_the_same_file(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    threads = []
+    for i in range(5):
+        sess.run(tf.assign(params[1], np.full(10, i, dtype=np.float32)))
+        threads.append(tl.files.save_npz(params, name=name, sess=sess, mmap=True, asynchronous=True))
+    for thread in threads:
+        thread.join()
+    # the saves of the same file run in order, the last one wins and no temporary file is left
+    np.testing.assert_array_equal(tl.files.load_npz(name=name)[1], np.full(10, 4, dtype=np.float32))
+    assert os.listdir(str(tmp_path)) == ['model.npz']
+
+
+def test_failed_asynchronous_save_raises_on_join(tmp_path, model):
+    sess, params = model
+    thread = tl.files.save_npz(params, name=str(tmp_path / 'missing' / 'model.npz'), sess=sess, mmap=True, asynchronous=True)
+    with pytest.raises(Exception):
+        thread.join()
+    assert thread.exception is not None
+
+
+def test_save_npz_dict_asynchronous(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    tl.files.save_npz_dict(params, name=name, sess=sess, asynchronous=True).join()
+    values = [sess.run(param) for param in params]
+    for param, value in zip(params, values):
+        sess.run(tf.assign(param, np.zeros_like(value)))
+    tl.files.load_and_assign_npz_dict(name=name, sess=sess)
+    _assert_params_equal(values, sess, params)
+
+
+def test_save_npz_mmap_round_trip(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    tl.files.save_npz(params, name=name, sess=sess, mmap=True)
+    loaded = tl.files.load_npz(name=name)
+    for value, param in zip(loaded, params):
+        assert isinstance(value, np.memmap)
+        assert value.dtype == sess.run(param).dtype
+    _assert_params_equal(loaded, sess, params)
+    # the file is a regular .npz file
+    with np.load(name) as npz:
+        np.testing.assert_array_equal(npz['param_00000'], sess.run(params[0]))
+    loaded = tl.files.load_npz(name=name, mmap=False)
+    assert not any(isinstance(value, np.memmap) for value in loaded)
+    _assert_params_equal(loaded, sess, params)
+
+
+def test_delta_npz_dict(tmp_path, model):
+    sess, params = model
+    names = [str(tmp_path / ('model_%d.npz' % i)) for i in range(3)]
+    tl.files.save_npz_dict(params, name=names[0], sess=sess)
+    sess.run(tf.assign(params[1], np.ones(10, dtype=np.float32)))
+    tl.files.save_npz_dict(params, name=names[1], sess=sess, base=names[0])
+    sess.run(tf.assign(params[2], np.zeros((2, 3), dtype=np.int64)))
+    tl.files.save_npz_dict(params, name=names[2], sess=sess, base=names[1])
+    values = [sess.run(param) for param in params]
+
+    # a delta checkpoint only holds the changed tensors, the unchanged ones refer directly to the checkpoint holding them
+    assert sorted(tl.files._npz_entries(names[1])) == ['b:0.npy', 'manifest.json']
+    assert sorted(tl.files._npz_entries(names[2])) == ['manifest.json', 'step:0.npy']
+    assert tl.files._read_delta_manifest(names[2])['refs'] == {'w:0': 'model_0.npz', 'b:0': 'model_1.npz'}
+
+    for param, value in zip(params, values):
+        sess.run(tf.assign(param, np.zeros_like(value)))
+    tl.files.load_and_assign_npz_dict(name=names[2], sess=sess)
+    _assert_params_equal(values, sess, params)
+
+    with pytest.raises(ValueError):
+        tl.files.save_npz_dict(params, name=names[2], sess=sess, base=names[2])
+    os.remove(names[0])
+    with pytest.raises(Exception):
+        tl.files.load_and_assign_npz_dict(name=names[2], sess=sess)
+
+
+def test_save_npz_compressed(tmp_path, model):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    tl.files.save_npz(params, name=name, sess=sess, compress=True)
+    _assert_params_equal(tl.files.load_npz(name=name), sess, params)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_save_npz_quantized(tmp_path, model, dtype):
+    sess, params = model
+    name = str(tmp_path / 'model.npz')
+    tl.files.save_npz(params, name=name, sess=sess, dtype=dtype)
+    loaded = tl.files.load_npz(name=name)
+    # the floating point parameters are restored in their dtype, the integers are kept as is
+    assert [value.dtype for value in loaded] == [np.float32, np.float32, np.int64]
+    for value, param in zip(loaded[:2], params[:2]):
+        expected = sess.run(param)
+        tolerance = 1e-2 if dtype == 'float16' else (max(expected.max(), 0) - min(expected.min(), 0)) / 255.
+        np.testing.assert_allclose(value, expected, atol=tolerance)
+    np.testing.assert_array_equal(loaded[2], sess.run(params[2]))
+    assert tl.files.load_npz(name=name, dtype=np.float64)[0].dtype == np.float64
+
+
+def test_quantize_int8():
+    value = np.random.RandomState(0).randn(1000).astype(np.float32) * 3
+    value[0] = 0
+    q, scale, zero_point = tl.files._quantize_int8(value)
+    assert q.dtype == np.int8 and q.shape == value.shape
+    restored = (q.astype(np.float32) - zero_point) * scale
+    assert np.abs(restored - value).max() <= scale / 2 + 1e-6
+    # zero is exactly representable, so the zero padding and biases stay zero
+    assert restored[0] == 0
+
+
+@pytest.mark.parametrize('value', [np.full((3, 4), 2.5, dtype=np.float32), np.zeros((0, 4), dtype=np.float32), np.zeros(5, dtype=np.float32)])
+def test_quantize_int8_degenerate(value):
+    q, scale, zero_point = tl.files._quantize_int8(value)
+    assert q.dtype == np.int8 and q.shape == value.shape
+    assert scale > 0
+    restored = (q.astype(np.float32) - zero_point) * scale
+    assert np.abs(restored - value).max(initial=0) <= scale / 2 + 1e-6
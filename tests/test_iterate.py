@@ -0,0 +1,151 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from tensorlayer import iterate
+
+
+def test_minibatches_of_tuples():
+    X1, X2, y = np.arange(24, dtype=np.float32).reshape(8, 3), np.arange(8, dtype=np.int64), np.arange(8)
+    batches = list(iterate.minibatches((X1, X2), y, batch_size=3, shuffle=True))
+    assert len(batches) == 2
+    for (X1_a, X2_a), y_a in batches:
+        assert X1_a.shape == (3, 3) and X1_a.dtype == np.float32 and X2_a.dtype == np.int64
+        # all the arrays are sliced by the same indices
+        np.testing.assert_array_equal(X2_a, y_a)
+        np.testing.assert_array_equal(X1_a[:, 0], 3 * y_a)
+
+
+def test_minibatches_of_dicts():
+    X = {'image': np.zeros((6, 2, 2), dtype=np.uint8), 'id': np.arange(6)}
+    y = {'label': np.arange(6) % 2, 'id': np.arange(6)}
+    for X_a, y_a in iterate.minibatches(X, y, batch_size=2, shuffle=True):
+        assert sorted(X_a) == ['id', 'image'] and sorted(y_a) == ['id', 'label']
+        assert X_a['image'].shape == (2, 2, 2)
+        np.testing.assert_array_equal(X_a['id'], y_a['id'])
+        np.testing.assert_array_equal(y_a['label'], y_a['id'] % 2)
+
+
+def test_minibatches_without_targets():
+    X = (np.arange(6), np.arange(6) * 2)
+    batches = list(iterate.minibatches(X, batch_size=2))
+    assert len(batches) == 3
+    np.testing.assert_array_equal(batches[1][0], [2, 3])
+    np.testing.assert_array_equal(batches[1][1], [4, 6])
+
+
+def test_class_balanced_minibatches():
+    X, y = np.arange(100), np.asarray([0] * 90 + [1] * 10)
+    labels = np.concatenate([y_a for _, y_a in iterate.class_balanced_minibatches(X, y, batch_size=100, n_batches=20, seed=0)])
+    assert len(labels) == 2000
+    assert 0.45 < labels.mean() < 0.55
+    for X_a, y_a in iterate.class_balanced_minibatches(X, y, batch_size=10, seed=0):
+        np.testing.assert_array_equal(y_a, y[X_a])
+    # the same seed draws the same batches
+    for (X_a, _), (X_b, _) in zip(
+            iterate.class_balanced_minibatches(X, y, batch_size=10, n_batches=3, seed=1),
+            iterate.class_balanced_minibatches(X, y, batch_size=10, n_batches=3, seed=1)):
+        np.testing.assert_array_equal(X_a, X_b)
+
+
+def test_class_balanced_minibatches_weights():
+    X, y = np.arange(9), np.asarray([0, 0, 0, 1, 1, 1, 2, 2, 2])
+    for _, y_a in iterate.class_balanced_minibatches(X, y, batch_size=10, n_batches=5, class_weights={0: 1, 1: 2}, seed=0):
+        assert 2 not in y_a
+    sample_weights = np.zeros(9)
+    sample_weights[[2, 7]] = 1
+    for X_a, _ in iterate.class_balanced_minibatches(X, y, batch_size=10, n_batches=5, sample_weights=sample_weights, seed=0):
+        assert set(X_a.tolist()) <= {2, 7}
+
+
+def test_class_balanced_minibatches_invalid_weights():
+    X, y = np.arange(4), np.asarray([0, 0, 1, 1])
+    invalid = [
+        dict(targets=y.reshape(2, 2), inputs=np.arange(2)),
+        dict(class_weights={0: -1, 1: 2}),
+        dict(class_weights={2: 1}),
+        dict(sample_weights=[1, -1, 1, 1]),
+        dict(sample_weights=[0, 0, 0, 0]),
+        dict(sample_weights=[1, 1, 1]),
+    ]
+    for kwargs in invalid:
+        kwargs = dict(dict(inputs=X, targets=y, batch_size=2, seed=0), **kwargs)
+        with pytest.raises(ValueError):
+            next(iterate.class_balanced_minibatches(**kwargs))
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_minibatches_shards_are_disjoint(shuffle):
+    y = np.arange(23)
+    shards = []
+    for shard_index in range(3):
+        batches = iterate.minibatches(y, y, batch_size=7, shuffle=shuffle, num_shards=3, shard_index=shard_index, seed=7)
+        shards.append(np.concatenate([y_a for _, y_a in batches]))
+    # every shard has 23 // 3 examples, the remaining ones are skipped
+    assert [len(shard) for shard in shards] == [7, 7, 7]
+    assert len(np.unique(np.concatenate(shards))) == 21
+
+
+def test_minibatches_shuffle_of_shards_depends_on_seed_and_epoch():
+    y = np.arange(100)
+
+    def shard_batches(epoch):
+        return [y_a.tolist() for _, y_a in iterate.minibatches(y, y, 10, shuffle=True, num_shards=2, shard_index=1, seed=3, epoch=epoch)]
+
+    assert shard_batches(0) == shard_batches(0)
+    assert shard_batches(0) != shard_batches(1)
+    with pytest.raises(ValueError):
+        list(iterate.minibatches(y, y, 10, shuffle=True, num_shards=2, shard_index=0))
+    with pytest.raises(ValueError):
+        list(iterate.minibatches(y, y, 10, num_shards=2, shard_index=2))
+
+
+def test_minibatch_iterator_matches_minibatches():
+    X, y = np.arange(30).reshape(15, 2), np.arange(15)
+    iterator = iterate.MinibatchIterator(X, y, batch_size=4)
+    assert len(iterator) == 3
+    for _ in range(2):  # the iterator is reusable
+        batches = list(iterator)
+        expected = list(iterate.minibatches(X, y, batch_size=4))
+        assert len(batches) == len(expected)
+        for (X_a, y_a), (X_e, y_e) in zip(batches, expected):
+            np.testing.assert_array_equal(X_a, X_e)
+            np.testing.assert_array_equal(y_a, y_e)
+    assert iterator.epoch == 2
+
+
+def test_minibatch_iterator_shuffles_like_minibatches_with_seed():
+    X, y = np.arange(30).reshape(15, 2), np.arange(15)
+    iterator = iterate.MinibatchIterator(X, y, batch_size=3, shuffle=True, num_shards=2, shard_index=1, seed=5)
+    for epoch in range(3):
+        # the batches are gathered into reused buffers, so they are copied
+        batches = [(X_a.copy(), y_a.copy()) for X_a, y_a in iterator]
+        expected = list(iterate.minibatches(X, y, 3, shuffle=True, num_shards=2, shard_index=1, seed=5, epoch=epoch))
+        assert len(batches) == len(expected) == 2
+        for (X_a, y_a), (X_e, y_e) in zip(batches, expected):
+            np.testing.assert_array_equal(X_a, X_e)
+            np.testing.assert_array_equal(y_a, y_e)
+            np.testing.assert_array_equal(X_a[:, 0] // 2, y_a)
+
+
+def test_minibatches_allow_smaller_final_batch():
+    X, y = np.arange(20).reshape(10, 2), np.arange(10)
+    assert [len(y_a) for _, y_a in iterate.minibatches(X, y, batch_size=4)] == [4, 4]
+    batches = list(iterate.minibatches(X, y, batch_size=4, allow_smaller_final_batch=True))
+    assert [len(y_a) for _, y_a in batches] == [4, 4, 2]
+    np.testing.assert_array_equal(np.concatenate([X_a for X_a, _ in batches]), X)
+    np.testing.assert_array_equal(np.concatenate([y_a for _, y_a in batches]), y)
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_minibatch_iterator_allow_smaller_final_batch(shuffle):
+    X, y = np.arange(20).reshape(10, 2), np.arange(10)
+    iterator = iterate.MinibatchIterator(X, y, batch_size=4, shuffle=shuffle, allow_smaller_final_batch=True)
+    assert len(iterator) == 3
+    batches = [(X_a.copy(), y_a.copy()) for X_a, y_a in iterator]
+    assert [len(y_a) for _, y_a in batches] == [4, 4, 2]
+    np.testing.assert_array_equal(np.sort(np.concatenate([y_a for _, y_a in batches])), y)
+    for X_a, y_a in batches:
+        np.testing.assert_array_equal(X_a[:, 0] // 2, y_a)
@@ -0,0 +1,75 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from tensorlayer._metrics import StreamingMetrics, evaluation
+
+
+def test_streaming_metrics_match_the_whole_dataset():
+    rnd = np.random.RandomState(0)
+    y_true, y_pred = rnd.randint(0, 4, 103), rnd.randint(0, 4, 103)
+    metrics = StreamingMetrics(n_classes=4)
+    for start in range(0, 103, 25):
+        metrics.update(y_true=y_true[start:start + 25], y_pred=y_pred[start:start + 25])
+    whole = StreamingMetrics(n_classes=4)
+    whole.update(y_true=y_true, y_pred=y_pred)
+    assert metrics.n_examples == 103
+    np.testing.assert_array_equal(metrics.confusion_matrix, whole.confusion_matrix)
+    assert metrics.confusion_matrix.sum() == 103
+    assert metrics.acc == pytest.approx(np.mean(y_true == y_pred))
+    np.testing.assert_allclose(metrics.f1, whole.f1)
+
+def test_streaming_metrics_weight_the_smaller_final_batch():
+    metrics = StreamingMetrics()
+    metrics.update(loss=1.0, acc=0.5, n_examples=100)
+    metrics.update(loss=4.0, acc=1.0, n_examples=10)
+    assert metrics.loss == pytest.approx((100 + 40) / 110.)
+    assert metrics.acc == pytest.approx((50 + 10) / 110.)
+    assert metrics.n_examples == 110
+
+def test_streaming_metrics_without_targets_count_one_example():
+    metrics = StreamingMetrics()
+    metrics.update(loss=2.0)
+    metrics.update(loss=4.0)
+    assert metrics.n_examples == 2
+    assert metrics.loss == pytest.approx(3.0)
+
+def test_streaming_metrics_merge():
+    a, b, both = StreamingMetrics(3), StreamingMetrics(3), StreamingMetrics(3)
+    a.update(y_true=[0, 1, 2], y_pred=[0, 1, 1], loss=1.0)
+    b.update(y_true=[2, 2], y_pred=[2, 0], loss=2.0)
+    both.update(y_true=[0, 1, 2], y_pred=[0, 1, 1], loss=1.0)
+    both.update(y_true=[2, 2], y_pred=[2, 0], loss=2.0)
+    a.merge(b)
+    np.testing.assert_array_equal(a.confusion_matrix, both.confusion_matrix)
+    assert a.loss == pytest.approx(both.loss)
+    assert a.acc == pytest.approx(0.6)
+    assert a.n_examples == 5
+
+def test_streaming_metrics_f1():
+    metrics = StreamingMetrics(3)
+    metrics.update(y_true=[0, 0, 1, 1], y_pred=[0, 1, 1, 1])
+    np.testing.assert_allclose(metrics.precision, [1., 2. / 3, 0.])
+    np.testing.assert_allclose(metrics.recall, [0.5, 1., 0.])
+    np.testing.assert_allclose(metrics.f1, [2. / 3, 0.8, 0.])
+    # the class 2 never appears, it is left out of the macro F1-score
+    assert metrics.f1_macro == pytest.approx((2. / 3 + 0.8) / 2)
+
+def test_evaluation_ignores_out_of_range_labels():
+    y_test, y_predict = np.array([0, 1, 2, 5, 1]), np.array([0, 1, 1, 5, 7])
+    c_mat, f1, acc, f1_macro = evaluation(y_test, y_predict, n_classes=3)
+    np.testing.assert_array_equal(c_mat, [[1, 0, 0], [0, 1, 0], [0, 1, 0]])
+    assert acc == pytest.approx(0.6)
+    assert len(f1) == 3
+
+def test_evaluation_matches_sklearn():
+    metrics = pytest.importorskip('sklearn.metrics')
+    rnd = np.random.RandomState(1)
+    y_test, y_predict = rnd.randint(0, 5, 200), rnd.randint(0, 5, 200)
+    c_mat, f1, acc, f1_macro = evaluation(y_test, y_predict, n_classes=5)
+    np.testing.assert_array_equal(c_mat, metrics.confusion_matrix(y_test, y_predict, labels=list(range(5))))
+    np.testing.assert_allclose(f1, metrics.f1_score(y_test, y_predict, average=None, labels=list(range(5))))
+    assert acc == pytest.approx(metrics.accuracy_score(y_test, y_predict))
+    assert f1_macro == pytest.approx(metrics.f1_score(y_test, y_predict, average='macro'))